@@ -0,0 +1,45 @@
+"""Size and speed of the grant data codecs:
+
+    python benchmarks/codec.py --count=100000
+"""
+import json
+import os
+import sys
+import timeit
+
+from tornado.options import define, options, parse_command_line
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from toroauth2.codec import CompactCodec, JSONCodec
+
+define('count', default=100000, type=int, help='iterations per measure')
+
+GRANT = {
+    'client_id': 'bench-client',
+    'scope': 'profile email',
+    'user_id': '51e8a6c3b7f5f1a9c2d4e6f8',
+    'exp': 1792317712,
+}
+
+
+def main():
+    for codec in (JSONCodec(), CompactCodec()):
+        # Values come back from Redis decoded, as unicode
+        stored = codec.encode(GRANT)
+        if isinstance(stored, str):
+            stored = stored.decode('utf-8')
+        assert codec.decode(stored) == GRANT
+        encode = timeit.timeit(lambda: codec.encode(GRANT), number=options.count)
+        decode = timeit.timeit(lambda: codec.decode(stored), number=options.count)
+        print json.dumps({
+            'codec': type(codec).__name__,
+            'bytes': len(stored.encode('utf-8')),
+            'encode_us': round(encode / options.count * 1e6, 3),
+            'decode_us': round(decode / options.count * 1e6, 3),
+        }, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parse_command_line()
+    main()
@@ -0,0 +1,355 @@
+"""Load test of /oauth/auth, /oauth/token and bearer token validation.
+
+Boots provider_server.application in-process against the stand-ins of
+benchmarks/standins.py, or with --store=memory against an in-process
+toroauth2.store.MemoryTokenStore, or with --shards=N against a
+ShardedRedisTokenStore over N Redis stand-ins, and drives a weighted mix
+of operations from --concurrency concurrent clients:
+
+    authorize   GET /oauth/auth, answered with a redirect carrying a code
+    exchange    POST /oauth/token with grant_type=authorization_code
+    refresh     POST /oauth/token with grant_type=refresh_token
+    validate    GET /bench/resource with a bearer token
+    introspect  POST /oauth/introspect with --introspect_batch tokens
+    client_credentials
+                POST /oauth/token with grant_type=client_credentials
+
+With --serve it only runs provider_server, so that another run can load
+test it with --url, see benchmarks/workers.py.
+
+Each run prints one JSON document with throughput and p50/p95/p99
+latencies per operation, so runs of different commits can be diffed:
+
+    python benchmarks/load.py --requests=20000 --concurrency=64 \\
+        --mix=authorize:1,exchange:1,refresh:2,validate:8 > before.json
+"""
+import collections
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib
+import urlparse
+
+import tornado.gen as gen
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.options import define, options, parse_command_line
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import provider
+import provider_server
+from standins import SCRIPTS, StandInDatabase, StandInRedisPool
+from toroauth2.store import (MemoryTokenStore, RedisTokenStore,
+                             ShardedRedisTokenStore)
+
+define('requests', default=5000, type=int, help='operations to run')
+define('concurrency', default=32, type=int, help='concurrent clients')
+define('mix', default='authorize:1,exchange:1,refresh:2,validate:8',
+       help='operation:weight pairs')
+define('backend_latency', default=0.0, type=float,
+       help='seconds added to every Mongo and Redis reply')
+define('introspect_batch', default=50, type=int,
+       help='tokens per introspect operation')
+define('seed', default=1, type=int, help='random seed of the operation mix')
+define('store', default='redis', help='token store: redis or memory')
+define('shards', default=1, type=int,
+       help='Redis stand-ins the redis store is sharded over')
+define('clients', default=1, type=int, help='client applications')
+define('standins', default=True, type=bool,
+       help='use the stand-ins instead of the Redis and Mongo of provider.py')
+define('url', default='',
+       help='load test the server at this URL instead of an in-process one')
+define('preload', default=False, type=bool,
+       help='load the applications in memory before the test')
+define('rate_limit', default=False, type=bool,
+       help='apply the client rate limit of provider.py')
+define('serve', default=False, type=bool,
+       help='only run provider_server, see its --port and --workers')
+
+
+def make_clients(count):
+    return [{
+        'app_key': 'bench-client-%d' % i if i else 'bench-client',
+        'app_secret': 'bench-secret',
+        'redirect_uri': 'http://localhost/callback',
+        'scope': '',
+    } for i in xrange(count)]
+
+
+class ResourceHandler(tornado.web.RequestHandler):
+    """Bearer token check, as done by a resource server."""
+
+    @tornado.web.asynchronous
+    @gen.engine
+    def get(self):
+        header = self.request.headers.get('Authorization', '').split()
+        data = None
+        if len(header) == 2 and header[0] == 'Bearer':
+            data = yield gen.Task(provider.token_store.get_access_token,
+                                  header[1])
+        if data is None:
+            self.set_status(401)
+        self.finish()
+
+
+class LoadTest(object):
+
+    def __init__(self, base_url, mix, total, concurrency, clients):
+        self.base_url = base_url
+        self.clients = clients
+        self.operations = []
+        for name, weight in mix:
+            self.operations.extend([name] * weight)
+        self.total = total
+        self.concurrency = concurrency
+        self.started = 0
+        # Operations outside of the mix run too, e.g. exchange to get a
+        # token for the first validate
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.defaultdict(int)
+        self.codes = []
+        self.access_tokens = []
+        self.refresh_tokens = []
+        self.http = AsyncHTTPClient(max_clients=concurrency)
+
+    @gen.engine
+    def fetch(self, name, path, callback=None, **kwargs):
+        start = time.time()
+        response = yield gen.Task(self.http.fetch, self.base_url + path,
+                                  follow_redirects=False, **kwargs)
+        self.latencies[name].append(time.time() - start)
+        callback(response)
+
+    @gen.engine
+    def authorize(self, callback=None):
+        client = random.choice(self.clients)
+        query = urllib.urlencode({'response_type': 'code',
+                                  'client_id': client['app_key'],
+                                  'redirect_uri': client['redirect_uri']})
+        response = yield gen.Task(self.fetch, 'authorize', '/oauth/auth?' + query)
+        location = response.headers.get('Location', '')
+        code = urlparse.parse_qs(urlparse.urlparse(location).query).get('code')
+        if response.code == 302 and code:
+            self.codes.append((client, code[0]))
+        else:
+            self.errors['authorize'] += 1
+        callback()
+
+    @gen.engine
+    def post_token(self, name, client, params, callback=None):
+        params.update(client_id=client['app_key'],
+                      client_secret=client['app_secret'])
+        response = yield gen.Task(self.fetch, name, '/oauth/token',
+                                  method='POST', body=urllib.urlencode(params))
+        try:
+            result = json.loads(response.body)
+        except (TypeError, ValueError):
+            result = {}
+        if response.code == 200 and 'access_token' in result:
+            self.access_tokens.append(result['access_token'])
+            if 'refresh_token' in result:
+                self.refresh_tokens.append((client, result['refresh_token']))
+        else:
+            self.errors[name] += 1
+        callback()
+
+    @gen.engine
+    def exchange(self, callback=None):
+        if not self.codes:
+            yield gen.Task(self.authorize)
+        if self.codes:
+            client, code = self.codes.pop()
+            yield gen.Task(self.post_token, 'exchange', client, {
+                'grant_type': 'authorization_code',
+                'redirect_uri': client['redirect_uri'],
+                'code': code})
+        callback()
+
+    @gen.engine
+    def refresh(self, callback=None):
+        if not self.refresh_tokens:
+            yield gen.Task(self.exchange)
+        if self.refresh_tokens:
+            client, refresh_token = self.refresh_tokens.pop(
+                random.randrange(len(self.refresh_tokens)))
+            yield gen.Task(self.post_token, 'refresh', client, {
+                'grant_type': 'refresh_token',
+                'refresh_token': refresh_token})
+        callback()
+
+    @gen.engine
+    def client_credentials(self, callback=None):
+        yield gen.Task(self.post_token, 'client_credentials',
+                       random.choice(self.clients),
+                       {'grant_type': 'client_credentials'})
+        callback()
+
+    @gen.engine
+    def validate(self, callback=None):
+        if not self.access_tokens:
+            yield gen.Task(self.exchange)
+        if self.access_tokens:
+            token = random.choice(self.access_tokens[-1000:])
+            response = yield gen.Task(self.fetch, 'validate', '/bench/resource',
+                                      headers={'Authorization': 'Bearer ' + token})
+            if response.code != 200:
+                self.errors['validate'] += 1
+        callback()
+
+    @gen.engine
+    def introspect(self, callback=None):
+        if not self.access_tokens:
+            yield gen.Task(self.exchange)
+        if self.access_tokens:
+            client = self.clients[0]
+            tokens = random.sample(self.access_tokens[-1000:], min(
+                options.introspect_batch, len(self.access_tokens[-1000:])))
+            response = yield gen.Task(
+                self.fetch, 'introspect', '/oauth/introspect', method='POST',
+                body=urllib.urlencode({'client_id': client['app_key'],
+                                       'client_secret': client['app_secret'],
+                                       'tokens': ' '.join(tokens)}))
+            try:
+                result = json.loads(response.body)['tokens']
+            except (TypeError, ValueError, KeyError):
+                result = []
+            if len(result) != len(tokens) or \
+                    not all(token['active'] for token in result):
+                self.errors['introspect'] += 1
+        callback()
+
+    @gen.engine
+    def client(self, callback=None):
+        while self.started < self.total:
+            self.started += 1
+            yield gen.Task(getattr(self, random.choice(self.operations)))
+        callback()
+
+    @gen.engine
+    def run(self, callback=None):
+        start = time.time()
+        yield [gen.Task(self.client) for i in xrange(self.concurrency)]
+        callback(time.time() - start)
+
+    def report(self, elapsed):
+        endpoints = {}
+        for name, samples in self.latencies.items():
+            samples.sort()
+            if not samples:
+                continue
+            pick = lambda p: round(samples[min(len(samples) - 1,
+                                               int(len(samples) * p))] * 1000, 3)
+            endpoints[name] = {
+                'count': len(samples),
+                'errors': self.errors[name],
+                'throughput_rps': round(len(samples) / elapsed, 1),
+                'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+                'p50_ms': pick(0.50),
+                'p95_ms': pick(0.95),
+                'p99_ms': pick(0.99),
+            }
+        count = sum(len(samples) for samples in self.latencies.values())
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(count / elapsed, 1),
+            'endpoints': endpoints,
+        }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def install_standins(clients):
+    provider.db = StandInDatabase(clients, latency=options.backend_latency)
+    provider.redis_pool = StandInRedisPool(
+        latency=options.backend_latency,
+        scripts=SCRIPTS)
+    if options.store == 'memory':
+        provider.token_store = MemoryTokenStore()
+    elif options.shards > 1:
+        provider.token_store = ShardedRedisTokenStore(dict(
+            ('shard%d' % i, StandInRedisPool(
+                latency=options.backend_latency,
+                scripts=SCRIPTS))
+            for i in xrange(options.shards)))
+    else:
+        provider.token_store = RedisTokenStore(provider.redis_pool)
+
+
+def prepare_application(clients):
+    if options.standins:
+        install_standins(clients)
+    if not options.rate_limit:
+        provider.client_rate_limiter = None
+    application = provider_server.application
+    application.add_handlers(r'.*$', [(r'/bench/resource', ResourceHandler)])
+    return application
+
+
+@gen.engine
+def main():
+    random.seed(options.seed)
+    clients = make_clients(options.clients)
+
+    server = None
+    base_url = options.url.rstrip('/')
+    if not base_url:
+        sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+        server = tornado.httpserver.HTTPServer(prepare_application(clients))
+        server.add_sockets(sockets)
+        base_url = 'http://127.0.0.1:%d' % sockets[0].getsockname()[1]
+        if options.preload:
+            yield gen.Task(provider.start_application_registry)
+
+    mix = [(name, int(weight)) for name, weight in
+           (pair.split(':') for pair in options.mix.split(','))]
+    test = LoadTest(base_url, mix, options.requests, options.concurrency,
+                    clients)
+    elapsed = yield gen.Task(test.run)
+
+    result = test.report(elapsed)
+    result.update({
+        'revision': git_revision(),
+        'requests': options.requests,
+        'concurrency': options.concurrency,
+        'mix': options.mix,
+        'backend_latency': options.backend_latency,
+        'store': options.store,
+        'shards': options.shards,
+        'clients': options.clients,
+        'preload': options.preload,
+    })
+    pools = getattr(provider.token_store, 'pools', None)
+    if pools and server is not None:
+        result['shard_keys'] = dict((name, pool.stats()['keys'])
+                                    for name, pool in pools.items())
+    print json.dumps(result, indent=2, sort_keys=True)
+
+    if server is not None:
+        server.stop()
+    tornado.ioloop.IOLoop.instance().stop()
+
+
+if __name__ == '__main__':
+    parse_command_line()
+    if options.serve:
+        prepare_application(make_clients(options.clients))
+        provider_server.PRELOAD_APPLICATIONS = options.preload
+        provider_server.main()
+    else:
+        tornado.ioloop.IOLoop.instance().add_callback(main)
+        tornado.ioloop.IOLoop.instance().start()
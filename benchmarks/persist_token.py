@@ -0,0 +1,105 @@
+"""Compare per-issuance latency of the token write strategies.
+
+"sequential" awaits setex, set and sadd one after the other, the way
+persist_token_information used to. "eval" runs the SAVE_TOKENS script
+of toroauth2.store with EVAL, sending its source every time. "evalsha"
+runs RedisTokenStore.save_tokens, which sends SAVE_TOKENS by its digest
+through a RedisPool. Needs a Redis server:
+
+    python benchmarks/persist_token.py --redis_port=6379 --count=5000
+"""
+import json
+import os
+import sys
+import time
+
+import tornado.gen as gen
+import tornado.ioloop
+import tornadoredis
+from tornado.options import define, options, parse_command_line
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from toroauth2.pool import RedisPool
+from toroauth2.store import RedisTokenStore, SAVE_TOKENS
+
+define('redis_host', default='localhost')
+define('redis_port', default=6379, type=int)
+define('count', default=2000, type=int, help='issuances per strategy')
+
+CLIENT_ID = 'bench'
+DATA = {'client_id': CLIENT_ID, 'scope': '', 'user_id': None}
+VALUE = json.dumps(DATA)
+
+
+def keys(store, i):
+    return [store.access_token_key % ('bench%d' % i),
+            store.refresh_token_key % (CLIENT_ID, 'bench%d' % i),
+            store.client_user_key % (CLIENT_ID, None)]
+
+
+@gen.engine
+def sequential(r, store, i, callback=None):
+    access_key, refresh_key, key = keys(store, i)
+    yield gen.Task(r.setex, access_key, 3600, VALUE)
+    yield gen.Task(r.set, refresh_key, VALUE)
+    yield gen.Task(r.sadd, key, access_key, refresh_key)
+    callback()
+
+
+@gen.engine
+def eval_script(r, store, i, callback=None):
+    yield gen.Task(r.eval, SAVE_TOKENS, keys(store, i),
+                   store._script_args(3600, DATA, None))
+    callback()
+
+
+@gen.engine
+def evalsha(r, store, i, callback=None):
+    yield gen.Task(store.save_tokens, CLIENT_ID, 'bench%d' % i, 3600,
+                   'bench%d' % i, DATA)
+    callback()
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+@gen.engine
+def main():
+    r = tornadoredis.Client(host=options.redis_host, port=options.redis_port)
+    r.connect()
+    store = RedisTokenStore(RedisPool(host=options.redis_host,
+                                      port=options.redis_port))
+
+    # sequential writes a set where the scripts write a sorted set
+    for name, strategy in (('sequential', sequential), ('eval', eval_script),
+                           ('evalsha', evalsha)):
+        samples = []
+        for i in xrange(options.count):
+            start = time.time()
+            yield gen.Task(strategy, r, store, i)
+            samples.append((time.time() - start) * 1000.0)
+        samples.sort()
+        print json.dumps({
+            'strategy': name,
+            'count': options.count,
+            'mean_ms': round(sum(samples) / len(samples), 4),
+            'p50_ms': round(percentile(samples, 0.50), 4),
+            'p99_ms': round(percentile(samples, 0.99), 4),
+        })
+
+        # Clean up, refresh keys never expire on their own
+        with r.pipeline() as pipe:
+            for i in xrange(options.count):
+                pipe.delete(*keys(store, i))
+            yield gen.Task(pipe.execute)
+
+    store.pool.close()
+    tornado.ioloop.IOLoop.instance().stop()
+
+
+if __name__ == '__main__':
+    parse_command_line()
+    tornado.ioloop.IOLoop.instance().add_callback(main)
+    tornado.ioloop.IOLoop.instance().start()
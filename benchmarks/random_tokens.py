@@ -0,0 +1,56 @@
+"""Micro-benchmark of random token generation.
+
+Compares the former one-CSPRNG-call-per-character generator with
+utils.random_ascii_string and with tokens handed out by utils.TokenPool:
+
+    python benchmarks/random_tokens.py --count=100000
+"""
+import json
+import os
+import sys
+import timeit
+
+from tornado.options import define, options, parse_command_line
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from toroauth2 import utils
+
+define('count', default=20000, type=int, help='tokens per generator')
+define('length', default=40, type=int, help='token length')
+
+
+def per_character(length):
+    from Crypto.Random import random
+    return ''.join([random.choice(utils.UNICODE_ASCII_CHARACTERS)
+                    for x in xrange(length)])
+
+
+def main():
+    pool = utils.TokenPool(options.length, size=options.count)
+    pool.refill()
+
+    generators = [
+        ('random_ascii_string', lambda: utils.random_ascii_string(options.length)),
+        # The pool refills from the IOLoop, outside of the measured calls
+        ('token_pool', pool.get),
+    ]
+    try:
+        import Crypto.Random
+        generators.insert(0, ('per_character', lambda: per_character(options.length)))
+    except ImportError:
+        pass
+
+    for name, generate in generators:
+        seconds = timeit.timeit(generate, number=options.count)
+        print json.dumps({
+            'generator': name,
+            'count': options.count,
+            'length': options.length,
+            'us_per_token': round(seconds / options.count * 1e6, 3),
+        })
+
+
+if __name__ == '__main__':
+    parse_command_line()
+    main()
@@ -0,0 +1,105 @@
+"""Checks of the scope of refreshed grants.
+
+Issues a grant of scope "read write" to a client allowed "profile read
+write", through a RedisTokenStore over a Redis stand-in and through a
+MemoryTokenStore, then refreshes it with narrower, equal and wider
+scopes. RFC 6749 section 6 allows a refresh to ask for any subset of the
+granted scope:
+
+    python benchmarks/refresh_scope.py
+
+Prints the status, error and access token scope of every refresh, and
+exits with status 1 when one of them is not the expected one.
+"""
+import json
+import os
+import sys
+
+import tornado.gen as gen
+from tornado.ioloop import IOLoop
+from tornado.options import parse_command_line
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import provider
+from standins import SCRIPTS, StandInDatabase, StandInRedisPool
+from toroauth2.store import MemoryTokenStore, RedisTokenStore
+
+CLIENT = {
+    'app_key': 'scope-client',
+    'app_secret': 'scope-secret',
+    'redirect_uri': 'http://localhost/callback',
+    'scope': 'profile read write',
+}
+GRANTED = 'read write'
+
+# Requested scope, expected error and expected scope of the new token.
+# Every refresh starts from a new grant of GRANTED.
+CASES = [
+    ('', None, 'read write'),
+    ('read', None, 'read'),
+    ('write', None, 'write'),
+    ('write read', None, 'read write'),
+    ('profile', 'invalid_grant', None),
+    ('read profile', 'invalid_grant', None),
+    ('admin', 'invalid_scope', None),
+]
+
+
+@gen.engine
+def refresh(oauth, store, index, scope, callback=None):
+    """Refresh a new grant of GRANTED with scope.
+
+    :rtype: (error, scope of the new access token) pair
+    """
+    client_id = CLIENT['app_key']
+    refresh_token = 'refresh%d' % index
+    data = {'client_id': client_id, 'user_id': 'user', 'scope': GRANTED}
+    yield gen.Task(store.save_tokens, client_id, 'access%d' % index, 3600,
+                   refresh_token, data, 86400)
+    response = yield gen.Task(oauth.refresh_token, 'refresh_token',
+                              client_id, CLIENT['app_secret'],
+                              refresh_token, scope=scope)
+    if response.error is not None:
+        callback((response.error, None))
+        return
+    data = yield gen.Task(store.get_access_token,
+                          response.json['access_token'])
+    callback((None, data and data.get('scope')))
+
+
+@gen.engine
+def check_store(store, callback=None):
+    provider.token_store = store
+    oauth = provider.Toroauth2AuthorizationProvider()
+    results = {}
+    for index, (scope, error, expected) in enumerate(CASES):
+        result = yield gen.Task(refresh, oauth, store, index, scope)
+        results[scope or '(none)'] = {
+            'error': result[0],
+            'scope': result[1],
+            'ok': result == (error, expected),
+        }
+    callback(results)
+
+
+@gen.engine
+def main():
+    provider.db = StandInDatabase([CLIENT])
+    provider.client_rate_limiter = None
+    report = {}
+    report['redis'] = yield gen.Task(check_store, RedisTokenStore(
+        StandInRedisPool(scripts=SCRIPTS)))
+    report['memory'] = yield gen.Task(check_store, MemoryTokenStore())
+    print json.dumps(report, sort_keys=True)
+    IOLoop.instance().stop()
+    if not all(result['ok'] for results in report.values()
+               for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parse_command_line()
+    IOLoop.instance().add_callback(main)
+    IOLoop.instance().start()
@@ -0,0 +1,168 @@
+"""Distribution of clients over the shards of ShardedRedisTokenStore.
+
+Reports how evenly --clients client ids spread over --shards shards and
+which share of them moves when one shard is added:
+
+    python benchmarks/sharding.py --clients=100000 --shards=4
+
+Then issues a grant for each of --grants clients through a
+ShardedRedisTokenStore over --shards Redis stand-ins, and checks that
+the keys of every grant are on the shard of their client, that access
+tokens are found from their {tag} prefix alone, and that adding a shard
+only moves the grants of about 1 / (shards + 1) of the clients. Exits
+with status 1 when a check fails.
+"""
+import json
+import os
+import re
+import sys
+
+import tornado.gen as gen
+from tornado.ioloop import IOLoop
+from tornado.options import define, options, parse_command_line
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from standins import SCRIPTS, StandInRedisPool
+from toroauth2.hashring import HashRing
+from toroauth2.store import ShardedRedisTokenStore, client_tag
+
+define('clients', default=20000, type=int, help='client ids to place')
+define('shards', default=4, type=int, help='shards before adding one')
+define('replicas', default=160, type=int, help='ring points per shard')
+define('grants', default=2000, type=int,
+       help='grants issued through the sharded store')
+
+_TAG = re.compile(r'\{([^}]*)\}')
+
+
+def place(ring, tags):
+    return [ring.get_node(tag) for tag in tags]
+
+
+def distribution():
+    tags = [client_tag('client-%d' % i) for i in xrange(options.clients)]
+    shards = ['shard%d' % i for i in xrange(options.shards)]
+    ring = HashRing(shards, options.replicas)
+    before = place(ring, tags)
+
+    ring.add_node('shard%d' % options.shards)
+    after = place(ring, tags)
+
+    counts = dict((shard, 0) for shard in shards)
+    for shard in before:
+        counts[shard] += 1
+    mean = float(options.clients) / options.shards
+    moved = sum(1 for a, b in zip(before, after) if a != b)
+
+    return {
+        'clients': options.clients,
+        'shards': options.shards,
+        'replicas': options.replicas,
+        'max_over_mean': round(max(counts.values()) / mean, 3),
+        'min_over_mean': round(min(counts.values()) / mean, 3),
+        'moved_on_add': round(float(moved) / options.clients, 4),
+        'ideal_moved_on_add': round(1.0 / (options.shards + 1), 4),
+    }
+
+
+def shard_tags(pools):
+    """Return the shards holding keys of every tag."""
+    tags = {}
+    for name, pool in pools.items():
+        for key in pool.data:
+            match = _TAG.match(key)
+            tags.setdefault(match.group(1) if match else None,
+                            set()).add(name)
+    return tags
+
+
+@gen.engine
+def issue(store, count, callback=None):
+    """Issue a code and a token pair for each of count clients.
+
+    :rtype: list of (client id, access token) pairs
+    """
+    grants = []
+    for i in xrange(count):
+        client_id = 'client-%d' % i
+        access_token = store.access_token_prefix(client_id) + 'access%d' % i
+        data = {'client_id': client_id, 'user_id': 'user-%d' % i, 'scope': ''}
+        yield gen.Task(store.save_authorization_code, client_id, 'code%d' % i,
+                       data, 600)
+        yield gen.Task(store.save_tokens, client_id, access_token, 3600,
+                       'refresh%d' % i, data, 86400)
+        grants.append((client_id, access_token))
+    callback(grants)
+
+
+@gen.engine
+def found(store, grants, callback=None):
+    """Return the clients whose access token is read back."""
+    clients = set()
+    for client_id, access_token in grants:
+        data = yield gen.Task(store.get_access_token, access_token)
+        if data is not None and data.get('client_id') == client_id:
+            clients.add(client_id)
+    callback(clients)
+
+
+@gen.engine
+def check_store(callback=None):
+    pools = dict(('shard%d' % i, StandInRedisPool(scripts=SCRIPTS))
+                 for i in xrange(options.shards))
+    store = ShardedRedisTokenStore(pools, options.replicas)
+    grants = yield gen.Task(issue, store, options.grants)
+
+    # Every key carries the tag of its client and sits on its shard
+    tags = shard_tags(pools)
+    colocated = None not in tags and all(
+        shards == set([store.ring.get_node(tag)])
+        for tag, shards in tags.iteritems())
+
+    # Access tokens are routed without their client id
+    before = yield gen.Task(found, store, grants)
+
+    new_shard = 'shard%d' % options.shards
+    routes = dict((client_id, store.ring.get_node(client_tag(client_id)))
+                  for client_id, access_token in grants)
+    store.add_shard(new_shard, StandInRedisPool(scripts=SCRIPTS))
+    moved = set(client_id for client_id, shard in routes.iteritems()
+                if store.ring.get_node(client_tag(client_id)) != shard)
+    after = yield gen.Task(found, store, grants)
+
+    ideal = 1.0 / (options.shards + 1)
+    moved_share = float(len(moved)) / options.grants
+    result = {
+        'grants': options.grants,
+        'keys': sum(len(pool.data) for pool in pools.values()),
+        'grant_keys_colocated': colocated,
+        'access_tokens_routed': len(before) == options.grants,
+        'add_moved': round(moved_share, 4),
+        # Grants of the moved clients stay behind on their former shard
+        'add_moved_only_new_shard': all(
+            store.ring.get_node(client_tag(client_id)) == new_shard
+            for client_id in moved),
+        'add_kept_others': after == before - moved,
+    }
+    # Tolerance of the ring's variance on a few thousand clients
+    result['add_moved_near_ideal'] = abs(moved_share - ideal) < ideal / 2
+    callback(result)
+
+
+@gen.engine
+def main():
+    report = distribution()
+    report['store'] = yield gen.Task(check_store)
+    print json.dumps(report, sort_keys=True)
+    IOLoop.instance().stop()
+    if not all(value for value in report['store'].values()
+               if isinstance(value, bool)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parse_command_line()
+    IOLoop.instance().add_callback(main)
+    IOLoop.instance().start()
@@ -0,0 +1,390 @@
+"""In-process stand-ins for Mongo and Redis used by the benchmarks.
+
+They answer on a later IOLoop iteration, optionally after a fixed
+latency, so the provider code runs the same asynchronous paths it runs
+against the real servers, without their variance.
+"""
+import re
+import time
+import zlib
+
+from tornado.ioloop import IOLoop
+from tornadoredis.exceptions import ResponseError
+
+from toroauth2.pool import RedisPool, script_digest
+from toroauth2.store import (DELETE_INDEXED_TOKENS, GET_CLIENT_TOKEN,
+                             ROTATE_REFRESH_TOKEN, SAVE_CLIENT_TOKEN,
+                             SAVE_TOKENS, UPDATE_DEVICE_CODE)
+
+
+def match_spec(document, spec):
+    """Whether document matches a query of equalities, $gt, $gte,
+    $exists and $or, the operators the provider uses."""
+    for field, condition in spec.items():
+        if field == '$or':
+            if not any(match_spec(document, alternative)
+                       for alternative in condition):
+                return False
+            continue
+        value = document.get(field)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for operator, operand in condition.items():
+            if operator == '$exists':
+                matched = (field in document) == operand
+            elif operator == '$gt':
+                matched = value is not None and value > operand
+            elif operator == '$gte':
+                matched = value is not None and value >= operand
+            else:
+                raise ValueError('Unsupported operator %s' % operator)
+            if not matched:
+                return False
+    return True
+
+
+class StandInCollection(object):
+    """Answers find_one/find like a mongotor collection."""
+
+    def __init__(self, documents, key, latency=0):
+        self.documents = dict((doc[key], dict(doc, _id=i))
+                              for i, doc in enumerate(documents))
+        self.key = key
+        self.latency = latency
+        self.queries = 0
+
+    def _reply(self, callback, result):
+        self.queries += 1
+        if self.latency:
+            IOLoop.current().add_timeout(time.time() + self.latency,
+                                         lambda: callback(result))
+        else:
+            IOLoop.current().add_callback(lambda: callback(result))
+
+    def find_one(self, spec, callback=None, **kwargs):
+        # mongotor answers an empty list when nothing matched
+        self._reply(callback, (self.documents.get(spec.get(self.key)) or [], None))
+
+    def find(self, spec=None, callback=None, sort=None, limit=0, **kwargs):
+        documents = [doc for doc in self.documents.values()
+                     if match_spec(doc, spec or {})]
+        if sort:
+            # Ascending sorts only
+            documents.sort(key=lambda doc: [doc.get(field)
+                                            for field in sort.keys()])
+        if limit:
+            documents = documents[:limit]
+        self._reply(callback, (documents, None))
+
+
+class StandInDatabase(object):
+
+    def __init__(self, applications, latency=0):
+        self.application = StandInCollection(applications, 'app_key', latency)
+
+
+def match_pattern(pattern):
+    """Compile a Redis glob-style pattern made of literals, backslash
+    escapes, * and ?."""
+    regex = []
+    chars = iter(pattern)
+    for char in chars:
+        if char == '\\':
+            regex.append(re.escape(next(chars, '\\')))
+        elif char == '*':
+            regex.append('.*')
+        elif char == '?':
+            regex.append('.')
+        else:
+            regex.append(re.escape(char))
+    return re.compile(''.join(regex) + r'\Z', re.DOTALL)
+
+
+class StandInRedisPool(object):
+    """Answers the execute/pipeline/execute_script calls of
+    toroauth2.pool.RedisPool.
+
+    Lua scripts are not interpreted; pass Python equivalents in scripts,
+    keyed by the script source, as fn(pool, keys, args), e.g.
+    :data:`SCRIPTS`.
+    """
+
+    def __init__(self, latency=0, scripts=None):
+        self.latency = latency
+        self.scripts = scripts or {}
+        self.data = {}
+        self.expires = {}
+        self.subscribers = {}
+        self.digests = dict((script_digest(script), script)
+                            for script in self.scripts)
+        # Digests of the scripts run with EVAL, as cached by Redis
+        self.loaded = set()
+        self.round_trips = 0
+
+    def _reply(self, callback, result):
+        self.round_trips += 1
+        if callback is None:
+            return
+        if self.latency:
+            IOLoop.current().add_timeout(time.time() + self.latency,
+                                         lambda: callback(result))
+        else:
+            IOLoop.current().add_callback(lambda: callback(result))
+
+    def _get(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key, None)
+            del self.expires[key]
+        return self.data.get(key)
+
+    def _set(self, key, value, ttl=None):
+        self.data[key] = value
+        if ttl is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = time.time() + int(ttl)
+        return True
+
+    def _run(self, command, *args, **kwargs):
+        return getattr(self, 'command_' + command)(*args, **kwargs)
+
+    def execute(self, command, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        self._reply(callback, self._run(command, *args, **kwargs))
+
+    def pipeline(self, commands, transactional=False, callback=None):
+        self._reply(callback, [self._run(*command) for command in commands])
+
+    # Same EVALSHA and NOSCRIPT fallback as the real pool
+    execute_script = RedisPool.execute_script.im_func
+    execute_scripts = RedisPool.execute_scripts.im_func
+
+    def subscribe(self, channel, callback):
+        self.subscribers.setdefault(channel, []).append(callback)
+
+    def stats(self):
+        return {'keys': len(self.data), 'round_trips': self.round_trips}
+
+    def command_get(self, key):
+        return self._get(key)
+
+    def command_mget(self, keys):
+        return [self._get(key) for key in keys]
+
+    def command_set(self, key, value, expire=None, only_if_not_exists=False):
+        if only_if_not_exists and self._get(key) is not None:
+            return None
+        return self._set(key, value, expire)
+
+    def command_setex(self, key, ttl, value):
+        return self._set(key, value, ttl)
+
+    def command_delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self._get(key) is not None:
+                deleted += 1
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return deleted
+
+    def command_expire(self, key, ttl):
+        if self._get(key) is None:
+            return False
+        self.expires[key] = time.time() + int(ttl)
+        return True
+
+    def command_persist(self, key):
+        if self._get(key) is None:
+            return False
+        return self.expires.pop(key, None) is not None
+
+    def command_sadd(self, key, *members):
+        members = set(members)
+        current = self.data.setdefault(key, set())
+        added = len(members - current)
+        current.update(members)
+        return added
+
+    def command_srem(self, key, *members):
+        current = self.data.get(key, set())
+        removed = len(current & set(members))
+        current.difference_update(members)
+        return removed
+
+    def command_smembers(self, key):
+        return set(self._get(key) or ())
+
+    def command_zadd(self, key, *scores_members):
+        current = self.data.setdefault(key, {})
+        for i in xrange(0, len(scores_members), 2):
+            current[scores_members[i + 1]] = float(scores_members[i])
+        return len(scores_members) // 2
+
+    def command_zrem(self, key, *members):
+        current = self.data.get(key, {})
+        return len([current.pop(m) for m in members if m in current])
+
+    def command_zrangebyscore(self, key, start, end, offset=None, limit=None,
+                              with_scores=False):
+        start, end = float(start), float(end)
+        entries = sorted((score, member) for member, score in
+                         (self._get(key) or {}).items()
+                         if start <= score <= end)
+        if offset is not None:
+            entries = entries[offset:offset + limit]
+        if with_scores:
+            return [(member, score) for score, member in entries]
+        return [member for score, member in entries]
+
+    def command_zcount(self, key, start, end):
+        start, end = float(start), float(end)
+        return len([score for score in (self._get(key) or {}).values()
+                    if start <= score <= end])
+
+    def command_zremrangebyscore(self, key, start, end):
+        start, end = float(start), float(end)
+        current = self._get(key) or {}
+        dead = [m for m, score in current.items() if start <= score <= end]
+        for member in dead:
+            del current[member]
+        if not current:
+            self.command_delete(key)
+        return len(dead)
+
+    def command_scan(self, cursor, count=None, match=None):
+        # Walk the keys in hash order like Redis, so that deleting keys
+        # during a scan does not make it skip others
+        cursor, count = int(cursor), count or 10
+        slots = {}
+        for key in self.data:
+            slot = zlib.crc32(key.encode('utf-8')) & 0xffff
+            slots.setdefault(slot, []).append(key)
+        keys = []
+        next_cursor = 0
+        for slot in sorted(slot for slot in slots if slot >= cursor):
+            if len(keys) >= count:
+                next_cursor = slot
+                break
+            keys.extend(slots[slot])
+        if match is not None:
+            pattern = match_pattern(match)
+            keys = [key for key in keys if pattern.match(key)]
+        return next_cursor, sorted(keys)
+
+    def command_hset(self, key, field, value):
+        values = self._get(key)
+        if values is None:
+            values = self.data[key] = {}
+        added = field not in values
+        values[field] = value
+        return int(added)
+
+    def command_hget(self, key, field):
+        return (self._get(key) or {}).get(field)
+
+    def command_ttl(self, key):
+        if self._get(key) is None:
+            return -2
+        expires_at = self.expires.get(key)
+        return -1 if expires_at is None else int(expires_at - time.time())
+
+    def command_publish(self, channel, message):
+        callbacks = self.subscribers.get(channel, [])
+        for callback in callbacks:
+            IOLoop.current().add_callback(lambda c=callback: c(message))
+        return len(callbacks)
+
+    def command_eval(self, script, keys=None, args=None):
+        self.loaded.add(script_digest(script))
+        return self.scripts[script](self, keys or [], args or [])
+
+    def command_evalsha(self, digest, keys=None, args=None):
+        if digest not in self.loaded:
+            return ResponseError('NOSCRIPT No matching script. '
+                                 'Please use EVAL.')
+        return self.scripts[self.digests[digest]](self, keys or [],
+                                                  args or [])
+
+
+def save_tokens(pool, keys, args):
+    """Python equivalent of toroauth2.store.SAVE_TOKENS."""
+    access_ttl, data, now, refresh_ttl, access_data = args
+    pool.command_setex(keys[0], access_ttl, access_data)
+    pool.command_zadd(keys[2], now + access_ttl, keys[0])
+    if refresh_ttl:
+        pool.command_setex(keys[1], refresh_ttl, data)
+        pool.command_zadd(keys[2], now + refresh_ttl, keys[1])
+        ttl = pool.command_ttl(keys[2])
+        index_ttl = max(access_ttl, refresh_ttl)
+        if (ttl == -1 and not pool.command_zcount(keys[2], '+inf', '+inf')) \
+                or 0 <= ttl < index_ttl:
+            pool.command_expire(keys[2], index_ttl)
+    else:
+        pool.command_set(keys[1], data)
+        pool.command_zadd(keys[2], '+inf', keys[1])
+        pool.command_persist(keys[2])
+    return 1
+
+
+def rotate_refresh_token(pool, keys, args):
+    """Python equivalent of toroauth2.store.ROTATE_REFRESH_TOKEN."""
+    if not pool.command_delete(keys[0]):
+        return 0
+    pool.command_zrem(keys[3], keys[0])
+    return save_tokens(pool, keys[1:], args)
+
+
+def delete_indexed_tokens(pool, keys, args):
+    """Python equivalent of toroauth2.store.DELETE_INDEXED_TOKENS."""
+    deleted = [key for key in list(pool.command_get(keys[0]) or ())
+               if pool.command_delete(key)]
+    pool.command_delete(keys[0])
+    return deleted
+
+
+def update_device_code(pool, keys, args):
+    """Python equivalent of toroauth2.store.UPDATE_DEVICE_CODE."""
+    ttl = pool.command_ttl(keys[0])
+    if ttl <= 0:
+        return 0
+    pool.command_setex(keys[0], ttl, args[0])
+    pool.command_publish(args[1], args[2])
+    return 1
+
+
+def save_client_token(pool, keys, args):
+    """Python equivalent of toroauth2.store.SAVE_CLIENT_TOKEN."""
+    access_ttl, data, now, refresh_ttl, access_data, scope, token = args
+    pool.command_setex(keys[0], access_ttl, access_data)
+    pool.command_zadd(keys[1], now + access_ttl, keys[0])
+    ttl = pool.command_ttl(keys[1])
+    if (ttl == -1 and not pool.command_zcount(keys[1], '+inf', '+inf')) or \
+            0 <= ttl < access_ttl:
+        pool.command_expire(keys[1], access_ttl)
+    pool.command_hset(keys[2], scope, token)
+    if pool.command_ttl(keys[2]) < access_ttl:
+        pool.command_expire(keys[2], access_ttl)
+    return 1
+
+
+def get_client_token(pool, keys, args):
+    """Python equivalent of toroauth2.store.GET_CLIENT_TOKEN."""
+    scope, min_expires_in, access_prefix = args
+    token = pool.command_hget(keys[0], scope)
+    if token is None or pool.command_ttl(access_prefix + token) < min_expires_in:
+        return None
+    return [token, pool.command_ttl(access_prefix + token)]
+
+
+SCRIPTS = {
+    SAVE_TOKENS: save_tokens,
+    SAVE_CLIENT_TOKEN: save_client_token,
+    GET_CLIENT_TOKEN: get_client_token,
+    ROTATE_REFRESH_TOKEN: rotate_refresh_token,
+    DELETE_INDEXED_TOKENS: delete_indexed_tokens,
+    UPDATE_DEVICE_CODE: update_device_code,
+}
@@ -0,0 +1,103 @@
+"""Throughput of provider_server per number of worker processes.
+
+For every count of --workers_list, starts provider_server through
+benchmarks/load.py --serve with that many pre-forked workers, load tests
+it from --generators load.py processes at once, and prints one JSON line
+with the combined throughput:
+
+    python benchmarks/workers.py --workers_list=1,2,4,8 --requests=20000
+
+The stand-ins of benchmarks/standins.py live in each worker, so a token
+issued by one worker is unknown to the others. The default mix only
+authorizes; pass --standins=false to run the full mix against the Redis
+and Mongo configured in provider.py.
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from tornado.options import define, options, parse_command_line
+
+define('workers_list', default='1,2,4', help='worker counts to measure')
+define('generators', default=2, type=int,
+       help='load generating processes')
+define('requests', default=5000, type=int, help='operations per count')
+define('concurrency', default=32, type=int,
+       help='concurrent clients per generator')
+define('mix', default='authorize:1', help='operation:weight pairs')
+define('clients', default=1, type=int, help='client applications')
+define('standins', default=True, type=bool,
+       help='use the stand-ins instead of the Redis and Mongo of provider.py')
+
+LOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load.py')
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError('Server did not listen on port %d' % port)
+
+
+def measure(workers):
+    port = free_port()
+    common = ['--clients=%d' % options.clients,
+              '--standins=%s' % options.standins, '--logging=warning']
+    server = subprocess.Popen([sys.executable, LOAD, '--serve',
+                               '--port=%d' % port, '--address=127.0.0.1',
+                               '--workers=%d' % workers] + common)
+    try:
+        wait_for(port)
+        generators = [subprocess.Popen(
+            [sys.executable, LOAD, '--url=http://127.0.0.1:%d' % port,
+             '--requests=%d' % (options.requests // options.generators),
+             '--concurrency=%d' % options.concurrency,
+             '--mix=%s' % options.mix, '--seed=%d' % i] + common,
+            stdout=subprocess.PIPE) for i in xrange(options.generators)]
+        reports = [json.loads(g.communicate()[0]) for g in generators]
+    finally:
+        server.terminate()
+        server.wait()
+
+    elapsed = max(report['elapsed_s'] for report in reports)
+    count = sum(endpoint['count'] for report in reports
+                for endpoint in report['endpoints'].values())
+    errors = sum(endpoint['errors'] for report in reports
+                 for endpoint in report['endpoints'].values())
+    return {
+        'workers': workers,
+        'generators': options.generators,
+        'requests': count,
+        'errors': errors,
+        'elapsed_s': elapsed,
+        'throughput_rps': round(count / elapsed, 1),
+        'worst_p99_ms': max(endpoint['p99_ms'] for report in reports
+                            for endpoint in report['endpoints'].values()),
+        'mix': options.mix,
+    }
+
+
+def main():
+    for workers in options.workers_list.split(','):
+        print json.dumps(measure(int(workers)), sort_keys=True)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parse_command_line()
+    main()
@@ -1,230 +1,304 @@
-from models import Application
-from pyoauth2.provider import AuthorizationProvider
-import tornadoredis
-import json
+from toroauth2.provider import AuthorizationProvider
+from toroauth2.cache import ApplicationCache
+from toroauth2.codec import CompactCodec
+from toroauth2.metrics import registry
+from toroauth2.notify import Notifier
+from toroauth2.pool import RedisPool
+from toroauth2.ratelimit import RateLimiter, SlidingWindow, TokenBuckets
+from toroauth2.redirects import RedirectURIs
+from toroauth2.registry import ApplicationRegistry
+from toroauth2.scopes import ScopeRegistry
+from toroauth2.signing import TokenSigner
+from toroauth2.singleflight import SingleFlight
+from toroauth2.store import RedisTokenStore, ShardedRedisTokenStore
+from toroauth2.sweeper import IndexSweeper
+from toroauth2.utils import TokenPool
 import logging
-import redis
+import time
 import tornado.gen as gen
 from mongotor.database import Database
 
 db = Database.connect(['localhost:27017'], 'auth')
 
-r = tornadoredis.Client()
-r.connect()
+# Connections are opened lazily, on the first command of each process
+redis_pool = RedisPool(host='localhost', port=6379, min_size=2, max_size=32,
+                       command_timeout=2, acquire_timeout=5, metrics=registry)
+
+# Set to spread codes and tokens over several Redis servers by client,
+# e.g. {'a': ('10.0.0.1', 6379), 'b': ('10.0.0.2', 6379)}. Shard names
+# place the servers on the hash ring, keep them when a server moves.
+REDIS_SHARDS = {}
+
+# Format of the grant data written to Redis. Entries of either format are
+# read, but releases before the codecs only read JSON: write with
+# toroauth2.codec.JSONCodec() until none of them runs anymore.
+GRANT_DATA_CODEC = CompactCodec()
+
+# Codes, tokens and revocations; toroauth2.store.MemoryTokenStore keeps
+# them in process instead, for a single server
+if REDIS_SHARDS:
+    token_store = ShardedRedisTokenStore(dict(
+        (name, RedisPool(host=host, port=port, min_size=2, max_size=32,
+                         command_timeout=2, acquire_timeout=5,
+                         metrics=registry))
+        for name, (host, port) in REDIS_SHARDS.items()),
+        codec=GRANT_DATA_CODEC, metrics=registry)
+else:
+    token_store = RedisTokenStore(redis_pool, codec=GRANT_DATA_CODEC,
+                                  metrics=registry)
+
+# Refresh tokens unused for that long expire, None to keep them for ever
+REFRESH_TOKEN_EXPIRES_IN = 30 * 24 * 3600
+
+# Client credentials tokens still valid for that long are answered again
+# to their client, None to issue a new token on every request
+CLIENT_CREDENTIALS_MIN_EXPIRES_IN = 600
+
+# Set to issue self-contained signed access tokens, e.g. {'k1': 'secret'}
+# with TOKEN_SIGNING_KEY_ID = 'k1'. Keep retired keys listed until the
+# tokens they signed have expired.
+TOKEN_SIGNING_KEYS = {}
+TOKEN_SIGNING_KEY_ID = None
+
+token_signer = (TokenSigner(TOKEN_SIGNING_KEYS, TOKEN_SIGNING_KEY_ID)
+                if TOKEN_SIGNING_KEYS else None)
+
+# Page where users approve their devices, see provider_server.py
+DEVICE_VERIFICATION_URI = 'http://localhost:9999/devices'
+
+# Wakes up the device token requests of this process waiting for their
+# user, see start_device_notifications
+device_notifier = Notifier()
+
+# Token endpoint requests per second and burst allowed to each client by
+# every process, None for no limit
+CLIENT_RATE_LIMIT = (50, 100)
+
+# Token endpoint requests per window seconds allowed to each client over
+# all processes, counted in Redis after the limit above, e.g. (3000, 60);
+# None to only limit each process
+CLIENT_RATE_WINDOW = None
+
+client_rate_limiter = None
+if CLIENT_RATE_LIMIT:
+    client_rate_limiter = RateLimiter(
+        TokenBuckets(*CLIENT_RATE_LIMIT),
+        SlidingWindow(redis_pool, *CLIENT_RATE_WINDOW)
+        if CLIENT_RATE_WINDOW else None)
+
+# Every grant takes an authorization code, an access token and a refresh
+# token, keep enough around for a burst of grants
+token_pool = TokenPool(40, size=3000)
+
+# Applications almost never change, so keep them in memory for a while
+# instead of asking Mongo on every authorization and token request.
+application_cache = ApplicationCache(max_size=4096, ttl=300)
+
+# Requests missing the cache for the same client share one Mongo query
+client_lookups = SingleFlight(name='load_client', metrics=registry)
+
+# Scope names of every application loaded, as bits
+scope_registry = ScopeRegistry()
+
+# Set to load every application in memory when serving, kept up to date
+# by polling their updated_at field, see start_application_registry
+PRELOAD_APPLICATIONS = False
+
+application_registry = None
+
+
+def start_index_sweeper(**kwargs):
+    """Start removing expired tokens from the client_user indexes of
+    token_store in the background; kwargs are passed to IndexSweeper.
+    One process of the deployment should call this.
+
+    :rtype: toroauth2.sweeper.IndexSweeper
+    """
+    sweeper = IndexSweeper(token_store, metrics=registry, **kwargs)
+    sweeper.start()
+    return sweeper
+
+
+def compile_application(app):
+    """Return the record of an application document, with the lookups
+    of every request precomputed.
+
+    Applications register their redirect URIs in redirect_uris, or a
+    single one in redirect_uri; see toroauth2.redirects.RedirectURIs.
+    Their scope lists the names clients may request any subset of.
+
+    :param app: Application document.
+    :type app: dict
+    :rtype: dict
+    """
+    uris = list(app.get('redirect_uris') or ())
+    if app.get('redirect_uri'):
+        uris.append(app['redirect_uri'])
+    return dict(app, redirect_uri_matcher=RedirectURIs(uris),
+                scope_mask=scope_registry.register(app.get('scope') or ''))
+
+
+def start_application_registry(callback=None, **kwargs):
+    """Load every application of db in memory and keep them up to date in
+    the background; kwargs are passed to ApplicationRegistry. Every
+    process serving requests should call this when PRELOAD_APPLICATIONS
+    is set. Until the first load is done, and callback called,
+    applications are looked up one by one.
+
+    :rtype: toroauth2.registry.ApplicationRegistry
+    """
+    global application_registry
+    application_registry = ApplicationRegistry(
+        db.application, fields=['app_key', 'app_secret', 'redirect_uri',
+                                'redirect_uris', 'scope', 'updated_at'],
+        compile=compile_application, metrics=registry, **kwargs)
+    application_registry.start(callback)
+    return application_registry
+
+
+def start_device_notifications():
+    """Wake up the waiting device token requests of this process when a
+    user decides, whichever process recorded it. Every process serving
+    token requests should call this.
+    """
+    token_store.subscribe_device_codes(device_notifier.notify)
 
-class Toroauth2AuthorizationProvider(AuthorizationProvider):
 
-    @gen.engine
-    def validate_client_id(self, client_id, callback=None):
-        """Check that the client_id represents a valid application.
+@gen.engine
+def load_revoked_tokens(revocation_list, callback=None):
+    """Refresh a revocation list with the revocations of the token store.
+    Resource servers verifying signed tokens should call this periodically.
+
+    :param revocation_list: Revocation list to update.
+    :type revocation_list: toroauth2.signing.RevocationList
+    """
+    entries = yield gen.Task(token_store.get_revocations)
+    revocation_list.purge()
+    revocation_list.update(entries)
+
+    if callback:
+        callback(len(entries))
+
 
-        :param client_id: Client id.
-        :type client_id: str
-        """
-        result, error = yield gen.Task(db.application.find_one, {"app_key": client_id})
-        
-        if callback:
-            raise Exception if result is None 
-            callback(result)
+class Toroauth2AuthorizationProvider(AuthorizationProvider):
 
-    @gen.engine
-    def validate_client_secret(self, client_id, client_secret, callback=None):
-        """Check that the client secret matches the application secret.
+    @property
+    def token_signer(self):
+        return token_signer
 
-        :param client_id: Client Id.
-        :type client_id: str
-        :param client_secret: Client secret.
-        :type client_secret: str
-        """
+    @property
+    def token_pool(self):
+        return token_pool
 
-        result, error = yield gen.Task(db.application.find_one, {"app_key": client_id})
+    @property
+    def token_store(self):
+        return token_store
 
-        if callback:
-            raise Exception if result["app_secret"] is not client_secret
-            callback(result)
+    @property
+    def refresh_token_expires_in(self):
+        return REFRESH_TOKEN_EXPIRES_IN
 
-    @gen.engine
-    def validate_redirect_uri(self, client_id, redirect_uri, callback=None):
-        """Validate that the redirect_uri requested is available for the app.
+    @property
+    def client_credentials_min_expires_in(self):
+        return CLIENT_CREDENTIALS_MIN_EXPIRES_IN
 
-        :param redirect_uri: Redirect URI.
-        :type redirect_uri: str
-        """
+    @property
+    def device_verification_uri(self):
+        return DEVICE_VERIFICATION_URI
 
-        app = Application.objects.get(app_key=client_id)
+    @property
+    def device_notifier(self):
+        return device_notifier
 
-        # When matching against a redirect_uri, it is very important to 
-        # ignore the query parameters, or else this step will fail as the 
-        # parameters change with every request
-        logging.info(app) 
-        if app is not None and app.redirect_uri == redirect_uri.split('?')[0]:
-            return True
-        return False
-
-    def validate_access(self):
-        """Validate that an OAuth token can be generated from the
-        current session."""
-#        return session.user is not None
-        return True
-
-    def validate_scope(self, client_id, scope):
-        """Validate that the scope requested is available for the app.
+    @property
+    def client_rate_limiter(self):
+        return client_rate_limiter
 
-        :param client_id: Client id.
-        :type client_id: str
-        :param scope: Requested scope.
-        :type scope: str
-        """
-        app = Application.objects.get(app_key=client_id)
-
-        if scope == app.scope:
-            return True
-        else:
-            return False 
+    @property
+    def metrics(self):
+        return registry
 
     @gen.engine
-    def persist_authorization_code(self, client_id, code, scope, callback=None):
-        """Store important session information (user_id) along with the
-        authorization code to later allow an access token to be created.
+    def load_client(self, client_id, callback=None):
+        """Get the application document, from the registry or the cache
+        when possible.
 
-        :param client_id: Client Id.
-        :type client_id: str
-        :param code: Authorization code.
-        :type code: str
-        :param scope: Scope.
-        :type scope: str
-        """
-        key = 'oauth2.authorization_code.%s:%s' % (client_id, code)
-
-        # Store any information about the current session that is needed
-        # to later authenticate the user.
-        
-        data = {'client_id': client_id,
-                'scope': scope,
-#                'user_id': session.user.id}
-                }
-        
-        result = yield gen.Task(
-            # Authorization codes expire in 1 minute
-            r.setex, key, 60, json.dumps(data))
-        
-        if callback:
-            callback(result)
-
-    @gen.engine
-    def persist_token_information(self, client_id, access_token,
-                                  token_type, expires_in, refresh_token,
-                                  data, callback=None):
-        """Save OAuth access and refresh token information.
-
-        :param client_id: Client Id.
+        :param client_id: Client id.
         :type client_id: str
-        :param access_token: Access token.
-        :type access_token: str
-        :param token_type: Token type (currently only Bearer)
-        :type token_type: str
-        :param expires_in: Access token expiration seconds.
-        :type expires_in: int
-        :param refresh_token: Refresh token.
-        :type refresh_token: str
-        :param data: Data from authorization code grant.
-        :type data: mixed
+        :rtype: dict if found else None
         """
-
-        # Set access token with proper expiration
-        access_key = 'oauth2.access_token:%s' % access_token
-        
-        result = yield gen.Task(r.setex, access_key, expires_in, json.dumps(data))
-
-        # Set refresh token with no expiration
-        refresh_key = 'oauth2.refresh_token.%s:%s' % (client_id, refresh_token)
-        result = yield gen.Task(r.set, refresh_key, json.dumps(data))
-
-        # Associate tokens to user for easy token revocation per app user
-        key = 'oauth2.client_user.%s:%s' % (client_id, data.get('user_id'))
-        result = yield gen.Task(r.sadd, key, access_key, refresh_key)
+        app = None
+        if application_registry is not None:
+            app = application_registry.get(client_id)
+        if app is None:
+            # Not preloaded, or created since the last registry poll
+            app = application_cache.get(client_id)
+        if app is None:
+            app = yield gen.Task(client_lookups.call, client_id,
+                                 self._find_client, client_id)
 
         if callback:
-            callback(result)
+            callback(app)
 
     @gen.engine
-    def from_authorization_code(self, client_id, code, callback=None):
-        """Get session data from authorization code.
+    def _find_client(self, client_id, callback=None):
+        start = time.time()
+        app, error = yield gen.Task(db.application.find_one, {"app_key": client_id})
+        registry.observe('mongo_query_seconds', time.time() - start,
+                         collection='application')
+        if error:
+            logging.error(error)
+
+        # find_one answers an empty list when nothing matched
+        app = compile_application(app) if app else None
+        if app is not None:
+            application_cache.set(client_id, app)
 
-        :param client_id: Client ID.
-        :type client_id: str
-        :param code: Authorization code.
-        :type code: str
-        :rtype: dict if valid else None
-        """
-        key = 'oauth2.authorization_code.%s:%s' % (client_id, code)
-        data = yield gen.Task(r.get, key)
-        
         if callback:
-            callback(json.loads(data))
+            callback(app)
 
-    def from_refresh_token(self, client_id, refresh_token, scope):
-        """Get session data from refresh token.
+    def check_client_secret(self, client, client_secret):
+        """Check that the client secret matches the application secret.
 
-        :param client_id: Client Id.
-        :type client_id: str
-        :param refresh_token: Refresh token.
-        :type refresh_token: str
-        :param scope: Scope to validate.
-        :type scope: str
-        :rtype: dict if valid else None
+        :param client: Client context.
+        :type client: toroauth2.provider.ClientContext
+        :param client_secret: Client secret.
+        :type client_secret: str
         """
-        key = 'oauth2.refresh_token.%s:%s' % (client_id, refresh_token)
-        data = self.r.get(key)
-        if data is not None:
-            data = json.loads(data)
-
-            # Validate scope and client_id
-            if (scope == '' or scope == data.get('scope')) and \
-                data.get('client_id') == client_id:
-                return data
+        return client.record.get('app_secret') == client_secret
 
-        return None  # The OAuth token refresh will fail at this point
-
-    @gen.engine
-    def discard_authorization_code(self, client_id, code, callback=None):
-        """Delete authorization code from the store.
+    def check_redirect_uri(self, client, redirect_uri):
+        """Validate that the redirect_uri requested is available for the app.
 
-        :param client_id: Client Id.
-        :type client_id: str
-        :param code: Authorization code.
-        :type code: str
+        :param client: Client context.
+        :type client: toroauth2.provider.ClientContext
+        :param redirect_uri: Redirect URI.
+        :type redirect_uri: str
         """
-        key = 'oauth2.authorization_code.%s:%s' % (client_id, code)
-        
-        result = yield gen.Task(r.delete, key)
-        
-        if callback:
-            callback(result)
-
-    def discard_refresh_token(self, client_id, refresh_token):
-        """Delete refresh token from the store.
+        # When matching against a redirect_uri, it is very important to 
+        # ignore the query parameters, or else this step will fail as the 
+        # parameters change with every request; the matcher does
+        return client.record['redirect_uri_matcher'].match(redirect_uri)
 
-        :param client_id: Client Id.
-        :type client_id: str
-        :param refresh_token: Refresh token.
-        :type refresh_token: str
+    def check_scope(self, client, scope):
+        """Validate that every scope requested is available for the app.
 
+        :param client: Client context.
+        :type client: toroauth2.provider.ClientContext
+        :param scope: Requested scope.
+        :type scope: str
         """
-        key = 'oauth2.refresh_token.%s:%s' % (client_id, refresh_token)
-        self.r.delete(key)
+        return scope_registry.allows(client.record['scope_mask'], scope)
 
-    def discard_client_user_tokens(self, client_id, user_id):
-        """Delete access and refresh tokens from the store.
+    def normalize_scope(self, scope):
+        return scope_registry.normalize(scope)
 
-        :param client_id: Client Id.
-        :type client_id: str
-        :param user_id: User Id.
-        :type user_id: str
+    def check_refresh_scope(self, granted_scope, scope):
+        return scope_registry.allows(scope_registry.register(granted_scope),
+                                     scope)
 
-        """
-        keys = 'oauth2.client_user.%s:%s' % (client_id, user_id)
-        pipe = self.r.pipeline()
-        for key in self.r.smembers(keys):
-            pipe.delete(key)
-        pipe.execute()
+    def validate_access(self):
+        """Validate that an OAuth token can be generated from the
+        current session."""
+#        return session.user is not None
+        return True
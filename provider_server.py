@@ -1,54 +1,278 @@
+import json
+import signal
+import time
+
+import tornado.escape
+import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
 import tornadoredis
 import tornado.web
 import tornado.gen
-from provider import Toroauth2AuthorizationProvider
+from tornado.options import define, options, parse_command_line
+from provider import (PRELOAD_APPLICATIONS, Toroauth2AuthorizationProvider,
+                      start_application_registry, start_device_notifications,
+                      start_index_sweeper)
+from toroauth2.metrics import MetricsHandler
+from toroauth2.provider import JSON_HEADERS
+from toroauth2.prefork import Supervisor
 
 import logging
 
-class AuthHandler(tornado.web.RequestHandler):
+define('port', default=9999, type=int, help='port to listen on')
+define('address', default='', help='address to listen on')
+define('workers', default=1, type=int,
+       help='worker processes, 0 for one per core')
+define('drain_timeout', default=10, type=float,
+       help='seconds a stopping worker waits for in-flight requests')
+define('max_in_flight', default=512, type=int,
+       help='requests in flight a worker accepts on the token endpoints '
+            'before answering 503, 0 for no limit')
+
+
+# Providers keep no per-request state, one serves every request
+provider = Toroauth2AuthorizationProvider()
+
+
+class ProviderHandler(tornado.web.RequestHandler):
+    """Counts the requests in flight, so workers can drain them."""
+
+    in_flight = 0
+
+    def prepare(self):
+        ProviderHandler.in_flight += 1
+        self._counted = True
+
+    def on_finish(self):
+        self._release()
+
+    def on_connection_close(self):
+        self._release()
+
+    def _release(self):
+        if getattr(self, '_counted', False):
+            self._counted = False
+            ProviderHandler.in_flight -= 1
+
+    def write_response(self, response):
+        """Finish the request with a toroauth2.provider.Response."""
+        self.set_status(response.status_code)
+        for name, value in response.headers:
+            self.set_header(name, value)
+        self.finish(response.body)
+
+
+class LimitedHandler(ProviderHandler):
+    """Turns requests away before any backend call: with 503 while the
+    worker has max_in_flight requests in flight, and with 429 for clients
+    over the provider's client_rate_limiter, see admit."""
+
+    def prepare(self):
+        super(LimitedHandler, self).prepare()
+        if options.max_in_flight and \
+                ProviderHandler.in_flight > options.max_in_flight:
+            self.reject(503, 'temporarily_unavailable', 1)
+
+    @tornado.gen.engine
+    def admit(self, client_id, callback=None):
+        """Check the rate limit of client_id, answering 429 when over it.
+
+        :rtype: bool, False when the request was answered
+        """
+        limiter = provider.client_rate_limiter
+        wait = 0
+        if limiter is not None and client_id:
+            wait = yield tornado.gen.Task(limiter.check, client_id)
+        if wait:
+            # Unknown to the httplib of Python 2, hence the reason
+            self.reject(429, 'too_many_requests', wait,
+                        reason='Too Many Requests')
+
+        callback(not wait)
+
+    def reject(self, status_code, error, retry_after, reason=None):
+        metrics = provider.metrics
+        if metrics is not None:
+            metrics.increment('oauth2_rejected_total', reason=error,
+                              endpoint=self.request.path)
+        self.set_status(status_code, reason)
+        for name, value in JSON_HEADERS:
+            self.set_header(name, value)
+        self.set_header('Retry-After', str(retry_after))
+        self.finish(json.dumps({'error': error}))
+
+
+class AuthHandler(ProviderHandler):
     
     @tornado.web.asynchronous
     @tornado.gen.engine
     def get(self):
         
-        provider = Toroauth2AuthorizationProvider()
-        
         result = yield tornado.gen.Task(provider.get_authorization_code_from_uri, self.request.uri)
 
-        if result:
-            self.redirect(result['redirect_uri'])          
-        else:
-            self.write("no response")
+        self.write_response(result)
 
-class TokenHandler(tornado.web.RequestHandler):
+class TokenHandler(LimitedHandler):
     
     @tornado.web.asynchronous
     @tornado.gen.engine
     def post(self):
 
-        provider = Toroauth2AuthorizationProvider()
-    
         data = {k: self.request.arguments[k][0] for k in self.request.arguments.iterkeys()} 
 
+        admitted = yield tornado.gen.Task(self.admit, data.get('client_id'))
+        if not admitted:
+            return
+
         result = yield tornado.gen.Task(provider.get_token_from_post_data, data)
        
-        if result:
-            self.finish(result)
-        else:
-            self.write("no access token")
+        start = time.time()
+        self.write_response(result)
+        provider._observe_stage('response', data.get('grant_type'), start)
             
-class DevicesHandler(tornado.web.RequestHandler):
+class IntrospectHandler(LimitedHandler):
+
+    @tornado.web.asynchronous
+    @tornado.gen.engine
+    def post(self):
+
+        data = {k: self.request.arguments[k][0] for k in self.request.arguments.iterkeys()}
+
+        admitted = yield tornado.gen.Task(self.admit, data.get('client_id'))
+        if not admitted:
+            return
+
+        result = yield tornado.gen.Task(provider.get_introspection_from_post_data, data)
+
+        self.write_response(result)
+
+class DeviceHandler(LimitedHandler):
+
+    @tornado.web.asynchronous
+    @tornado.gen.engine
+    def post(self):
+
+        data = {k: self.request.arguments[k][0] for k in self.request.arguments.iterkeys()}
+
+        admitted = yield tornado.gen.Task(self.admit, data.get('client_id'))
+        if not admitted:
+            return
+
+        result = yield tornado.gen.Task(provider.get_device_code_from_post_data, data)
+
+        self.write_response(result)
+
+class DevicesHandler(ProviderHandler):
+    """Page where users enter the code shown by their device, to approve
+    or deny it."""
+
     def get(self):
-        self.write("devices")
+        if not provider.validate_access():
+            raise tornado.web.HTTPError(403)
+        self.render_form(self.get_argument('user_code', ''))
+
+    def render_form(self, user_code, message=''):
+        self.write(DEVICE_FORM % {
+            'message': tornado.escape.xhtml_escape(message),
+            'user_code': tornado.escape.xhtml_escape(user_code),
+            'xsrf': self.xsrf_form_html(),
+        })
+
+    @tornado.web.asynchronous
+    @tornado.gen.engine
+    def post(self):
+        # Only this form is posted by browsers, so the application does not
+        # enable xsrf_cookies, which would reject the API clients
+        self.check_xsrf_cookie()
+        if not provider.validate_access():
+            raise tornado.web.HTTPError(403)
+        user_code = self.get_argument('user_code', '')
+        approved = self.get_argument('action', '') == 'approve'
+
+        updated = yield tornado.gen.Task(provider.approve_device, user_code, approved)
+
+        if not updated:
+            self.set_status(400)
+            self.render_form(user_code, 'Unknown or expired code.')
+        elif approved:
+            self.write('Device approved, you may go back to your device.')
+        else:
+            self.write('Device denied.')
+        self.finish()
+
+DEVICE_FORM = """<!DOCTYPE html>
+<html><body>
+<p>%(message)s</p>
+<form method="post" action="/devices">
+%(xsrf)s
+<label>Code shown by your device
+<input name="user_code" value="%(user_code)s" autocomplete="off"></label>
+<button name="action" value="approve">Approve</button>
+<button name="action" value="deny">Deny</button>
+</form>
+</body></html>
+"""
 
 application = tornado.web.Application([
     (r"/oauth/auth", AuthHandler),
     (r"/oauth/token", TokenHandler),
-    (r"/devices", DevicesHandler)
+    (r"/oauth/introspect", IntrospectHandler),
+    (r"/oauth/device", DeviceHandler),
+    (r"/devices", DevicesHandler),
+    (r"/metrics", MetricsHandler)
 ])
 
-if __name__ == "__main__":
-    application.listen(9999)
-    tornado.ioloop.IOLoop.instance().start()
 
+def serve(sockets, drain_timeout=10, sweep=True):
+    """Serve application on sockets until SIGTERM or SIGINT, then stop
+    accepting connections and exit once the requests in flight are done,
+    or after drain_timeout seconds. With sweep, also remove the expired
+    tokens from the token indexes in the background.
+
+    Redis and Mongo connections are opened by the first requests, so each
+    worker process has connections of its own.
+    """
+    io_loop = tornado.ioloop.IOLoop.instance()
+    server = tornado.httpserver.HTTPServer(application)
+    server.add_sockets(sockets)
+    if PRELOAD_APPLICATIONS:
+        start_application_registry()
+    start_device_notifications()
+    if sweep:
+        start_index_sweeper()
+
+    def drain():
+        server.stop()
+        deadline = time.time() + drain_timeout
+
+        def check():
+            if ProviderHandler.in_flight <= 0 or time.time() >= deadline:
+                io_loop.stop()
+            else:
+                io_loop.add_timeout(time.time() + 0.05, check)
+        check()
+
+    def on_signal(signum, frame):
+        io_loop.add_callback_from_signal(drain)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    io_loop.start()
+
+
+def main():
+    sockets = tornado.netutil.bind_sockets(options.port, options.address)
+    worker_id = None
+    if options.workers != 1:
+        # Workers share the listening sockets bound above
+        worker_id = Supervisor(options.workers).run()
+        if worker_id is None:
+            return
+        logging.info('Worker %d serving on port %d', worker_id, options.port)
+    # A single worker sweeps the indexes shared by all of them
+    serve(sockets, options.drain_timeout, sweep=not worker_id)
+
+
+if __name__ == "__main__":
+    parse_command_line()
+    main()
@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict
+
+
+class ApplicationCache(object):
+    """Bounded in-process cache for client application documents.
+
+    Entries expire ``ttl`` seconds after they were stored, and the least
+    recently used entry is evicted once ``max_size`` entries are held.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, clock=time.time):
+        """
+        :param max_size: Maximum number of applications kept in memory.
+        :type max_size: int
+        :param ttl: Seconds an application stays valid once cached.
+        :type ttl: int
+        :param clock: Callable returning the current time in seconds.
+        :type clock: callable
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, client_id):
+        """Return the cached application for client_id.
+
+        :param client_id: Client id.
+        :type client_id: str
+        :rtype: dict if cached and fresh else None
+        """
+        entry = self._entries.pop(client_id, None)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, app = entry
+        if expires_at <= self.clock():
+            self.misses += 1
+            return None
+
+        # Re-insert to mark the entry as most recently used
+        self._entries[client_id] = entry
+        self.hits += 1
+        return app
+
+    def set(self, client_id, app):
+        """Store an application document.
+
+        :param client_id: Client id.
+        :type client_id: str
+        :param app: Application document.
+        :type app: dict
+        """
+        self._entries.pop(client_id, None)
+        self._entries[client_id] = (self.clock() + self.ttl, app)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, client_id):
+        """Drop a single application, e.g. after its secret was changed.
+
+        :param client_id: Client id.
+        :type client_id: str
+        """
+        self._entries.pop(client_id, None)
+
+    def clear(self):
+        """Drop every cached application."""
+        self._entries.clear()
+
+    def stats(self):
+        """Return cache counters.
+
+        :rtype: dict
+        """
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,159 @@
+import json
+
+# Stored values go through the UTF-8 decoding of the Redis client, so the
+# compact format is text: a version character followed by fields parted
+# by RECORD_SEPARATOR, each made of a field id character, a type
+# character and the value.
+COMPACT_V1 = u'\x01'
+RECORD_SEPARATOR = u'\x1e'
+
+# Field ids of version 1. Never change the table of a released version,
+# add fields to a new version instead; fields missing from the table are
+# kept in the EXTRA_FIELDS field as JSON.
+FIELDS_V1 = (
+    ('client_id', u'a'),
+    ('scope', u'b'),
+    ('user_id', u'c'),
+    ('exp', u'd'),
+    ('redirect_uri', u'e'),
+    ('grant_type', u'f'),
+)
+EXTRA_FIELDS = u'*'
+
+
+class CodecError(ValueError):
+    """Raised when a stored value cannot be decoded."""
+
+
+def _decode_json(value):
+    return json.loads(value)
+
+
+def _decode_compact_v1(value, _ids=dict((i, f) for f, i in FIELDS_V1)):
+    data = {}
+    if len(value) == 1:
+        return data
+    for part in value[1:].split(RECORD_SEPARATOR):
+        kind = part[1:2]
+        if kind == u's':
+            item = part[2:]
+        elif kind == u'n':
+            item = None
+        elif kind == u'i':
+            item = int(part[2:])
+        elif kind == u't':
+            item = True
+        elif kind == u'f':
+            item = False
+        elif kind == u'j':
+            item = json.loads(part[2:])
+        else:
+            raise CodecError('Unknown value type %r' % kind)
+
+        field = part[:1]
+        if field == EXTRA_FIELDS:
+            data.update(item)
+        else:
+            try:
+                data[_ids[field]] = item
+            except KeyError:
+                raise CodecError('Unknown field id %r' % field)
+    return data
+
+
+# First character of a stored value -> decoder; JSON objects are the
+# entries written before the codecs existed.
+DECODERS = {
+    u'{': _decode_json,
+    COMPACT_V1: _decode_compact_v1,
+}
+
+
+class Codec(object):
+    """Serialization of the grant data stored with codes and tokens.
+
+    Every codec decodes all known formats, whatever it encodes, so the
+    format written can be switched while entries in the previous one are
+    still live.
+    """
+
+    version = None
+
+    def encode(self, data):
+        raise NotImplementedError('Subclasses must implement encode.')
+
+    def decode(self, value):
+        """Decode a stored value of any known format.
+
+        :param value: Stored value, None when missing.
+        :type value: str
+        :rtype: dict or None
+        """
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = value.decode('utf-8')
+        decoder = DECODERS.get(value[:1])
+        if decoder is None:
+            raise CodecError('Unknown grant data format %r' % value[:1])
+        return decoder(value)
+
+
+class JSONCodec(Codec):
+    """Writes JSON objects, the format of the first releases."""
+
+    version = 0
+
+    def encode(self, data):
+        return json.dumps(data)
+
+
+class CompactCodec(Codec):
+    """Writes version 1 of the compact format, which stores neither field
+    names nor quotes: 71 bytes instead of 113 for a typical grant."""
+
+    version = 1
+
+    def __init__(self):
+        self._ids = dict(FIELDS_V1)
+
+    def _encode_value(self, value):
+        if value is None:
+            return u'n'
+        if value is True:
+            return u't'
+        if value is False:
+            return u'f'
+        if isinstance(value, (int, long)):
+            return u'i%d' % value
+        if isinstance(value, basestring) and RECORD_SEPARATOR not in value:
+            if isinstance(value, str):
+                value = value.decode('utf-8')
+            return u's' + value
+        # json.dumps escapes control characters, separators included
+        return u'j' + json.dumps(value)
+
+    def encode(self, data):
+        """
+        :param data: Grant data.
+        :type data: dict
+        :rtype: unicode
+        """
+        ids = self._ids
+        parts = []
+        extra = None
+        for key, value in data.iteritems():
+            field = ids.get(key)
+            if field is None:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+            elif type(value) is unicode and RECORD_SEPARATOR not in value:
+                parts.append(field + u's' + value)
+            elif type(value) is str and '\x1e' not in value:
+                parts.append(field + u's' + value.decode('utf-8'))
+            else:
+                parts.append(field + self._encode_value(value))
+        if extra is not None:
+            parts.append(EXTRA_FIELDS + u'j' + json.dumps(extra))
+        return COMPACT_V1 + RECORD_SEPARATOR.join(parts)
@@ -0,0 +1,55 @@
+import bisect
+import hashlib
+
+
+class HashRing(object):
+    """Consistent hash ring.
+
+    Every node is placed at ``replicas`` points of the ring and a key
+    belongs to the node of the first point following the hash of the
+    key. Adding a node only moves the keys between its new points and
+    the preceding ones, about 1 / (number of nodes) of all keys.
+    """
+
+    def __init__(self, nodes=(), replicas=160):
+        """
+        :param nodes: Node names.
+        :type nodes: iterable
+        :param replicas: Points per node.
+        :type replicas: int
+        """
+        self.replicas = replicas
+        self._points = []
+        self._nodes = []
+        for node in nodes:
+            self.add_node(node)
+
+    def __len__(self):
+        return len(set(self._nodes))
+
+    def _hash(self, key):
+        return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+    def add_node(self, node):
+        for i in xrange(self.replicas):
+            point = self._hash('%s#%d' % (node, i))
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._nodes.insert(index, node)
+
+    def remove_node(self, node):
+        for index in reversed(xrange(len(self._nodes))):
+            if self._nodes[index] == node:
+                del self._points[index]
+                del self._nodes[index]
+
+    def get_node(self, key):
+        """Return the node key belongs to.
+
+        :param key: Key.
+        :type key: str
+        """
+        if not self._points:
+            raise LookupError('Hash ring has no nodes')
+        index = bisect.bisect(self._points, self._hash(key))
+        return self._nodes[index % len(self._nodes)]
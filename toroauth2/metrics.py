@@ -0,0 +1,163 @@
+import bisect
+import os
+
+import tornado.web
+
+# Upper bounds in seconds, from 0.5 millisecond to 10 seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    """Escape a label value as the text exposition format requires."""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+class Histogram(object):
+    """Fixed bucket histogram. Observing a value costs one bisection."""
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Return (upper bound, count of values <= bound) pairs, ending
+        with the "+Inf" bound.
+
+        :rtype: list
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Registry(object):
+    """Counters and histograms by name and labels, rendered in the
+    Prometheus text exposition format.
+
+    Every process has its own registry; with pre-forked workers each
+    scrape reports the worker that answered, which the pid label tells.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, labels=None):
+        """
+        :param buckets: Histogram bucket upper bounds.
+        :type buckets: tuple
+        :param labels: Labels added to every sample, defaults to the pid.
+        :type labels: dict
+        """
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, text):
+        """Set the HELP text of a metric."""
+        self._help[name] = text
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def counter(self, name, **labels):
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name, **labels):
+        return self._histograms.get((name, tuple(sorted(labels.items()))))
+
+    def clear(self):
+        self._counters.clear()
+        self._histograms.clear()
+
+    def _format_labels(self, labels, extra=()):
+        common = self.labels
+        if common is None:
+            common = {'pid': os.getpid()}
+        pairs = sorted(common.items()) + list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (k, _escape(v))
+                                 for k, v in pairs)
+
+    def render(self):
+        """Return all metrics in the Prometheus text format.
+
+        :rtype: str
+        """
+        lines = []
+        for kind, items in (('counter', self._counters),
+                            ('histogram', self._histograms)):
+            last = None
+            for (name, labels), value in sorted(items.items()):
+                if name != last:
+                    last = name
+                    if name in self._help:
+                        lines.append('# HELP %s %s' % (name, self._help[name]))
+                    lines.append('# TYPE %s %s' % (name, kind))
+                if kind == 'counter':
+                    lines.append('%s%s %s' % (name, self._format_labels(labels),
+                                              value))
+                    continue
+                for bound, count in value.cumulative():
+                    lines.append('%s_bucket%s %d' % (
+                        name, self._format_labels(labels, [('le', bound)]),
+                        count))
+                lines.append('%s_sum%s %.6f' % (
+                    name, self._format_labels(labels), value.sum))
+                lines.append('%s_count%s %d' % (
+                    name, self._format_labels(labels), value.count))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+registry.describe('oauth2_stage_seconds',
+                  'Time spent in each stage of a grant.')
+registry.describe('oauth2_requests_total',
+                  'Authorization and token requests by grant type and outcome.')
+registry.describe('oauth2_request_seconds',
+                  'Time to answer authorization and token requests.')
+registry.describe('oauth2_errors_total', 'OAuth errors answered, by error.')
+registry.describe('redis_command_seconds', 'Redis round trips by command.')
+registry.describe('redis_pool_wait_seconds',
+                  'Time waited for a free Redis connection.')
+registry.describe('redis_timeouts_total',
+                  'Redis connection waits and commands that timed out.')
+registry.describe('mongo_query_seconds', 'Mongo queries by collection.')
+registry.describe('coalesced_calls_total',
+                  'Calls answered by an identical call in flight.')
+registry.describe('oauth2_rejected_total',
+                  'Requests turned away before any backend call, by reason.')
+registry.describe('oauth2_index_entries_reclaimed_total',
+                  'Expired tokens removed from the client_user indexes.')
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Serve a registry, e.g. ``(r'/metrics', MetricsHandler)`` or
+    ``(r'/metrics', MetricsHandler, {'registry': other})``."""
+
+    def initialize(self, registry=registry):
+        self.registry = registry
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(self.registry.render())
@@ -0,0 +1,63 @@
+import time
+
+from tornado.ioloop import IOLoop
+
+
+class Notifier(object):
+    """Wakes up the callbacks waiting on a key, e.g. the long polls of a
+    device waiting for its user's approval.
+
+    Waiters are only known to the current process; to wake up the ones of
+    other processes, publish the key, e.g. with
+    toroauth2.pool.RedisPool.subscribe calling :meth:`notify`.
+    """
+
+    def __init__(self, io_loop=None):
+        self.io_loop = io_loop
+        self._waiters = {}
+        self.notified = 0
+        self.timed_out = 0
+
+    def __len__(self):
+        return sum(len(waiters) for waiters in self._waiters.itervalues())
+
+    def wait(self, key, timeout, callback):
+        """Call callback with True once key is notified, or with False
+        after timeout seconds.
+
+        :param key: Key to wait on.
+        :type key: str
+        :param timeout: Seconds to wait at most.
+        :type timeout: float
+        """
+        io_loop = self.io_loop or IOLoop.current()
+        waiter = [callback, None]
+
+        def expire():
+            waiters = self._waiters.get(key)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[key]
+                self.timed_out += 1
+                callback(False)
+
+        waiter[1] = io_loop.add_timeout(time.time() + timeout, expire)
+        self._waiters.setdefault(key, []).append(waiter)
+
+    def notify(self, key):
+        """Wake up the callbacks waiting on key.
+
+        :param key: Notified key.
+        :type key: str
+        :rtype: int
+        """
+        waiters = self._waiters.pop(key, None)
+        if not waiters:
+            return 0
+        io_loop = self.io_loop or IOLoop.current()
+        for callback, timeout in waiters:
+            io_loop.remove_timeout(timeout)
+            callback(True)
+        self.notified += len(waiters)
+        return len(waiters)
@@ -0,0 +1,442 @@
+import hashlib
+import logging
+import time
+from collections import deque
+from functools import partial
+
+import tornadoredis
+from tornado import stack_context
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornadoredis.exceptions import ConnectionError, ResponseError
+
+# Lua script source -> SHA1 digest, as SCRIPT LOAD would answer
+_digests = {}
+
+
+def script_digest(script):
+    """Return the SHA1 digest running script with EVALSHA.
+
+    :param script: Lua source.
+    :type script: str
+    :rtype: str
+    """
+    digest = _digests.get(script)
+    if digest is None:
+        digest = _digests[script] = hashlib.sha1(script).hexdigest()
+    return digest
+
+
+def _is_noscript(result):
+    return isinstance(result, ResponseError) and \
+        str(result.message).startswith('NOSCRIPT')
+
+
+def _error(result):
+    """Return the error reply in result, a reply or a list of pipelined
+    replies, except NOSCRIPT which execute_script handles."""
+    for reply in result if isinstance(result, list) else [result]:
+        if isinstance(reply, (ResponseError, ConnectionError)) and \
+                not _is_noscript(reply):
+            return reply
+    return None
+
+
+class PoolTimeout(Exception):
+    """Raised when a connection or a command reply took too long."""
+
+
+class RedisPool(object):
+    """Asynchronous pool of tornadoredis clients.
+
+    Every command runs on a client of its own, so a slow reply only stalls
+    the coroutine waiting for it. No connection is opened before
+    :meth:`start` (or the first command), which makes it safe to build
+    the pool at import time and fork afterwards.
+
+    Commands are run with :meth:`execute` and :meth:`pipeline`, Lua
+    scripts with :meth:`execute_script`::
+
+        data = yield gen.Task(pool.execute, 'get', key)
+        result = yield gen.Task(pool.pipeline, [('setex', key, 60, value),
+                                                ('sadd', index, key)])
+        result = yield gen.Task(pool.execute_script, SCRIPT, [key], [value])
+    """
+
+    def __init__(self, host='localhost', port=6379, password=None,
+                 selected_db=None, min_size=1, max_size=10,
+                 command_timeout=None, acquire_timeout=None,
+                 health_check_interval=30, metrics=None, io_loop=None):
+        """
+        :param min_size: Connections opened on start and kept open.
+        :type min_size: int
+        :param max_size: Upper bound of open connections.
+        :type max_size: int
+        :param command_timeout: Seconds to wait for a reply, None for ever.
+        :type command_timeout: float
+        :param acquire_timeout: Seconds to wait for a free connection,
+            None for ever.
+        :type acquire_timeout: float
+        :param health_check_interval: Seconds between pings of idle
+            connections, 0 to disable.
+        :type health_check_interval: float
+        :param metrics: Registry timing commands and connection waits.
+        :type metrics: toroauth2.metrics.Registry
+        """
+        self.host = host
+        self.port = port
+        self.password = password
+        self.selected_db = selected_db
+        self.min_size = min_size
+        self.max_size = max_size
+        self.command_timeout = command_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.metrics = metrics
+        self.io_loop = io_loop
+
+        self._idle = deque()
+        self._waiters = deque()
+        self._size = 0
+        self._started = False
+        self._health_check = None
+        self._subscribers = []
+
+        self.acquired = 0
+        self.waited = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+        self.reconnects = 0
+
+    def start(self):
+        """Open min_size connections and start the health checks."""
+        if self.io_loop is None:
+            self.io_loop = IOLoop.current()
+        # Health checks first: they open the connections that fail now
+        if self.health_check_interval and self._health_check is None:
+            self._health_check = PeriodicCallback(
+                self.check_health, self.health_check_interval * 1000,
+                io_loop=self.io_loop)
+            self._health_check.start()
+        self._started = True
+        self._fill()
+
+    def close(self):
+        """Stop the health checks and disconnect idle connections."""
+        if self._health_check is not None:
+            self._health_check.stop()
+            self._health_check = None
+        self._started = False
+        while self._idle:
+            self._discard(self._idle.popleft())
+        subscribers, self._subscribers = self._subscribers, []
+        for client in subscribers:
+            client.connection.disconnect()
+
+    def _connect(self):
+        client = tornadoredis.Client(host=self.host, port=self.port,
+                                     password=self.password,
+                                     selected_db=self.selected_db,
+                                     io_loop=self.io_loop)
+        client.connect()
+        self._size += 1
+        return client
+
+    def _fill(self):
+        """Open connections up to min_size. Redis being unreachable is not
+        an error here, the next health check tries again.
+        """
+        while self._size < self.min_size:
+            try:
+                client = self._connect()
+            except Exception as exc:
+                logging.warning('Cannot connect to redis on %s:%s: %s',
+                                self.host, self.port, exc)
+                self.reconnects += 1
+                return
+            self._idle.append(client)
+
+    def _discard(self, client):
+        self._size -= 1
+        try:
+            client.connection.disconnect()
+        except Exception as exc:
+            logging.debug('Error closing redis connection: %s', exc)
+
+    def acquire(self, callback):
+        """Pass a client to callback once one is available. The client
+        must be given back with :meth:`release`.
+        """
+        if not self._started:
+            self.start()
+
+        if self._idle:
+            self.acquired += 1
+            callback(self._idle.pop())
+        elif self._size < self.max_size:
+            client = self._connect()
+            self.acquired += 1
+            callback(client)
+        else:
+            # Handed the client in its own context, not in the one of the
+            # request releasing it, so that its errors reach it
+            waiter = [stack_context.wrap(callback), time.time(), None]
+            if self.acquire_timeout is not None:
+                waiter[2] = self.io_loop.add_timeout(
+                    waiter[1] + self.acquire_timeout,
+                    partial(self._on_acquire_timeout, waiter))
+            self._waiters.append(waiter)
+
+    def _on_acquire_timeout(self, waiter):
+        self._waiters.remove(waiter)
+        self.timeouts += 1
+        if self.metrics is not None:
+            self.metrics.increment('redis_timeouts_total', stage='acquire')
+        raise PoolTimeout('No redis connection available after %ss' %
+                          self.acquire_timeout)
+
+    def release(self, client):
+        """Give a client back to the pool.
+
+        :param client: Client obtained from :meth:`acquire`.
+        :type client: tornadoredis.Client
+        """
+        if not client.connection.connected():
+            # Replace broken connections instead of handing them out
+            self._discard(client)
+            self._replenish()
+            return
+
+        if self._waiters:
+            callback, enqueued_at, timeout = self._waiters.popleft()
+            if timeout is not None:
+                self.io_loop.remove_timeout(timeout)
+            wait_time = time.time() - enqueued_at
+            self.waited += 1
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            if self.metrics is not None:
+                self.metrics.observe('redis_pool_wait_seconds', wait_time)
+            self.acquired += 1
+            callback(client)
+        else:
+            self._idle.append(client)
+
+    def _replenish(self):
+        """Open a new connection for the next waiter after one was dropped."""
+        self.reconnects += 1
+        if self._waiters and self._size < self.max_size:
+            self.release(self._connect())
+
+    def _run(self, client, name, send, callback):
+        """Call send with a reply callback, enforcing command_timeout.
+        Error replies are raised, e.g. OOM or READONLY on writes.
+        """
+        state = {'timeout': None, 'done': False}
+        start = time.time()
+
+        def on_reply(result):
+            if state['done']:
+                return
+            state['done'] = True
+            if state['timeout'] is not None:
+                self.io_loop.remove_timeout(state['timeout'])
+            if self.metrics is not None:
+                self.metrics.observe('redis_command_seconds',
+                                     time.time() - start, command=name)
+            self.release(client)
+            error = _error(result)
+            if error is not None:
+                raise error
+            if callback:
+                callback(result)
+
+        def on_timeout():
+            if state['done']:
+                return
+            state['done'] = True
+            self.timeouts += 1
+            if self.metrics is not None:
+                self.metrics.increment('redis_timeouts_total', stage=name)
+            # The late reply would be read by the next user of this client
+            self._discard(client)
+            self._replenish()
+            raise PoolTimeout('Redis did not reply within %ss' %
+                              self.command_timeout)
+
+        if self.command_timeout is not None:
+            state['timeout'] = self.io_loop.add_timeout(
+                time.time() + self.command_timeout, on_timeout)
+        send(callback=on_reply)
+
+    def execute(self, command, *args, **kwargs):
+        """Run a single command on a pooled client.
+
+        :param command: Name of the tornadoredis.Client method, e.g. "get".
+        :type command: str
+        """
+        callback = kwargs.pop('callback', None)
+
+        def on_client(client):
+            send = partial(getattr(client, command), *args, **kwargs)
+            self._run(client, command, send, callback)
+
+        self.acquire(on_client)
+
+    def pipeline(self, commands, transactional=False, callback=None):
+        """Run several commands in one round trip on a pooled client.
+
+        :param commands: (command, arg, ...) tuples.
+        :type commands: list
+        :param transactional: Wrap the commands in MULTI/EXEC.
+        :type transactional: bool
+        :rtype: list of replies
+        """
+        def on_client(client):
+            pipe = client.pipeline(transactional=transactional)
+            for command in commands:
+                getattr(pipe, command[0])(*command[1:])
+            self._run(client, 'pipeline', pipe.execute, callback)
+
+        self.acquire(on_client)
+
+    def execute_script(self, script, keys, args, callback=None):
+        """Run a Lua script by its digest with EVALSHA, so that its source
+        only goes over the wire the first time a server runs it: on
+        NOSCRIPT it is sent with EVAL, which also caches it there.
+
+        :param script: Lua source.
+        :type script: str
+        :param keys: KEYS of the script.
+        :type keys: list
+        :param args: ARGV of the script.
+        :type args: list
+        """
+        def on_reply(result):
+            if _is_noscript(result):
+                self.execute('eval', script, list(keys), list(args),
+                             callback=callback)
+            elif callback:
+                callback(result)
+
+        # tornadoredis extends the keys with the args, pass copies
+        self.execute('evalsha', script_digest(script), list(keys),
+                     list(args), callback=on_reply)
+
+    def execute_scripts(self, script, calls, callback=None):
+        """Run a Lua script once per (keys, args) pair of calls in one
+        round trip, see :meth:`execute_script`.
+
+        :param script: Lua source.
+        :type script: str
+        :param calls: (keys, args) pairs.
+        :type calls: list
+        :rtype: list of replies
+        """
+        def on_replies(results):
+            missing = [i for i, result in enumerate(results)
+                       if _is_noscript(result)]
+            if not missing:
+                if callback:
+                    callback(results)
+                return
+
+            def on_retries(retries):
+                for i, result in zip(missing, retries):
+                    results[i] = result
+                if callback:
+                    callback(results)
+            self.pipeline([('eval', script, list(calls[i][0]),
+                            list(calls[i][1])) for i in missing],
+                          callback=on_retries)
+
+        digest = script_digest(script)
+        self.pipeline([('evalsha', digest, list(keys), list(args))
+                       for keys, args in calls], callback=on_replies)
+
+    def subscribe(self, channel, callback, reconnect_delay=1.0):
+        """Call callback with the body of every message published on
+        channel, until :meth:`close`. The subscription has a connection of
+        its own, outside of the pool, and subscribes again after
+        reconnect_delay seconds when it is lost; messages published in the
+        meantime are missed.
+
+        :param channel: Channel name.
+        :type channel: str
+        :param callback: Called with each message body.
+        :type callback: callable
+        :param reconnect_delay: Seconds between two connection attempts.
+        :type reconnect_delay: float
+        """
+        if self.io_loop is None:
+            self.io_loop = IOLoop.current()
+        retry = partial(self.subscribe, channel, callback, reconnect_delay)
+        client = tornadoredis.Client(host=self.host, port=self.port,
+                                     password=self.password,
+                                     selected_db=self.selected_db,
+                                     io_loop=self.io_loop)
+        try:
+            client.connect()
+        except Exception as exc:
+            logging.warning('Cannot subscribe to %s on %s:%s: %s', channel,
+                            self.host, self.port, exc)
+            self.io_loop.add_timeout(time.time() + reconnect_delay, retry)
+            return
+        self._subscribers.append(client)
+
+        def on_message(message):
+            if message.kind == 'message':
+                callback(message.body)
+            elif message.kind == 'disconnect' and client in self._subscribers:
+                # Not closed on purpose
+                self._subscribers.remove(client)
+                logging.warning('Subscription to %s on %s:%s lost', channel,
+                                self.host, self.port)
+                self.io_loop.add_timeout(time.time() + reconnect_delay, retry)
+
+        client.subscribe(channel, callback=lambda result: client.listen(
+            on_message))
+
+    def check_health(self):
+        """Ping idle connections and replace the ones that fail."""
+        for i in xrange(len(self._idle)):
+            self._ping(self._idle.popleft())
+        self._fill()
+
+    def _ping(self, client):
+        state = {}
+
+        def done(healthy):
+            if 'done' in state:
+                return
+            state['done'] = True
+            self.io_loop.remove_timeout(state['timeout'])
+            if not healthy:
+                logging.warning('Redis health check failed on %s:%s',
+                                self.host, self.port)
+                client.connection.disconnect()
+            self.release(client)
+
+        state['timeout'] = self.io_loop.add_timeout(
+            time.time() + (self.command_timeout or self.health_check_interval),
+            partial(done, False))
+        client.ping(callback=lambda result: done(result is True))
+
+    def stats(self):
+        """Return pool usage counters.
+
+        :rtype: dict
+        """
+        return {
+            'size': self._size,
+            'idle': len(self._idle),
+            'in_use': self._size - len(self._idle),
+            'waiters': len(self._waiters),
+            'acquired': self.acquired,
+            'waited': self.waited,
+            'wait_time': self.wait_time,
+            'avg_wait_time': self.wait_time / self.waited if self.waited else 0.0,
+            'max_wait_time': self.max_wait_time,
+            'timeouts': self.timeouts,
+            'reconnects': self.reconnects,
+        }
@@ -0,0 +1,168 @@
+import errno
+import logging
+import os
+import random
+import signal
+import time
+
+from tornado.ioloop import IOLoop
+from tornado.process import cpu_count
+
+
+class Supervisor(object):
+    """Pre-fork process supervisor.
+
+    Like tornado.process.fork_processes, :meth:`run` forks the workers and
+    returns the worker id in each of them, so they go on serving the
+    sockets bound before the fork. The supervisor itself stays in
+    :meth:`run` and:
+
+    - respawns workers that died, waiting respawn_delay between two
+      respawns of a worker that keeps dying on startup;
+    - on SIGHUP, replaces every worker: new workers are forked first,
+      then the old ones get SIGTERM and drain their requests;
+    - on SIGTERM or SIGINT, sends SIGTERM to all workers and waits up to
+      stop_timeout seconds before killing those still running.
+
+    Workers must exit on SIGTERM once their in-flight requests are done.
+    No IOLoop may exist before :meth:`run`; connection pools must open
+    their connections in the workers.
+    """
+
+    def __init__(self, workers=None, respawn_delay=1.0, stop_timeout=30):
+        """
+        :param workers: Number of workers, None or 0 for one per core.
+        :type workers: int
+        :param respawn_delay: Seconds between respawns of a worker which
+            lived less than that.
+        :type respawn_delay: float
+        :param stop_timeout: Seconds workers have to exit on shutdown.
+        :type stop_timeout: float
+        """
+        self.workers = workers or cpu_count()
+        self.respawn_delay = respawn_delay
+        self.stop_timeout = stop_timeout
+        self.respawns = 0
+        self._children = {}
+        self._started_at = {}
+        self._stopping = False
+        self._restarting = False
+
+    def _spawn(self, worker_id):
+        pid = os.fork()
+        if pid == 0:
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            # Do not share the random state of the supervisor
+            random.seed()
+            return worker_id
+        self._children[pid] = worker_id
+        self._started_at[pid] = time.time()
+        return None
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_restart(self, signum, frame):
+        self._restarting = True
+
+    def run(self):
+        """Start the workers and supervise them.
+
+        :rtype: worker id in workers, None in the supervisor once all
+            workers exited
+        """
+        if IOLoop.initialized():
+            raise RuntimeError('An IOLoop was created before forking')
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_restart)
+
+        logging.info('Starting %d workers', self.workers)
+        for worker_id in xrange(self.workers):
+            if self._spawn(worker_id) is not None:
+                return worker_id
+
+        retiring = set()
+        while self._children:
+            if self._stopping:
+                self._stop()
+                break
+
+            if self._restarting:
+                self._restarting = False
+                logging.info('Restarting %d workers', len(self._children))
+                for pid, worker_id in self._children.items():
+                    if pid in retiring:
+                        continue
+                    if self._spawn(worker_id) is not None:
+                        return worker_id
+                    retiring.add(pid)
+                    self._kill(pid, signal.SIGTERM)
+
+            try:
+                pid, status = os.wait()
+            except OSError as exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                raise
+
+            worker_id = self._children.pop(pid, None)
+            started_at = self._started_at.pop(pid, None)
+            if worker_id is None:
+                continue
+            if pid in retiring:
+                retiring.discard(pid)
+                continue
+            if self._stopping:
+                continue
+
+            if os.WIFSIGNALED(status):
+                logging.warning('Worker %d (pid %d) killed by signal %d, '
+                                'respawning', worker_id, pid,
+                                os.WTERMSIG(status))
+            else:
+                logging.warning('Worker %d (pid %d) exited with status %d, '
+                                'respawning', worker_id, pid,
+                                os.WEXITSTATUS(status))
+            if time.time() - started_at < self.respawn_delay:
+                time.sleep(self.respawn_delay)
+            self.respawns += 1
+            if self._spawn(worker_id) is not None:
+                return worker_id
+        return None
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as exc:
+            if exc.errno != errno.ESRCH:
+                raise
+
+    def _stop(self):
+        logging.info('Stopping %d workers', len(self._children))
+        for pid in self._children:
+            self._kill(pid, signal.SIGTERM)
+
+        deadline = time.time() + self.stop_timeout
+        while self._children and time.time() < deadline:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                if exc.errno == errno.ECHILD:
+                    break
+                raise
+            if pid:
+                self._children.pop(pid, None)
+                self._started_at.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+        for pid in self._children:
+            logging.warning('Killing worker pid %d', pid)
+            self._kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self._children.clear()
@@ -1,7 +1,6 @@
 import json
 import logging
-from requests import Response
-from cStringIO import StringIO
+import time
 try:
     from werkzeug.exceptions import Unauthorized
 except ImportError:
@@ -9,10 +8,63 @@ except ImportError:
 from . import utils
 
 import tornado.gen as gen
+from tornado.ioloop import IOLoop
 
 class Provider(object):
     """Base provider class for different types of OAuth 2.0 providers."""
 
+    @property
+    def metrics(self):
+        """Property method to get the registry timing every stage of the
+        grants and counting errors, or None.
+
+        :rtype: toroauth2.metrics.Registry
+        """
+        return None
+
+    def _grant_type_label(self, grant_type):
+        """Return the metrics label of a grant or response type sent by a
+        client: unknown ones share the "other" label, so that clients
+        cannot add series.
+        """
+        if grant_type is None or grant_type in METRIC_GRANT_TYPES:
+            return grant_type
+        return 'other'
+
+    def _observe_stage(self, stage, grant_type, start):
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.observe('oauth2_stage_seconds', time.time() - start,
+                            stage=stage,
+                            grant_type=self._grant_type_label(grant_type))
+
+    def _timed(self, stage, grant_type, func, *args, **kwargs):
+        """Call the asynchronous func, timing it as stage of grant_type."""
+        metrics = self.metrics
+        if metrics is None:
+            return func(*args, **kwargs)
+
+        callback = kwargs.pop('callback', None)
+        start = time.time()
+        grant_type = self._grant_type_label(grant_type)
+
+        def done(result=None):
+            metrics.observe('oauth2_stage_seconds', time.time() - start,
+                            stage=stage, grant_type=grant_type)
+            if callback:
+                callback(result)
+        func(*args, callback=done, **kwargs)
+
+    def _count_request(self, endpoint, grant_type, result, start):
+        metrics = self.metrics
+        if metrics is not None:
+            outcome = 'ok' if result.error is None else 'error'
+            grant_type = self._grant_type_label(grant_type)
+            metrics.increment('oauth2_requests_total', endpoint=endpoint,
+                              grant_type=grant_type, outcome=outcome)
+            metrics.observe('oauth2_request_seconds', time.time() - start,
+                            endpoint=endpoint, grant_type=grant_type)
+
     def _handle_exception(self, exc):
         """Handle an internal exception that was caught and suppressed.
 
@@ -22,23 +74,26 @@ class Provider(object):
         logger = logging.getLogger(__name__)
         logger.exception(exc)
 
-    def _make_response(self, body='', headers=None, status_code=200):
+    def _make_response(self, body='', headers=None, status_code=200,
+                       error=None):
         """Return a response object from the given parameters.
 
         :param body: Buffer/string containing the response body.
         :type body: str
-        :param headers: Dict of headers to include in the requests.
+        :param headers: Dict or (name, value) pairs of headers to include
+            in the response.
         :type headers: dict
         :param status_code: HTTP status code.
         :type status_code: int
-        :rtype: requests.Response
+        :param error: OAuth error carried by the response.
+        :type error: str
+        :rtype: Response
         """
-        res = Response()
-        res.status_code = status_code
-        if headers is not None:
-            res.headers.update(headers)
-        res.raw = StringIO(body)
-        return res
+        if isinstance(headers, dict):
+            headers = tuple(headers.items())
+        if self.metrics is not None and error is not None:
+            self.metrics.increment('oauth2_errors_total', error=error)
+        return Response(status_code, headers or (), body, error)
 
     def _make_redirect_error_response(self, redirect_uri, err):
         """Return a HTTP 302 redirect response object containing the error.
@@ -47,7 +102,7 @@ class Provider(object):
         :type redirect_uri: str
         :param err: OAuth error message.
         :type err: str
-        :rtype: requests.Response
+        :rtype: Response
         """
         params = {
             'error': err,
@@ -56,8 +111,8 @@ class Provider(object):
             'redirect_uri': None
         }
         redirect = utils.build_url(redirect_uri, params)
-        return self._make_response(headers={'Location': redirect},
-                                   status_code=302)
+        return self._make_response(headers=(('Location', redirect),),
+                                   status_code=302, error=err)
 
     def _make_json_response(self, data, headers=None, status_code=200):
         """Return a response object from the given JSON data.
@@ -68,14 +123,11 @@ class Provider(object):
         :type headers: dict
         :param status_code: HTTP status code.
         :type status_code: int
-        :rtype: requests.Response
+        :rtype: Response
         """
-        response_headers = {}
+        response_headers = JSON_HEADERS
         if headers is not None:
-            response_headers.update(headers)
-        response_headers['Content-Type'] = 'application/json;charset=UTF-8'
-        response_headers['Cache-Control'] = 'no-store'
-        response_headers['Pragma'] = 'no-cache'
+            response_headers = tuple(headers.items()) + JSON_HEADERS
         return self._make_response(json.dumps(data),
                                    response_headers,
                                    status_code)
@@ -85,18 +137,100 @@ class Provider(object):
 
         :param err: OAuth error message.
         :type err: str
-        :rtype: requests.Response
+        :rtype: Response
         """
-        return self._make_json_response({'error': err}, status_code=400)
+        if self.metrics is not None:
+            self.metrics.increment('oauth2_errors_total', error=err)
+        response = JSON_ERROR_RESPONSES.get(err)
+        if response is None:
+            response = Response(400, JSON_HEADERS, json.dumps({'error': err}),
+                                err)
+        return response
 
     def _invalid_redirect_uri_response(self):
         """What to return when the redirect_uri parameter is missing.
 
-        :rtype: requests.Response
+        :rtype: Response
         """
         return self._make_json_error_response('invalid_request')
 
 
+class Response(object):
+    """HTTP response of a provider, written as is by the request handler.
+
+    Shared instances, such as the pre-serialized error responses, must
+    not be modified.
+    """
+    __slots__ = ('status_code', 'headers', 'body', 'error')
+
+    def __init__(self, status_code=200, headers=(), body='', error=None):
+        """
+        :param status_code: HTTP status code.
+        :type status_code: int
+        :param headers: (name, value) pairs.
+        :type headers: tuple
+        :param body: Response body.
+        :type body: str
+        :param error: OAuth error carried by the response, if any.
+        :type error: str
+        """
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.error = error
+
+    @property
+    def json(self):
+        """Return the decoded JSON body.
+
+        :rtype: dict
+        """
+        return json.loads(self.body)
+
+
+JSON_HEADERS = (
+    ('Content-Type', 'application/json;charset=UTF-8'),
+    ('Cache-Control', 'no-store'),
+    ('Pragma', 'no-cache'),
+)
+
+# Error bodies never change, build them once
+JSON_ERROR_RESPONSES = dict(
+    (err, Response(400, JSON_HEADERS, json.dumps({'error': err}), err))
+    for err in ('invalid_request', 'invalid_client', 'invalid_grant',
+                'unauthorized_client', 'unsupported_grant_type',
+                'invalid_scope', 'server_error', 'authorization_pending',
+                'slow_down', 'access_denied', 'expired_token'))
+
+DEVICE_CODE_GRANT_TYPE = 'urn:ietf:params:oauth:grant-type:device_code'
+
+# Grant types, and the "code" response type, labelled as is in metrics
+METRIC_GRANT_TYPES = frozenset(['authorization_code', 'refresh_token',
+                                'client_credentials', DEVICE_CODE_GRANT_TYPE,
+                                'code'])
+
+
+class ClientContext(object):
+    """Client application resolved once for the duration of a request.
+
+    Every client check of a grant runs against :attr:`record` instead of
+    looking the application up again.
+    """
+    __slots__ = ('client_id', 'record')
+
+    def __init__(self, client_id, record=None):
+        self.client_id = client_id
+        self.record = record
+
+    @property
+    def is_valid(self):
+        """Whether client_id represents a known application.
+
+        :rtype: bool
+        """
+        return self.record is not None
+
+
 class AuthorizationProvider(Provider):
     """OAuth 2.0 authorization provider. This class manages authorization
     codes and access tokens. Certain methods MUST be overridden in a
@@ -104,21 +238,24 @@ class AuthorizationProvider(Provider):
 
     These are the methods that must be implemented in a subclass:
 
-        validate_client_id(self, client_id)
-            # Return True or False
+        load_client(self, client_id)
+            # Return the client application record or None
 
-        validate_client_secret(self, client_id, client_secret)
+        check_client_secret(self, client, client_secret)
             # Return True or False
 
-        validate_scope(self, client_id, scope)
+        check_scope(self, client, scope)
             # Return True or False
 
-        validate_redirect_uri(self, client_id, redirect_uri)
+        check_redirect_uri(self, client, redirect_uri)
             # Return True or False
 
         validate_access(self)  # Use this to validate your app session user
             # Return True or False
 
+    and, unless token_store is overridden to return a
+    toroauth2.store.TokenStore:
+
         from_authorization_code(self, client_id, code, scope)
             # Return mixed data or None on invalid
 
@@ -150,12 +287,62 @@ class AuthorizationProvider(Provider):
         @property
         token_expires_in(self)
 
+        @property
+        authorization_code_expires_in(self)
+
+        @property
+        refresh_token_expires_in(self)
+
+        @property
+        introspection_batch_size(self)
+
+        @property
+        device_code_expires_in(self)
+
+        @property
+        device_code_retention(self)
+
+        @property
+        device_poll_interval(self)
+
+        @property
+        device_poll_timeout(self)
+
+        @property
+        device_verification_uri(self)
+
+        @property
+        device_notifier(self)
+
+        @property
+        client_rate_limiter(self)
+
+        @property
+        client_credentials_min_expires_in(self)
+
+        @property
+        token_store(self)
+
+        @property
+        token_signer(self)
+
+        @property
+        token_pool(self)
+
+        @property
+        metrics(self)
+
         generate_authorization_code(self)
 
-        generate_access_token(self)
+        generate_access_token(self, client_id, data)
 
         generate_refresh_token(self)
 
+        consume_authorization_code(self, client_id, code)
+
+        rotate_refresh_token(self, client_id, refresh_token, access_token,
+                             token_type, expires_in, new_refresh_token, data)
+
     """
 
     @property
@@ -182,26 +369,266 @@ class AuthorizationProvider(Provider):
         """
         return 3600
 
+    @property
+    def authorization_code_expires_in(self):
+        """Property method to get the authorization code expiration time
+        in seconds.
+
+        :rtype: int
+        """
+        return 60
+
+    @property
+    def refresh_token_expires_in(self):
+        """Property method to get the refresh token expiration time in
+        seconds, None for refresh tokens which never expire. Only used
+        with a token_store.
+
+        :rtype: int
+        """
+        return None
+
+    @property
+    def client_credentials_min_expires_in(self):
+        """Property method to get the seconds a client credentials token
+        must still be valid for to be answered again to its client asking
+        for the same scope, or None to issue a new token on every request.
+
+        :rtype: int
+        """
+        return None
+
+    @property
+    def introspection_batch_size(self):
+        """Property method to get the maximum number of tokens of an
+        introspection request.
+
+        :rtype: int
+        """
+        return 1000
+
+    @property
+    def device_code_expires_in(self):
+        """Property method to get the device and user code expiration time
+        in seconds.
+
+        :rtype: int
+        """
+        return 600
+
+    @property
+    def device_code_retention(self):
+        """Property method to get the seconds device codes are kept after
+        they expired, so that their devices are answered expired_token
+        instead of invalid_grant.
+
+        :rtype: int
+        """
+        return 600
+
+    @property
+    def device_poll_interval(self):
+        """Property method to get the seconds devices must wait between
+        two token requests.
+
+        :rtype: int
+        """
+        return 5
+
+    @property
+    def device_poll_timeout(self):
+        """Property method to get the seconds a device token request waits
+        for the user's decision before answering authorization_pending,
+        when there is a device_notifier.
+
+        :rtype: int
+        """
+        return 20
+
+    @property
+    def device_verification_uri(self):
+        """Property method to get the URI of the page where users enter
+        the code shown by their device, required by the device grant.
+
+        :rtype: str
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'device_verification_uri.')
+
+    @property
+    def device_notifier(self):
+        """Property method to get the notifier waking up the device token
+        requests waiting for their user's decision, notified with the
+        device codes updated in the token_store, or None to answer them
+        right away.
+
+        :rtype: toroauth2.notify.Notifier
+        """
+        return None
+
+    @property
+    def client_rate_limiter(self):
+        """Property method to get the per-client rate limit of the token
+        endpoints, applied by the server before calling the provider, or
+        None.
+
+        :rtype: toroauth2.ratelimit.RateLimiter
+        """
+        return None
+
+    @property
+    def token_store(self):
+        """Property method to get the store of codes and tokens used by
+        the default persistence methods, or None to implement them.
+
+        :rtype: toroauth2.store.TokenStore
+        """
+        return None
+
+    @property
+    def token_pool(self):
+        """Property method to get a pool of pre-generated random tokens
+        of token_length, or None to generate every token on demand.
+
+        :rtype: toroauth2.utils.TokenPool
+        """
+        return None
+
+    def _random_token(self):
+        pool = self.token_pool
+        if pool is not None:
+            return pool.get()
+        return utils.random_ascii_string(self.token_length)
+
     def generate_authorization_code(self):
         """Generate a random authorization code.
 
         :rtype: str
         """
-        return utils.random_ascii_string(self.token_length)
+        return self._random_token()
+
+    @property
+    def token_signer(self):
+        """Property method to get the signer of self-contained access
+        tokens, or None to issue random opaque tokens.
 
-    def generate_access_token(self):
-        """Generate a random access token.
+        :rtype: toroauth2.signing.TokenSigner
+        """
+        return None
 
+    def generate_access_token(self, client_id=None, data=None):
+        """Generate an access token, signed when a token signer is set.
+
+        :param client_id: Client ID.
+        :type client_id: str
+        :param data: Data from the grant.
+        :type data: dict
         :rtype: str
         """
-        return utils.random_ascii_string(self.token_length)
+        signer = self.token_signer
+        if signer is not None and client_id is not None:
+            return signer.sign(signer.make_claims(client_id, data or {},
+                                                  self.token_expires_in))
+
+        # Sharded stores route access tokens by a prefix naming the client
+        store = self.token_store
+        if store is not None and client_id is not None:
+            return store.access_token_prefix(client_id) + self._random_token()
+        return self._random_token()
 
     def generate_refresh_token(self):
         """Generate a random refresh token.
 
         :rtype: str
         """
-        return utils.random_ascii_string(self.token_length)
+        return self._random_token()
+
+    @gen.engine
+    def consume_authorization_code(self, client_id, code, callback=None):
+        """Get session data from an authorization code and discard the code.
+
+        With a token_store this is the store's atomic consume, otherwise
+        from_authorization_code and then discard_authorization_code are
+        called. Override this when both can be done in a single atomic
+        step, so a code is never redeemed twice.
+
+        :param client_id: Client ID.
+        :type client_id: str
+        :param code: Authorization code.
+        :type code: str
+        :rtype: dict if valid else None
+        """
+        store = self.token_store
+        if store is not None:
+            data = yield gen.Task(store.consume_authorization_code,
+                                  client_id, code)
+        else:
+            data = yield gen.Task(self.from_authorization_code, client_id, code)
+            if data is not None:
+                yield gen.Task(self.discard_authorization_code, client_id, code)
+
+        if callback:
+            callback(data)
+
+    @gen.engine
+    def rotate_refresh_token(self, client_id, refresh_token, access_token,
+                             token_type, expires_in, new_refresh_token,
+                             data, callback=None):
+        """Discard a used refresh token and save the tokens replacing it.
+
+        With a token_store this is the store's atomic rotation, otherwise
+        discard_refresh_token and then persist_token_information are
+        called. Override this when both can be done in a single atomic
+        step, and answer False when the refresh token was already
+        discarded.
+
+        :param client_id: Client Id.
+        :type client_id: str
+        :param refresh_token: Refresh token being used.
+        :type refresh_token: str
+        :param access_token: New access token.
+        :type access_token: str
+        :param token_type: Token type (currently only Bearer)
+        :type token_type: str
+        :param expires_in: Access token expiration seconds.
+        :type expires_in: int
+        :param new_refresh_token: New refresh token.
+        :type new_refresh_token: str
+        :param data: Data from the original grant.
+        :type data: mixed
+        :rtype: bool
+        """
+        store = self.token_store
+        if store is not None:
+            rotated = yield gen.Task(store.rotate_refresh_token, client_id,
+                                     refresh_token, access_token, expires_in,
+                                     new_refresh_token, data,
+                                     self.refresh_token_expires_in)
+        else:
+            yield gen.Task(self.discard_refresh_token, client_id, refresh_token)
+            yield gen.Task(self.persist_token_information, client_id=client_id,
+                           access_token=access_token,
+                           token_type=token_type,
+                           expires_in=expires_in,
+                           refresh_token=new_refresh_token,
+                           data=data)
+            rotated = True
+
+        if callback:
+            callback(rotated)
+
+    @gen.engine
+    def get_client_context(self, client_id, callback=None):
+        """Resolve the client application once for the current request.
+
+        :param client_id: Client ID.
+        :type client_id: str
+        :rtype: ClientContext
+        """
+        record = yield gen.Task(self.load_client, client_id)
+
+        if callback:
+            callback(ClientContext(client_id, record))
 
     @gen.engine
     def get_authorization_code(self,
@@ -217,64 +644,49 @@ class AuthorizationProvider(Provider):
         :type client_id: str
         :param redirect_uri: Client redirect URI.
         :type redirect_uri: str
-        :rtype: requests.Response
+        :rtype: Response
         """
-        
-        # Ensure proper response_type
-        if response_type != 'code':
-            err = 'unsupported_response_type'
-            raise gen.Return(err)
-            
-#             return self._make_redirect_error_response(redirect_uri, err)
-
-#         # Check redirect URI
-#         is_valid_redirect_uri = yield gen.Task(self.validate_redirect_uri, client_id, redirect_uri)
-#         
-#         # Check conditions
-#         is_valid_client_id = self.validate_client_id(client_id)
-#         is_valid_access = self.validate_access()
         scope = params.get('scope', '')
-#         is_valid_scope = self.validate_scope(client_id, scope)
-        
-        
-        result = yield gen.Task(self.validate_client_id, client_id)
 
+        # Every check below runs against this one client record
+        client = yield gen.Task(self._timed, 'load_client', 'code',
+                                self.get_client_context, client_id)
 
-        if result:
-            if result.get('redirect_uri') is not redirect_uri:
-                pass
-                #raise gen.Return()
-    #             return self._invalid_redirect_uri_response()
-            
-            if result.get('scope') is not scope:
-                err = 'invalid_scope'
-                pass
-                #raise gen.Return(err)
-    #             return self._make_redirect_error_response(redirect_uri, err)
-
-    #        if not is_valid_access:
-    #            err = 'access_denied'
-    #            raise
-    #             return self._make_redirect_error_response(redirect_uri, err)
+        # Never redirect to an URI that was not registered for the client
+        if not (client.is_valid and
+                self.check_redirect_uri(client, redirect_uri)):
+            if callback:
+                callback(self._invalid_redirect_uri_response())
+            return
 
+        # Check conditions
+        if response_type != 'code':
+            err = 'unsupported_response_type'
+        elif not self.check_scope(client, scope):
+            err = 'invalid_scope'
+        elif not self.validate_access():
+            err = 'access_denied'
         else:
-            err = 'unauthorized_client'
-            pass
-            #raise gen.Return(err)
-    #             return self._make_redirect_error_response(redirect_uri, err)
+            err = None
+
+        if err is not None:
+            if callback:
+                callback(self._make_redirect_error_response(redirect_uri, err))
+            return
+        scope = self.normalize_scope(scope)
 
-        
         # Generate authorization code
+        start = time.time()
         code = self.generate_authorization_code()
-
+        self._observe_stage('generate_tokens', 'code', start)
 
         # Save information to be used to validate later requests
-        result = yield gen.Task(self.persist_authorization_code, client_id=client_id,
+        result = yield gen.Task(self._timed, 'persist_authorization_code', 'code',
+                                self.persist_authorization_code, client_id=client_id,
                                         code=code,
                                         scope=scope)
         
         if callback:
-            response = {}
             params.update({
                 'code': code,
                 'response_type': None,
@@ -282,15 +694,18 @@ class AuthorizationProvider(Provider):
                 'redirect_uri': None
             })
             
-            response['redirect_uri'] = utils.build_url(redirect_uri, params)
+            redirect = utils.build_url(redirect_uri, params)
 
-            callback(response)
+            callback(self._make_response(headers=(('Location', redirect),),
+                                         status_code=302))
 
+    @gen.engine
     def refresh_token(self,
                       grant_type,
                       client_id,
                       client_secret,
                       refresh_token,
+                      callback=None,
                       **params):
         """Generate access token HTTP response from a refresh token.
 
@@ -302,56 +717,69 @@ class AuthorizationProvider(Provider):
         :type client_secret: str
         :param refresh_token: Refresh token.
         :type refresh_token: str
-        :rtype: requests.Response
+        :rtype: Response
         """
-
-        # Ensure proper grant_type
-        if grant_type != 'refresh_token':
-            return self._make_json_error_response('unsupported_grant_type')
-
-        # Check conditions
-        is_valid_client_id = self.validate_client_id(client_id)
-        is_valid_client_secret = self.validate_client_secret(client_id,
-                                                             client_secret)
         scope = params.get('scope', '')
-        is_valid_scope = self.validate_scope(client_id, scope)
-        data = self.from_refresh_token(client_id, refresh_token, scope)
-        is_valid_refresh_token = data is not None
 
-        # Return proper error responses on invalid conditions
-        if not (is_valid_client_id and is_valid_client_secret):
-            return self._make_json_error_response('invalid_client')
+        client = yield gen.Task(self._timed, 'load_client', 'refresh_token',
+                                self.get_client_context, client_id)
 
-        if not is_valid_scope:
-            return self._make_json_error_response('invalid_scope')
+        # Check conditions against the client record loaded above. An
+        # empty scope keeps the scope of the original grant.
+        if grant_type != 'refresh_token':
+            err = 'unsupported_grant_type'
+        elif not (client.is_valid and
+                  self.check_client_secret(client, client_secret)):
+            err = 'invalid_client'
+        elif scope and not self.check_scope(client, scope):
+            err = 'invalid_scope'
+        else:
+            err = None
 
-        if not is_valid_refresh_token:
-            return self._make_json_error_response('invalid_grant')
+        if err is not None:
+            if callback:
+                callback(self._make_json_error_response(err))
+            return
 
-        # Discard original refresh token
-        self.discard_refresh_token(client_id, refresh_token)
+        data = yield gen.Task(self._timed, 'from_refresh_token',
+                              'refresh_token', self.from_refresh_token,
+                              client_id, refresh_token, scope)
+        if data is None:
+            if callback:
+                callback(self._make_json_error_response('invalid_grant'))
+            return
 
         # Generate access tokens once all conditions have been met
-        access_token = self.generate_access_token()
+        start = time.time()
+        access_token = self.generate_access_token(client_id, data)
         token_type = self.token_type
         expires_in = self.token_expires_in
-        refresh_token = self.generate_refresh_token()
-
-        # Save information to be used to validate later requests
-        self.persist_token_information(client_id=client_id,
-                                       access_token=access_token,
-                                       token_type=token_type,
-                                       expires_in=expires_in,
-                                       refresh_token=refresh_token,
-                                       data=data)
+        new_refresh_token = self.generate_refresh_token()
+        self._observe_stage('generate_tokens', 'refresh_token', start)
+
+        # Discard original refresh token and save the new tokens. This
+        # fails if a concurrent request already used the refresh token.
+        rotated = yield gen.Task(self._timed, 'rotate_refresh_token',
+                                 'refresh_token', self.rotate_refresh_token,
+                                 client_id=client_id,
+                                 refresh_token=refresh_token,
+                                 access_token=access_token,
+                                 token_type=token_type,
+                                 expires_in=expires_in,
+                                 new_refresh_token=new_refresh_token,
+                                 data=data)
+        if not rotated:
+            if callback:
+                callback(self._make_json_error_response('invalid_grant'))
+            return
 
-        # Return json response
-        return self._make_json_response({
-            'access_token': access_token,
-            'token_type': token_type,
-            'expires_in': expires_in,
-            'refresh_token': refresh_token
-        })
+        if callback:
+            callback(self._make_json_response({
+                'access_token': access_token,
+                'token_type': token_type,
+                'expires_in': expires_in,
+                'refresh_token': new_refresh_token
+            }))
 
     @gen.engine
     def get_token(self,
@@ -374,56 +802,54 @@ class AuthorizationProvider(Provider):
         :type redirect_uri: str
         :param code: Authorization code.
         :type code: str
-        :rtype: requests.Response
+        :rtype: Response
         """
+        client = yield gen.Task(self._timed, 'load_client', 'authorization_code',
+                                self.get_client_context, client_id)
 
-        # Ensure proper grant_type
+        # Check conditions against the client record loaded above
         if grant_type != 'authorization_code':
-            pass
-#             return self._make_json_error_response('unsupported_grant_type')
-
-        # Check conditions
-#         is_valid_client_id = self.validate_client_id(client_id)
-#         is_valid_client_secret = self.validate_client_secret(client_id,
-#                                                              client_secret)
-#         is_valid_redirect_uri = self.validate_redirect_uri(client_id,
-#                                                            redirect_uri)
-
-        data = yield gen.Task(self.from_authorization_code, client_id, code)
-        is_valid_grant = data is not None
-
-#         # Return proper error responses on invalid conditions
-#         if not (is_valid_client_id and is_valid_client_secret):
-#             return self._make_json_error_response('invalid_client')
-# 
-#         if not is_valid_grant or not is_valid_redirect_uri:
-#             return self._make_json_error_response('invalid_grant')
+            err = 'unsupported_grant_type'
+        elif not (client.is_valid and
+                  self.check_client_secret(client, client_secret)):
+            err = 'invalid_client'
+        elif not self.check_redirect_uri(client, redirect_uri):
+            err = 'invalid_grant'
+        else:
+            err = None
 
-        # Discard original authorization code
-        result = yield gen.Task(self.discard_authorization_code, client_id, code)
+        if err is not None:
+            if callback:
+                callback(self._make_json_error_response(err))
+            return
+
+        # Fetch and discard the original authorization code in one step
+        data = yield gen.Task(self._timed, 'consume_authorization_code',
+                              'authorization_code',
+                              self.consume_authorization_code, client_id, code)
+        if data is None:
+            if callback:
+                callback(self._make_json_error_response('invalid_grant'))
+            return
 
         # Generate access tokens once all conditions have been met
-        access_token = self.generate_access_token()
+        start = time.time()
+        access_token = self.generate_access_token(client_id, data)
         token_type = self.token_type
         expires_in = self.token_expires_in
         refresh_token = self.generate_refresh_token()
+        self._observe_stage('generate_tokens', 'authorization_code', start)
 
         # Save information to be used to validate later requests
-        result = yield gen.Task(self.persist_token_information, client_id=client_id,
+        result = yield gen.Task(self._timed, 'persist_token_information',
+                                'authorization_code',
+                                self.persist_token_information, client_id=client_id,
                                        access_token=access_token,
                                        token_type=token_type,
                                        expires_in=expires_in,
                                        refresh_token=refresh_token,
                                        data=data)
 
-        # Return json response
-#         return self._make_json_response({
-#             'access_token': access_token,
-#             'token_type': token_type,
-#             'expires_in': expires_in,
-#             'refresh_token': refresh_token
-#         })
-        
         if callback:
             r = {
                 'access_token': access_token,
@@ -431,7 +857,301 @@ class AuthorizationProvider(Provider):
                 'expires_in': expires_in,
                 'refresh_token': refresh_token
                 }
-            callback(r)
+            callback(self._make_json_response(r))
+
+    def generate_user_code(self):
+        """Generate a user code, as shown by devices.
+
+        :rtype: str
+        """
+        return utils.random_user_code(8)
+
+    @gen.engine
+    def get_device_code(self, client_id, scope='', callback=None, **params):
+        """Generate a device authorization HTTP response.
+
+        :param client_id: Client ID.
+        :type client_id: str
+        :param scope: Desired scope.
+        :type scope: str
+        :rtype: Response
+        """
+        client = yield gen.Task(self._timed, 'load_client',
+                                DEVICE_CODE_GRANT_TYPE,
+                                self.get_client_context, client_id)
+        if not client.is_valid:
+            err = 'invalid_client'
+        elif not self.check_scope(client, scope):
+            err = 'invalid_scope'
+        else:
+            err = None
+
+        if err is not None:
+            if callback:
+                callback(self._make_json_error_response(err))
+            return
+
+        store = self._require_token_store('get_device_code')
+        device_code = self._random_token()
+        expires_in = self.device_code_expires_in
+        data = {'client_id': client_id, 'scope': self.normalize_scope(scope),
+                'status': 'pending',
+                'expires_at': int(time.time()) + expires_in}
+        saved = False
+        # Retry on the rare user code collision
+        for attempt in xrange(3):
+            user_code = self.generate_user_code()
+            saved = yield gen.Task(self._timed, 'persist_device_code',
+                                   DEVICE_CODE_GRANT_TYPE,
+                                   store.save_device_code, client_id,
+                                   device_code, user_code, data,
+                                   expires_in + self.device_code_retention)
+            if saved:
+                break
+        if not saved:
+            if callback:
+                callback(self._make_json_error_response('server_error'))
+            return
+
+        if callback:
+            verification_uri = self.device_verification_uri
+            shown_code = '%s-%s' % (user_code[:4], user_code[4:])
+            r = {
+                'device_code': device_code,
+                'user_code': shown_code,
+                'verification_uri': verification_uri,
+                'verification_uri_complete': utils.build_url(
+                    verification_uri, {'user_code': shown_code}),
+                'expires_in': expires_in,
+                'interval': self.device_poll_interval,
+            }
+            callback(self._make_json_response(r))
+
+    def _device_code_expired(self, data):
+        expires_at = data.get('expires_at')
+        return expires_at is not None and expires_at <= time.time()
+
+    @gen.engine
+    def get_device_token(self, grant_type, client_id, device_code,
+                         client_secret=None, callback=None, **params):
+        """Generate access token HTTP response for a device, once its user
+        approved it.
+
+        With a device_notifier, requests of a device still waiting for its
+        user are held up to device_poll_timeout seconds and answered as
+        soon as the user decides. Devices polling again less than
+        device_poll_interval seconds after the end of their previous
+        request are answered slow_down.
+
+        :param grant_type: Desired grant type. Must be
+            DEVICE_CODE_GRANT_TYPE.
+        :type grant_type: str
+        :param client_id: Client ID.
+        :type client_id: str
+        :param device_code: Device code.
+        :type device_code: str
+        :param client_secret: Client secret, optional as devices are
+            usually public clients.
+        :type client_secret: str
+        :rtype: Response
+        """
+        client = yield gen.Task(self._timed, 'load_client', grant_type,
+                                self.get_client_context, client_id)
+        if grant_type != DEVICE_CODE_GRANT_TYPE:
+            err = 'unsupported_grant_type'
+        elif not client.is_valid or (
+                client_secret is not None and
+                not self.check_client_secret(client, client_secret)):
+            err = 'invalid_client'
+        else:
+            err = None
+
+        if err is not None:
+            if callback:
+                callback(self._make_json_error_response(err))
+            return
+
+        store = self._require_token_store('get_device_token')
+        notifier = self.device_notifier
+        hold = self.device_poll_timeout if notifier is not None else 0
+        allowed = yield gen.Task(self._timed, 'poll_device_code', grant_type,
+                                 store.poll_device_code, client_id,
+                                 device_code, self.device_poll_interval + hold)
+        if not allowed:
+            if callback:
+                callback(self._make_json_error_response('slow_down'))
+            return
+
+        data = yield gen.Task(self._timed, 'get_device_code', grant_type,
+                              store.get_device_code, client_id, device_code)
+        if hold and data is not None and data.get('status') == 'pending' \
+                and not self._device_code_expired(data):
+            start = time.time()
+            # Not past the expiration of the code
+            if data.get('expires_at') is not None:
+                hold = min(hold, data['expires_at'] - start)
+            yield gen.Task(notifier.wait, device_code, hold)
+            self._observe_stage('wait_device_code', grant_type, start)
+            # Read again even when not notified, in case the decision came
+            # between the read above and the wait
+            data = yield gen.Task(self._timed, 'get_device_code', grant_type,
+                                  store.get_device_code, client_id,
+                                  device_code)
+
+        if data is None:
+            # Never issued, used, or expired longer than
+            # device_code_retention ago
+            err = 'invalid_grant'
+        elif self._device_code_expired(data):
+            err = 'expired_token'
+        elif data.get('status') == 'denied':
+            err = 'access_denied'
+        elif data.get('status') != 'approved':
+            err = 'authorization_pending'
+        else:
+            # Only one request gets the tokens of a device code
+            data = yield gen.Task(self._timed, 'consume_device_code',
+                                  grant_type, store.consume_device_code,
+                                  client_id, device_code)
+            err = 'invalid_grant' if data is None else None
+
+        if err is not None:
+            if callback:
+                callback(self._make_json_error_response(err))
+            return
+
+        grant = {'client_id': client_id, 'scope': data.get('scope', ''),
+                 'user_id': data.get('user_id')}
+
+        # Generate access tokens once all conditions have been met
+        start = time.time()
+        access_token = self.generate_access_token(client_id, grant)
+        token_type = self.token_type
+        expires_in = self.token_expires_in
+        refresh_token = self.generate_refresh_token()
+        self._observe_stage('generate_tokens', grant_type, start)
+
+        # Save information to be used to validate later requests
+        yield gen.Task(self._timed, 'persist_token_information', grant_type,
+                       self.persist_token_information, client_id=client_id,
+                       access_token=access_token,
+                       token_type=token_type,
+                       expires_in=expires_in,
+                       refresh_token=refresh_token,
+                       data=grant)
+
+        if callback:
+            r = {
+                'access_token': access_token,
+                'token_type': token_type,
+                'expires_in': expires_in,
+                'refresh_token': refresh_token
+                }
+            callback(self._make_json_response(r))
+
+    @gen.engine
+    def get_client_credentials_token(self, grant_type, client_id,
+                                     client_secret, callback=None, **params):
+        """Generate access token HTTP response for a client acting on its
+        own behalf. No refresh token is issued.
+
+        With client_credentials_min_expires_in set, the latest token of
+        the client for the same scope is answered again while it is valid
+        for long enough, instead of writing a new one on every request.
+
+        :param grant_type: Desired grant type. Must be "client_credentials".
+        :type grant_type: str
+        :param client_id: Client ID.
+        :type client_id: str
+        :param client_secret: Client secret.
+        :type client_secret: str
+        :rtype: Response
+        """
+        scope = params.get('scope', '')
+
+        client = yield gen.Task(self._timed, 'load_client', grant_type,
+                                self.get_client_context, client_id)
+        if grant_type != 'client_credentials':
+            err = 'unsupported_grant_type'
+        elif not (client.is_valid and
+                  self.check_client_secret(client, client_secret)):
+            err = 'invalid_client'
+        elif not self.check_scope(client, scope):
+            err = 'invalid_scope'
+        else:
+            err = None
+
+        if err is not None:
+            if callback:
+                callback(self._make_json_error_response(err))
+            return
+
+        store = self._require_token_store('get_client_credentials_token')
+        scope = self.normalize_scope(scope)
+        token_type = self.token_type
+        min_expires_in = self.client_credentials_min_expires_in
+        found = None
+        if min_expires_in is not None:
+            found = yield gen.Task(self._timed, 'get_client_token', grant_type,
+                                   store.get_client_token, client_id, scope,
+                                   min_expires_in)
+
+        if found is not None:
+            access_token, expires_in = found
+        else:
+            grant = {'client_id': client_id, 'scope': scope,
+                     'grant_type': grant_type}
+            start = time.time()
+            access_token = self.generate_access_token(client_id, grant)
+            expires_in = self.token_expires_in
+            self._observe_stage('generate_tokens', grant_type, start)
+
+            yield gen.Task(self._timed, 'persist_token_information',
+                           grant_type, store.save_client_token, client_id,
+                           access_token, expires_in, grant)
+
+        if callback:
+            callback(self._make_json_response({
+                'access_token': access_token,
+                'token_type': token_type,
+                'expires_in': expires_in
+            }))
+
+    @gen.engine
+    def approve_device(self, user_code, approved=True, user_id=None,
+                       callback=None):
+        """Record the decision of a user about the device showing
+        user_code, and wake up the device's waiting token request.
+
+        :param user_code: User code as typed by the user.
+        :type user_code: str
+        :param approved: Whether the user approved the device.
+        :type approved: bool
+        :param user_id: User Id, stored with the tokens.
+        :type user_id: str
+        :rtype: bool, False for unknown or expired user codes
+        """
+        store = self._require_token_store('approve_device')
+        user_code = utils.normalize_user_code(user_code)
+        ref = yield gen.Task(store.get_user_code, user_code)
+        data = None
+        if ref is not None:
+            data = yield gen.Task(store.get_device_code, ref['client_id'],
+                                  ref['device_code'])
+
+        updated = False
+        if data is not None and data.get('status') == 'pending' and \
+                not self._device_code_expired(data):
+            data = dict(data, status='approved' if approved else 'denied',
+                        user_id=user_id)
+            updated = yield gen.Task(store.update_device_code,
+                                     ref['client_id'], ref['device_code'],
+                                     data)
+            # User codes are used once
+            yield gen.Task(store.delete_user_code, user_code)
+
+        if callback:
+            callback(updated)
 
     @gen.engine
     def get_authorization_code_from_uri(self, uri, callback=None):
@@ -441,8 +1161,9 @@ class AuthorizationProvider(Provider):
 
         :param uri: URI to parse for authorization information.
         :type uri: str
-        :rtype: requests.Response
+        :rtype: Response
         """
+        start = time.time()
         params = utils.url_query_params(uri)
         try:
             if 'response_type' not in params:
@@ -455,6 +1176,8 @@ class AuthorizationProvider(Provider):
                 raise TypeError('Missing parameter redirect_uri in URL query')
             
             result = yield gen.Task(self.get_authorization_code, **params)
+            self._count_request('authorize', params.get('response_type'),
+                                result, start)
 
             if callback:
                 callback(result)
@@ -462,23 +1185,22 @@ class AuthorizationProvider(Provider):
         except TypeError as exc:
             self._handle_exception(exc)
 
-            # Catch missing parameters in request
-            err = 'invalid_request'
-            if 'redirect_uri' in params:
-                u = params['redirect_uri']
-                raise
-#                 return self._make_redirect_error_response(u, err)
-            else:
-                raise
-#                 return self._invalid_redirect_uri_response()
-        except StandardError as exc:
+            # Catch missing parameters in request. The redirect_uri was not
+            # validated, so answer directly instead of redirecting.
+            result = self._invalid_redirect_uri_response()
+            self._count_request('authorize', params.get('response_type'),
+                                result, start)
+            if callback:
+                callback(result)
+        except Exception as exc:
             self._handle_exception(exc)
 
-            # Catch all other server errors
-            err = 'server_error'
-            u = params['redirect_uri']
-            raise
-#             return self._make_redirect_error_response(u, err)
+            # Catch all other server errors, Redis errors and timeouts too
+            result = self._make_json_error_response('server_error')
+            self._count_request('authorize', params.get('response_type'),
+                                result, start)
+            if callback:
+                callback(result)
 
     @gen.engine
     def get_token_from_post_data(self, data, callback=None):
@@ -486,25 +1208,43 @@ class AuthorizationProvider(Provider):
 
         :param data: POST data containing authorization information.
         :type data: dict
-        :rtype: requests.Response
+        :rtype: Response
         """
+        start = time.time()
         try:
+            # Handle get token from device_code, devices may be public
+            # clients without a secret
+            if data.get('grant_type') == DEVICE_CODE_GRANT_TYPE:
+                for x in ['client_id', 'device_code']:
+                    if not data.get(x):
+                        raise TypeError("Missing required OAuth 2.0 POST param: {0}".format(x))
+                result = yield gen.Task(self.get_device_token, **data)
+                self._count_request('token', data.get('grant_type'), result,
+                                    start)
+                if callback:
+                    callback(result)
+                return
+
             # Verify OAuth 2.0 Parameters
             for x in ['grant_type', 'client_id', 'client_secret']:
                 if not data.get(x):
                     raise TypeError("Missing required OAuth 2.0 POST param: {0}".format(x))
             
+            # Handle get token from client_credentials
+            if data['grant_type'] == 'client_credentials':
+                result = yield gen.Task(self.get_client_credentials_token,
+                                        **data)
             # Handle get token from refresh_token
-            if 'refresh_token' in data:
-                pass
-#                 return self.refresh_token(**data)
+            elif 'refresh_token' in data:
+                result = yield gen.Task(self.refresh_token, **data)
+            else:
+                # Handle get token from authorization code
+                for x in ['redirect_uri', 'code']:
+                    if not data.get(x):
+                        raise TypeError("Missing required OAuth 2.0 POST param: {0}".format(x))
+                result = yield gen.Task(self.get_token, **data)
+            self._count_request('token', data.get('grant_type'), result, start)
 
-            # Handle get token from authorization code
-            for x in ['redirect_uri', 'code']:
-                if not data.get(x):
-                    raise TypeError("Missing required OAuth 2.0 POST param: {0}".format(x))            
-            result = yield gen.Task(self.get_token, **data)
-            
             if callback:
                 callback(result)
             
@@ -512,58 +1252,393 @@ class AuthorizationProvider(Provider):
             self._handle_exception(exc)
 
             # Catch missing parameters in request
-#             return self._make_json_error_response('invalid_request')
-        except StandardError as exc:
+            result = self._make_json_error_response('invalid_request')
+            self._count_request('token', data.get('grant_type'), result, start)
+            if callback:
+                callback(result)
+        except Exception as exc:
+            self._handle_exception(exc)
+
+            # Catch all other server errors, Redis errors and timeouts too
+            result = self._make_json_error_response('server_error')
+            self._count_request('token', data.get('grant_type'), result, start)
+            if callback:
+                callback(result)
+
+    @gen.engine
+    def get_device_code_from_post_data(self, data, callback=None):
+        """Get a device authorization response from POST data.
+
+        :param data: POST data containing client_id and optionally scope.
+        :type data: dict
+        :rtype: Response
+        """
+        start = time.time()
+        try:
+            if not data.get('client_id'):
+                raise TypeError('Missing required OAuth 2.0 POST param: client_id')
+
+            result = yield gen.Task(self.get_device_code, **data)
+            self._count_request('device', DEVICE_CODE_GRANT_TYPE, result,
+                                start)
+
+            if callback:
+                callback(result)
+
+        except TypeError as exc:
+            self._handle_exception(exc)
+
+            # Catch missing parameters in request
+            result = self._make_json_error_response('invalid_request')
+            self._count_request('device', DEVICE_CODE_GRANT_TYPE, result,
+                                start)
+            if callback:
+                callback(result)
+        except Exception as exc:
+            self._handle_exception(exc)
+
+            # Catch all other server errors, Redis errors and timeouts too
+            result = self._make_json_error_response('server_error')
+            self._count_request('device', DEVICE_CODE_GRANT_TYPE, result,
+                                start)
+            if callback:
+                callback(result)
+
+    @gen.engine
+    def introspect_tokens(self, access_tokens, callback=None):
+        """Describe access tokens like RFC 7662 token introspection, all
+        of them fetched from the token store at once.
+
+        :param access_tokens: Access tokens.
+        :type access_tokens: list
+        :rtype: list of dicts with "active" and, for active tokens,
+            "client_id", "scope" and "exp"
+        """
+        store = self._require_token_store('introspect_tokens')
+        entries = yield gen.Task(self._timed, 'get_access_tokens', None,
+                                 store.get_access_tokens, access_tokens)
+
+        now = time.time()
+        result = []
+        for data in entries:
+            if data is None or data.get('exp', now + 1) <= now:
+                result.append({'active': False})
+                continue
+            info = {
+                'active': True,
+                'client_id': data.get('client_id'),
+                'scope': data.get('scope'),
+            }
+            # Tokens issued before exp was stored do not have it
+            if 'exp' in data:
+                info['exp'] = int(data['exp'])
+            result.append(info)
+
+        if callback:
+            callback(result)
+
+    @gen.engine
+    def get_introspection_from_post_data(self, data, callback=None):
+        """Get a token introspection response from POST data.
+
+        The caller authenticates with client_id and client_secret. A
+        single token is given in token and answered with a RFC 7662
+        object; a batch is given in tokens, separated by spaces, and
+        answered with {"tokens": [object, ...]} in the same order.
+
+        :param data: POST data.
+        :type data: dict
+        :rtype: Response
+        """
+        start = time.time()
+        try:
+            # Verify parameters
+            for x in ['client_id', 'client_secret']:
+                if not data.get(x):
+                    raise TypeError("Missing required POST param: {0}".format(x))
+            if data.get('token'):
+                access_tokens = [data['token']]
+            else:
+                access_tokens = data.get('tokens', '').split()
+            if not access_tokens:
+                raise TypeError('Missing required POST param: token or tokens')
+            if len(access_tokens) > self.introspection_batch_size:
+                raise TypeError('More than {0} tokens'.format(
+                    self.introspection_batch_size))
+
+            client = yield gen.Task(self._timed, 'load_client', None,
+                                    self.get_client_context, data['client_id'])
+            if not (client.is_valid and
+                    self.check_client_secret(client, data['client_secret'])):
+                result = self._make_json_error_response('invalid_client')
+            else:
+                tokens = yield gen.Task(self.introspect_tokens, access_tokens)
+                if data.get('token'):
+                    result = self._make_json_response(tokens[0])
+                else:
+                    result = self._make_json_response({'tokens': tokens})
+            self._count_request('introspect', None, result, start)
+
+            if callback:
+                callback(result)
+
+        except TypeError as exc:
+            self._handle_exception(exc)
+
+            # Catch missing parameters in request
+            result = self._make_json_error_response('invalid_request')
+            self._count_request('introspect', None, result, start)
+            if callback:
+                callback(result)
+        except Exception as exc:
             self._handle_exception(exc)
 
-            # Catch all other server errors
-#             return self._make_json_error_response('server_error')
+            # Catch all other server errors, Redis errors and timeouts too
+            result = self._make_json_error_response('server_error')
+            self._count_request('introspect', None, result, start)
+            if callback:
+                callback(result)
 
+    @gen.engine
     def validate_client_id(self, client_id, callback=None):
-        raise NotImplementedError('Subclasses must implement ' \
-                                  'validate_client_id.')
+        """Check that the client_id represents a valid application.
+
+        :param client_id: Client id.
+        :type client_id: str
+        :rtype: client record if valid else None
+        """
+        client = yield gen.Task(self.get_client_context, client_id)
 
+        if callback:
+            callback(client.record)
+
+    @gen.engine
     def validate_client_secret(self, client_id, client_secret, callback=None):
-        raise NotImplementedError('Subclasses must implement ' \
-                                  'validate_client_secret.')
+        """Check that the client secret matches the application secret.
+
+        :param client_id: Client Id.
+        :type client_id: str
+        :param client_secret: Client secret.
+        :type client_secret: str
+        :rtype: bool
+        """
+        client = yield gen.Task(self.get_client_context, client_id)
+
+        if callback:
+            callback(client.is_valid and
+                     self.check_client_secret(client, client_secret))
 
+    @gen.engine
     def validate_redirect_uri(self, client_id, redirect_uri, callback=None):
-        raise NotImplementedError('Subclasses must implement ' \
-                                  'validate_redirect_uri.')
+        """Validate that the redirect_uri requested is available for the app.
+
+        :param client_id: Client id.
+        :type client_id: str
+        :param redirect_uri: Redirect URI.
+        :type redirect_uri: str
+        :rtype: bool
+        """
+        client = yield gen.Task(self.get_client_context, client_id)
 
+        if callback:
+            callback(client.is_valid and
+                     self.check_redirect_uri(client, redirect_uri))
+
+    @gen.engine
     def validate_scope(self, client_id, scope, callback=None):
+        """Validate that the scope requested is available for the app.
+
+        :param client_id: Client id.
+        :type client_id: str
+        :param scope: Requested scope.
+        :type scope: str
+        :rtype: bool
+        """
+        client = yield gen.Task(self.get_client_context, client_id)
+
+        if callback:
+            callback(client.is_valid and self.check_scope(client, scope))
+
+    def load_client(self, client_id, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'load_client.')
+
+    def check_client_secret(self, client, client_secret):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'check_client_secret.')
+
+    def check_redirect_uri(self, client, redirect_uri):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'check_redirect_uri.')
+
+    def check_scope(self, client, scope):
         raise NotImplementedError('Subclasses must implement ' \
-                                  'validate_scope.')
+                                  'check_scope.')
+
+    def normalize_scope(self, scope):
+        """Return the form of a checked scope stored in grant data, e.g.
+        with its names sorted.
+
+        :param scope: Requested scope.
+        :type scope: str
+        :rtype: str
+        """
+        return scope
+
+    def check_refresh_scope(self, granted_scope, scope):
+        """Validate that a scope requested on refresh is a subset of the
+        scope of the original grant, as RFC 6749 section 6 allows.
+
+        :param granted_scope: Scope of the grant, as stored in grant data.
+        :type granted_scope: str
+        :param scope: Requested scope.
+        :type scope: str
+        :rtype: bool
+        """
+        return set(scope.split()) <= set(granted_scope.split())
 
     def validate_access(self):
         raise NotImplementedError('Subclasses must implement ' \
                                   'validate_access.')
 
+    def _require_token_store(self, name):
+        store = self.token_store
+        if store is None:
+            raise NotImplementedError('Subclasses must implement %s ' \
+                                      'or token_store.' % name)
+        return store
+
     def from_authorization_code(self, client_id, code, callback=None):
-        raise NotImplementedError('Subclasses must implement ' \
-                                  'from_authorization_code.')
+        store = self._require_token_store('from_authorization_code')
+        store.get_authorization_code(client_id, code, callback=callback)
 
+    @gen.engine
     def from_refresh_token(self, client_id, refresh_token, scope, callback=None):
-        raise NotImplementedError('Subclasses must implement ' \
-                                  'from_refresh_token.')
+        store = self._require_token_store('from_refresh_token')
+        data = yield gen.Task(store.get_refresh_token, client_id, refresh_token)
+
+        # Validate scope and client_id. The new tokens are granted the
+        # requested scope, which may be narrower than the original one.
+        if data is not None and not (
+                (scope == '' or
+                 self.check_refresh_scope(data.get('scope', ''), scope)) and
+                data.get('client_id') == client_id):
+            data = None
+        elif data is not None and scope:
+            data = dict(data, scope=self.normalize_scope(scope))
+
+        if callback:
+            callback(data)
 
     def persist_authorization_code(self, client_id, code, scope, callback=None):
-        raise NotImplementedError('Subclasses must implement ' \
-                                  'persist_authorization_code.')
+        store = self._require_token_store('persist_authorization_code')
+        data = {'client_id': client_id, 'scope': scope}
+        store.save_authorization_code(client_id, code, data,
+                                      self.authorization_code_expires_in,
+                                      callback=callback)
 
     def persist_token_information(self, client_id, access_token,
                                   token_type, expires_in, refresh_token,
                                   data, callback=None):
-        raise NotImplementedError('Subclasses must implement ' \
-                                  'persist_token_information.')
+        store = self._require_token_store('persist_token_information')
+        store.save_tokens(client_id, access_token, expires_in, refresh_token,
+                          data, self.refresh_token_expires_in,
+                          callback=callback)
 
     def discard_authorization_code(self, client_id, code, callback=None):
-        raise NotImplementedError('Subclasses must implement ' \
-                                  'discard_authorization_code.')
+        store = self._require_token_store('discard_authorization_code')
+        store.delete_authorization_code(client_id, code, callback=callback)
 
     def discard_refresh_token(self, client_id, refresh_token, callback=None):
-        raise NotImplementedError('Subclasses must implement ' \
-                                  'discard_refresh_token.')
+        store = self._require_token_store('discard_refresh_token')
+        store.delete_refresh_token(client_id, refresh_token, callback=callback)
+
+    @gen.engine
+    def revoke_access_token(self, access_token, callback=None):
+        """Delete an access token. Signed tokens are also added to the
+        store's revocations, as resource servers verify them locally.
+
+        :param access_token: Access token.
+        :type access_token: str
+        """
+        store = self._require_token_store('revoke_access_token')
+        result = yield gen.Task(store.delete_access_token, access_token)
+        yield gen.Task(self._revoke_signed_tokens, [access_token])
+
+        if callback:
+            callback(result)
+
+    @gen.engine
+    def _revoke_signed_tokens(self, access_tokens, callback=None):
+        signer = self.token_signer
+        if signer is not None:
+            store = self.token_store
+            for access_token in access_tokens:
+                claims = signer.verify(access_token)
+                if claims is not None:
+                    yield gen.Task(store.add_revocation, claims['jti'],
+                                   claims['exp'])
+
+        if callback:
+            callback(None)
+
+    @gen.engine
+    def discard_client_user_tokens(self, client_id, user_id, callback=None):
+        """Revoke the access and refresh tokens of an app user.
+
+        :param client_id: Client Id.
+        :type client_id: str
+        :param user_id: User Id.
+        :type user_id: str
+        :rtype: int
+        """
+        store = self._require_token_store('discard_client_user_tokens')
+        deleted, access_tokens = yield gen.Task(
+            store.delete_client_user_tokens, client_id, user_id)
+        yield gen.Task(self._revoke_signed_tokens, access_tokens)
+
+        if callback:
+            callback(deleted)
+
+    @gen.engine
+    def revoke_client_tokens(self, client_id, cursor=None, batch_size=100,
+                             progress=None, callback=None):
+        """Revoke every code and token of a client, e.g. when its secret
+        leaked.
+
+        Codes and tokens are deleted in batches, returning to the IOLoop
+        between two batches, so that requests served by the same process
+        are not held up. After each batch progress, when given, is called
+        with the cursor to pass to resume the revocation, None once it is
+        complete, and the number of codes and tokens deleted so far.
+
+        :param client_id: Client Id.
+        :type client_id: str
+        :param cursor: Cursor to resume an interrupted revocation from.
+        :param batch_size: Batch size hint, see
+            toroauth2.store.TokenStore.delete_client_tokens.
+        :type batch_size: int
+        :param progress: Called with (cursor, deleted) after each batch.
+        :type progress: callable
+        :rtype: int
+        """
+        store = self._require_token_store('revoke_client_tokens')
+        deleted = 0
+        while True:
+            cursor, count, access_tokens = yield gen.Task(
+                store.delete_client_tokens, client_id, cursor, batch_size)
+            yield gen.Task(self._revoke_signed_tokens, access_tokens)
+            deleted += count
+            if progress is not None:
+                progress(cursor, deleted)
+            if cursor is None:
+                break
+            yield gen.Task(IOLoop.current().add_callback)
+
+        logging.info('Revoked %d codes and tokens of client %s', deleted,
+                     client_id)
+        if callback:
+            callback(deleted)
 
 
 class OAuthError(Unauthorized):
@@ -602,12 +1677,55 @@ class ResourceProvider(Provider):
             # Set is_valid=True, client_id, and expires_in attributes
             #   on authorization if authorization was successful.
             # Return value is ignored
+
+    Signed access tokens are verified locally, without calling
+    validate_access_token, when token_signer is overridden. Revoked
+    signed tokens are rejected if revocation_list is overridden too.
     """
 
     @property
     def authorization_class(self):
         return ResourceAuthorization
 
+    @property
+    def token_signer(self):
+        """Property method to get the signer used to verify self-contained
+        access tokens, or None.
+
+        :rtype: toroauth2.signing.TokenSigner
+        """
+        return None
+
+    @property
+    def revocation_list(self):
+        """Property method to get the list of revoked signed tokens, or
+        None.
+
+        :rtype: toroauth2.signing.RevocationList
+        """
+        return None
+
+    def validate_signed_access_token(self, access_token, authorization):
+        """Validate a self-contained access token with no I/O.
+
+        :param access_token: Signed access token.
+        :type access_token: str
+        :param authorization: Authorization to update.
+        :type authorization: ResourceAuthorization
+        """
+        claims = self.token_signer.verify(access_token)
+        if claims is None:
+            return
+
+        revocation_list = self.revocation_list
+        if revocation_list is not None and \
+                revocation_list.is_revoked(claims.get('jti')):
+            return
+
+        authorization.is_valid = True
+        authorization.client_id = claims.get('client_id')
+        authorization.expires_in = int(claims['exp'] - time.time())
+
     def get_authorization(self):
         """Get authorization object representing status of authentication."""
         auth = self.authorization_class()
@@ -618,7 +1736,11 @@ class ResourceProvider(Provider):
         if len(header) > 1 and header[0] == 'Bearer':
             auth.is_oauth = True
             access_token = header[1]
-            self.validate_access_token(access_token, auth)
+            # Opaque tokens never contain a dot, signed tokens always do
+            if self.token_signer is not None and '.' in access_token:
+                self.validate_signed_access_token(access_token, auth)
+            else:
+                self.validate_access_token(access_token, auth)
             if not auth.is_valid:
                 auth.error = 'access_denied'
         return auth
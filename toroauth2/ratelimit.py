@@ -0,0 +1,166 @@
+import itertools
+import logging
+import math
+import time
+from collections import OrderedDict
+
+import tornado.gen as gen
+
+# KEYS: window. ARGV: current time in milliseconds, window length in
+# milliseconds, requests allowed per window, unique request id. Returns
+# 0 when the request is allowed, otherwise the milliseconds to wait.
+SLIDING_WINDOW = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return math.max(1, tonumber(oldest[2]) + window - now)
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], window)
+return 0
+"""
+
+
+class _Bucket(object):
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, tokens, updated_at):
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+
+class TokenBuckets(object):
+    """Token bucket per key, in the memory of the current process.
+
+    Each key may spend burst requests at once, then rate requests per
+    second. Checking a key costs a dict lookup and a few additions. At
+    most max_keys buckets are kept, the least recently used are dropped
+    first, so keys made up by callers cost constant time and memory.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000, clock=time.time):
+        """
+        :param rate: Requests per second allowed to each key.
+        :type rate: float
+        :param burst: Requests a key may make at once.
+        :type burst: int
+        :param max_keys: Number of keys tracked, the least recently used
+            are forgotten first.
+        :type max_keys: int
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key):
+        """Spend a request of key.
+
+        :param key: Rate limited key, e.g. a client id.
+        :type key: str
+        :rtype: float, 0 when allowed, otherwise the seconds to wait
+        """
+        now = self.clock()
+        # Pop and insert again to keep the buckets in order of use
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+            bucket = _Bucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens +
+                                (now - bucket.updated_at) * self.rate)
+            bucket.updated_at = now
+        self._buckets[key] = bucket
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0
+        return (1 - bucket.tokens) / self.rate
+
+
+class SlidingWindow(object):
+    """Requests per key over a sliding window, counted in Redis so that
+    the limit holds across processes and servers.
+
+    Each check is one script round trip. When Redis fails, requests are
+    allowed.
+    """
+
+    key = 'oauth2.rate_limit:%s'
+
+    def __init__(self, pool, limit, window):
+        """
+        :param pool: Redis pool.
+        :type pool: toroauth2.pool.RedisPool
+        :param limit: Requests allowed to each key per window.
+        :type limit: int
+        :param window: Window length in seconds.
+        :type window: float
+        """
+        self.pool = pool
+        self.limit = limit
+        self.window = window
+        self._ids = itertools.count()
+        self.errors = 0
+
+    @gen.engine
+    def take(self, key, callback=None):
+        now = int(time.time() * 1000)
+        request_id = '%d:%d' % (now, next(self._ids))
+        try:
+            wait = yield gen.Task(self.pool.execute_script, SLIDING_WINDOW,
+                                  [self.key % key],
+                                  [now, int(self.window * 1000), self.limit,
+                                   request_id])
+            wait = int(wait or 0) / 1000.0
+        except Exception as exc:
+            logging.warning('Rate limit check failed for %s: %s', key, exc)
+            self.errors += 1
+            wait = 0
+
+        if callback:
+            callback(wait)
+
+
+class RateLimiter(object):
+    """Per-client rate limit: the TokenBuckets of the process first, so
+    clients over their limit are turned away without any round trip,
+    then an optional SlidingWindow shared by all processes.
+    """
+
+    def __init__(self, buckets, window=None):
+        """
+        :param buckets: Limit of each process.
+        :type buckets: TokenBuckets
+        :param window: Limit shared by all processes, or None.
+        :type window: SlidingWindow
+        """
+        self.buckets = buckets
+        self.window = window
+        self.limited = 0
+
+    @gen.engine
+    def check(self, key, callback=None):
+        """Spend a request of key.
+
+        :param key: Rate limited key, e.g. a client id.
+        :type key: str
+        :rtype: int, 0 when allowed, otherwise the seconds to wait
+            (rounded up, as sent in Retry-After)
+        """
+        wait = self.buckets.take(key)
+        if not wait and self.window is not None:
+            wait = yield gen.Task(self.window.take, key)
+        if wait:
+            self.limited += 1
+            wait = int(math.ceil(wait))
+
+        if callback:
+            callback(wait)
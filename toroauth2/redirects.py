@@ -0,0 +1,159 @@
+import logging
+import re
+import urlparse
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Characters browsers ignore or read as '/', which would make a URI
+# redirect elsewhere than it reads
+_UNSAFE = re.compile(r'[\x00-\x20\x7f\\]')
+_ESCAPED_DOT = re.compile(r'%2e', re.IGNORECASE)
+
+PREFIX_SUFFIX = '/*'
+
+
+def _remove_dot_segments(path):
+    output = []
+    for segment in path.split('/'):
+        if segment == '..':
+            if len(output) > 1:
+                output.pop()
+        elif segment != '.':
+            output.append(segment)
+    if path.endswith(('/.', '/..')):
+        output.append('')
+    return '/'.join(output)
+
+
+def _split(uri):
+    """Return the (origin, path) of a normalized URI, or None."""
+    if not uri or _UNSAFE.search(uri) or '#' in uri:
+        return None
+    parts = urlparse.urlsplit(uri)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if not scheme or '@' in netloc:
+        return None
+    if not netloc:
+        # Private-use schemes of native apps, e.g. com.example.app:/cb
+        if scheme in DEFAULT_PORTS:
+            return None
+        origin = scheme + ':'
+    else:
+        try:
+            port = parts.port
+        except ValueError:
+            return None
+        host = netloc
+        if port is not None or netloc.endswith(':'):
+            host = netloc[:netloc.rindex(':')]
+        if port is not None and port != DEFAULT_PORTS.get(scheme):
+            host = '%s:%d' % (host, port)
+        origin = '%s://%s' % (scheme, host)
+
+    # Browsers resolve escaped dots too
+    path = _remove_dot_segments(_ESCAPED_DOT.sub('.', parts.path))
+    if netloc and not path:
+        path = '/'
+    return origin, path
+
+
+def normalize_redirect_uri(uri):
+    """Normalize a redirect URI for comparison: lower case scheme and
+    host, no default port, no dot segments, no query.
+
+    :param uri: Redirect URI.
+    :type uri: str
+    :rtype: str, None for URIs never redirected to, e.g. with a fragment
+    """
+    split = _split(uri)
+    if split is None:
+        return None
+    return split[0] + split[1]
+
+
+class _Node(object):
+    __slots__ = ('children', 'terminal')
+
+    def __init__(self):
+        self.children = {}
+        self.terminal = False
+
+
+class RedirectURIs(object):
+    """Redirect URIs registered for an application, compiled for
+    matching in time linear in the length of the requested URI.
+
+    Registered URIs match exactly, after normalization of both sides. A
+    URI ending with '/*' matches its path and every path below it, on
+    whole path segments: https://a.example/cb/* matches /cb and /cb/x,
+    not /cbx.
+    """
+
+    def __init__(self, uris):
+        """
+        :param uris: Registered redirect URIs; invalid ones are skipped.
+        :type uris: list
+        """
+        self._exact = set()
+        self._prefixes = {}
+        self._prefix_count = 0
+        for uri in uris:
+            if not isinstance(uri, basestring):
+                pass
+            elif uri.endswith(PREFIX_SUFFIX):
+                split = _split(uri[:-len(PREFIX_SUFFIX)] + '/')
+                if split is not None:
+                    self._add_prefix(*split)
+                    continue
+            else:
+                normalized = normalize_redirect_uri(uri)
+                if normalized is not None and '*' not in normalized:
+                    self._exact.add(normalized)
+                    continue
+            logging.warning('Ignoring invalid redirect URI %r', uri)
+
+    def _add_prefix(self, origin, path):
+        node = self._prefixes.get(origin)
+        if node is None:
+            node = self._prefixes[origin] = _Node()
+        for segment in path.split('/')[1:-1]:
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _Node()
+            node = child
+        if not node.terminal:
+            node.terminal = True
+            self._prefix_count += 1
+
+    def __len__(self):
+        return len(self._exact) + self._prefix_count
+
+    def match(self, uri):
+        """Whether uri may be redirected to. Its query is ignored.
+
+        :param uri: Requested redirect URI.
+        :type uri: str
+        :rtype: bool
+        """
+        split = _split(uri)
+        if split is None:
+            return False
+        origin, path = split
+        if origin + path in self._exact:
+            return True
+
+        node = self._prefixes.get(origin)
+        if node is None:
+            return False
+        if node.terminal:
+            return True
+        for segment in path.split('/')[1:]:
+            node = node.children.get(segment)
+            if node is None:
+                return False
+            if node.terminal:
+                return True
+        return False
+
+    __contains__ = match
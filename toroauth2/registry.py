@@ -0,0 +1,263 @@
+import datetime
+import logging
+import time
+
+import tornado.gen as gen
+from bson.son import SON
+from tornado.ioloop import IOLoop
+
+
+class ApplicationRegistry(object):
+    """Every client application of a Mongo collection, held in memory so
+    that looking one up is a dict lookup.
+
+    :meth:`start` loads the whole collection, then polls it every
+    poll_interval seconds for the applications whose modified_field
+    changed, and loads it whole again every reload_interval seconds to
+    drop the deleted ones. Writers must set modified_field whenever they
+    change an application. Each load or poll builds a new snapshot aside
+    and swaps it in once complete, so lookups never see a partial one.
+
+    Applications created since the last poll are missing; callers should
+    fall back to looking them up, see provider.py.
+    """
+
+    def __init__(self, collection, key='app_key', modified_field='updated_at',
+                 fields=None, compile=None, batch_size=1000, poll_interval=10,
+                 reload_interval=3600, overlap=60, metrics=None,
+                 io_loop=None):
+        """
+        :param collection: Mongo collection of the applications.
+        :type collection: mongotor.orm.collection.Collection
+        :param key: Field holding the client id.
+        :type key: str
+        :param modified_field: Field holding the modification time, a
+            datetime or a number of seconds.
+        :type modified_field: str
+        :param fields: Fields kept in memory, None for whole documents.
+        :type fields: list
+        :param compile: Called with every document loaded, returns the
+            record kept, e.g. with precomputed lookups.
+        :type compile: callable
+        :param batch_size: Documents fetched per query.
+        :type batch_size: int
+        :param poll_interval: Seconds between two polls.
+        :type poll_interval: float
+        :param reload_interval: Seconds between two whole loads.
+        :type reload_interval: float
+        :param overlap: Seconds of changes fetched again by every poll,
+            to catch the writes that raced the previous one.
+        :type overlap: float
+        :param metrics: Registry timing the queries.
+        :type metrics: toroauth2.metrics.Registry
+        """
+        self.collection = collection
+        self.key = key
+        self.modified_field = modified_field
+        self.fields = fields
+        self.compile = compile
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.reload_interval = reload_interval
+        self.overlap = overlap
+        self.metrics = metrics
+        self.io_loop = io_loop
+
+        self._applications = {}
+        # Client id -> modification time of the loaded application
+        self._versions = {}
+        self._since = None
+        self._loaded_at = None
+        self._timeout = None
+        self._on_loaded = None
+
+        self.loads = 0
+        self.polls = 0
+        self.updated = 0
+        self.errors = 0
+
+    def __len__(self):
+        return len(self._applications)
+
+    def __contains__(self, client_id):
+        return client_id in self._applications
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def get(self, client_id):
+        """Return the application of client_id.
+
+        :param client_id: Client id.
+        :type client_id: str
+        :rtype: dict if loaded else None
+        """
+        return self._applications.get(client_id)
+
+    def start(self, callback=None):
+        """Load the applications now, then keep them up to date.
+
+        :param callback: Called with the number of applications once the
+            first load succeeded.
+        :type callback: callable
+        """
+        self._on_loaded = callback
+        if self._timeout is None:
+            if self.io_loop is None:
+                self.io_loop = IOLoop.current()
+            self._schedule(0)
+
+    def stop(self):
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+    def _schedule(self, delay):
+        self._timeout = self.io_loop.add_timeout(time.time() + delay,
+                                                 self._step)
+
+    @gen.engine
+    def _step(self):
+        try:
+            if self._loaded_at is None or \
+                    time.time() - self._loaded_at >= self.reload_interval:
+                yield gen.Task(self.load)
+            else:
+                yield gen.Task(self.poll)
+        except Exception:
+            # Lookups keep the current snapshot, try again on the next step
+            logging.exception('Error refreshing applications')
+            self.errors += 1
+
+        if self._on_loaded is not None and self.loaded:
+            callback, self._on_loaded = self._on_loaded, None
+            callback(len(self._applications))
+
+        if self._timeout is not None:
+            self._schedule(self.poll_interval)
+
+    @gen.engine
+    def _find_all(self, spec, sort, next_spec, callback=None):
+        """Get every document matching spec, batch_size at a time;
+        next_spec(last document) is the spec of the page after it.
+
+        :rtype: list, None on error
+        """
+        documents = []
+        while True:
+            start = time.time()
+            page, error = yield gen.Task(self.collection.find, spec,
+                                         fields=self.fields, sort=sort,
+                                         limit=self.batch_size)
+            if self.metrics is not None:
+                self.metrics.observe('mongo_query_seconds',
+                                     time.time() - start,
+                                     collection='application')
+            if error:
+                logging.error('Error loading applications: %s', error)
+                self.errors += 1
+                documents = None
+                break
+
+            # Replies may hold fewer than limit documents, only an empty
+            # page is the last one
+            if not page:
+                break
+            documents.extend(page)
+            spec = next_spec(page[-1])
+
+        callback(documents)
+
+    def _add(self, applications, versions, documents):
+        since = self._since
+        for document in documents:
+            modified_at = document.get(self.modified_field)
+            if modified_at is not None and (since is None or
+                                            modified_at > since):
+                since = modified_at
+            record = document if self.compile is None else \
+                self.compile(document)
+            applications[document[self.key]] = record
+            versions[document[self.key]] = modified_at
+        self._since = since
+
+    @gen.engine
+    def load(self, callback=None):
+        """Load every application into a new snapshot.
+
+        :rtype: int, the number of applications, None on error
+        """
+        documents = yield gen.Task(
+            self._find_all, {}, SON([('_id', 1)]),
+            lambda last: {'_id': {'$gt': last['_id']}})
+
+        count = None
+        if documents is not None:
+            applications = {}
+            versions = {}
+            self._add(applications, versions, documents)
+            self._applications = applications
+            self._versions = versions
+            self._loaded_at = time.time()
+            self.loads += 1
+            count = len(applications)
+            logging.info('Loaded %d applications', count)
+
+        if callback:
+            callback(count)
+
+    @gen.engine
+    def poll(self, callback=None):
+        """Apply the changes made since the previous load or poll.
+
+        :rtype: int, the number of applications updated, None on error
+        """
+        field = self.modified_field
+        since = self._since
+        if since is None:
+            # No application had been modified yet, any that has is new
+            spec = {field: {'$exists': True}}
+        elif isinstance(since, datetime.datetime):
+            spec = {field: {'$gte': since -
+                            datetime.timedelta(seconds=self.overlap)}}
+        else:
+            spec = {field: {'$gte': since - self.overlap}}
+
+        documents = yield gen.Task(
+            self._find_all, spec, SON([(field, 1), ('_id', 1)]),
+            lambda last: {'$or': [
+                {field: {'$gt': last[field]}},
+                {field: last[field], '_id': {'$gt': last['_id']}}]})
+
+        count = None
+        if documents is not None:
+            # Skip the overlap already applied
+            versions = self._versions
+            documents = [document for document in documents
+                         if document[self.key] not in versions or
+                         versions[document[self.key]] !=
+                         document.get(field)]
+            count = len(documents)
+            if documents:
+                # Copy on write, lookups keep the previous snapshot until
+                # the new one is complete
+                applications = dict(self._applications)
+                versions = dict(versions)
+                self._add(applications, versions, documents)
+                self._applications = applications
+                self._versions = versions
+                self.updated += count
+            self.polls += 1
+
+        if callback:
+            callback(count)
+
+    def stats(self):
+        return {
+            'applications': len(self._applications),
+            'loads': self.loads,
+            'polls': self.polls,
+            'updated': self.updated,
+            'errors': self.errors,
+        }
@@ -0,0 +1,111 @@
+class ScopeRegistry(object):
+    """Interns scope names as bits, so that a set of scopes is an int and
+    checking that requested scopes were allowed is a single and.
+
+    Bits are assigned in order of registration and differ between
+    processes: store scopes as :meth:`normalize` strings, which are the
+    same everywhere, and turn them into masks with :meth:`mask` or
+    :meth:`register`, cached by string.
+    """
+
+    def __init__(self, max_cached=10000):
+        """
+        :param max_cached: Scope strings whose mask is cached.
+        :type max_cached: int
+        """
+        self.max_cached = max_cached
+        self._bits = {}
+        self._names = []
+        self._masks = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def _cache(self, scope, mask):
+        if len(self._masks) >= self.max_cached:
+            self._masks.clear()
+        self._masks[scope] = mask
+
+    def register(self, scope):
+        """Intern every name of scope.
+
+        :param scope: Space separated scope names.
+        :type scope: str
+        :rtype: int, the mask of scope
+        """
+        mask = self._masks.get(scope)
+        if mask is None:
+            mask = 0
+            for name in scope.split():
+                bit = self._bits.get(name)
+                if bit is None:
+                    bit = self._bits[name] = 1 << len(self._names)
+                    self._names.append(name)
+                mask |= bit
+            self._cache(scope, mask)
+        return mask
+
+    def mask(self, scope):
+        """Return the mask of scope, without interning new names, e.g. for
+        scopes requested by clients.
+
+        :param scope: Space separated scope names.
+        :type scope: str
+        :rtype: int, None when a name was never registered
+        """
+        mask = self._masks.get(scope)
+        if mask is None:
+            mask = 0
+            for name in scope.split():
+                bit = self._bits.get(name)
+                if bit is None:
+                    return None
+                mask |= bit
+            self._cache(scope, mask)
+        return mask
+
+    def names(self, mask):
+        """
+        :param mask: Mask of scopes.
+        :type mask: int
+        :rtype: list, the names of mask sorted
+        """
+        return sorted(name for index, name in enumerate(self._names)
+                      if mask >> index & 1)
+
+    def normalize(self, scope):
+        """Return the canonical form of scope, its names sorted and
+        deduplicated, as stored in grant data.
+
+        :param scope: Space separated scope names.
+        :type scope: str
+        :rtype: str
+        """
+        return ' '.join(sorted(set(scope.split())))
+
+    def allows(self, allowed, scope):
+        """Whether every name of scope is in the allowed mask.
+
+        :param allowed: Mask of the allowed scopes.
+        :type allowed: int
+        :param scope: Requested scope.
+        :type scope: str
+        :rtype: bool
+        """
+        mask = self.mask(scope)
+        return mask is not None and not mask & ~allowed
+
+    def contains(self, scope, name):
+        """Whether granted scope includes name, e.g. for resource servers
+        checking the scope of a token. Granted scopes are trusted and
+        registered.
+
+        :param scope: Granted scope, as stored in grant data.
+        :type scope: str
+        :param name: Scope name.
+        :type name: str
+        :rtype: bool
+        """
+        mask = self.register(scope)
+        bit = self._bits.get(name)
+        return bit is not None and bool(mask & bit)
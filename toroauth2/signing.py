@@ -0,0 +1,152 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from . import utils
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class TokenSigner(object):
+    """Issue and verify self-contained, HMAC-SHA256 signed access tokens.
+
+    A token reads ``<payload>.<key id>.<signature>``, where the payload is
+    the URL-safe base64 encoded JSON claims. Keys are looked up by id, so
+    a new key can be introduced while tokens signed with the previous one
+    are still verified.
+    """
+
+    def __init__(self, keys, key_id):
+        """
+        :param keys: Secret keys by key id.
+        :type keys: dict
+        :param key_id: Id of the key used to sign new tokens.
+        :type key_id: str
+        """
+        if key_id not in keys:
+            raise ValueError('Unknown signing key id: %s' % key_id)
+        self.keys = dict(keys)
+        self.key_id = key_id
+
+    def _signature(self, key_id, signing_input):
+        digest = hmac.new(self.keys[key_id], signing_input, hashlib.sha256)
+        return _b64encode(digest.digest())
+
+    def sign(self, claims):
+        """Return a signed token carrying the claims.
+
+        :param claims: Token claims, must contain "exp".
+        :type claims: dict
+        :rtype: str
+        """
+        payload = _b64encode(json.dumps(claims, separators=(',', ':'),
+                                        sort_keys=True))
+        signing_input = '%s.%s' % (payload, self.key_id)
+        return '%s.%s' % (signing_input,
+                          self._signature(self.key_id, signing_input))
+
+    def verify(self, token, now=None):
+        """Return the claims of a valid, unexpired token.
+
+        :param token: Signed token.
+        :type token: str
+        :param now: Current time in seconds, defaults to time.time().
+        :type now: float
+        :rtype: dict if valid else None
+        """
+        try:
+            payload, key_id, signature = token.encode('ascii').split('.')
+        except (UnicodeError, ValueError):
+            return None
+
+        if key_id not in self.keys:
+            return None
+
+        expected = self._signature(key_id, '%s.%s' % (payload, key_id))
+        if not hmac.compare_digest(expected, signature):
+            return None
+
+        try:
+            claims = json.loads(_b64decode(payload))
+        except (TypeError, ValueError):
+            return None
+
+        if claims.get('exp', 0) <= (now or time.time()):
+            return None
+        return claims
+
+    def make_claims(self, client_id, data, expires_in):
+        """Build the claims of an access token for a grant.
+
+        :param client_id: Client ID.
+        :type client_id: str
+        :param data: Data from the grant.
+        :type data: dict
+        :param expires_in: Access token expiration seconds.
+        :type expires_in: int
+        :rtype: dict
+        """
+        return {
+            'client_id': client_id,
+            'scope': data.get('scope', ''),
+            'sub': data.get('user_id'),
+            'exp': int(time.time()) + expires_in,
+            'jti': utils.random_ascii_string(16),
+        }
+
+
+class RevocationList(object):
+    """Ids of revoked signed tokens.
+
+    Entries are only kept until the token would have expired anyway, so
+    the list stays as small as the number of tokens revoked within one
+    access token lifetime.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def revoke(self, jti, expires_at):
+        """Revoke a token.
+
+        :param jti: Token id.
+        :type jti: str
+        :param expires_at: Expiration time of the token.
+        :type expires_at: float
+        """
+        self._entries[jti] = expires_at
+
+    def update(self, entries):
+        """Revoke several tokens at once.
+
+        :param entries: (jti, expires_at) pairs.
+        :type entries: iterable
+        """
+        self._entries.update(entries)
+
+    def is_revoked(self, jti):
+        """
+        :param jti: Token id.
+        :type jti: str
+        :rtype: bool
+        """
+        return jti in self._entries
+
+    def purge(self):
+        """Forget revoked tokens that have expired since."""
+        now = self.clock()
+        for jti, expires_at in self._entries.items():
+            if expires_at <= now:
+                del self._entries[jti]
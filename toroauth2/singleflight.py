@@ -0,0 +1,158 @@
+import logging
+from collections import OrderedDict
+
+from tornado import stack_context
+
+
+def _reraise(exc_info):
+    raise exc_info[0], exc_info[1], exc_info[2]
+
+
+class _Flight(object):
+    __slots__ = ('waiters', 'done', 'deactivate')
+
+    def __init__(self):
+        # (callback, errback) pairs, each wrapped in its caller's context
+        self.waiters = []
+        self.done = False
+        self.deactivate = None
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls for the same key: while a call is in
+    flight, callers asking for the same key wait for its result instead
+    of sending the same query again.
+
+    Results are handed to every waiter as is, so they must not be
+    modified. When the call raises, the exception is raised again in the
+    context of each waiter. A call shares its result with max_waiters
+    callers at most; the next ones start a new call, so a hot key costs
+    one backend call per max_waiters requests instead of one per request.
+    """
+
+    def __init__(self, max_waiters=1000, max_keys=1000, name=None,
+                 metrics=None):
+        """
+        :param max_waiters: Callers sharing a single call at most.
+        :type max_waiters: int
+        :param max_keys: Keys whose statistics are kept, the least
+            recently called are dropped first.
+        :type max_keys: int
+        :param name: Label of the metrics counted, e.g. 'load_client'.
+        :type name: str
+        :param metrics: Registry counting the calls and shared results.
+        :type metrics: toroauth2.metrics.Registry
+        """
+        self.max_waiters = max_waiters
+        self.max_keys = max_keys
+        self.name = name
+        self.metrics = metrics
+        self._flights = {}
+        self._keys = OrderedDict()
+
+        self.calls = 0
+        self.shared = 0
+        self.overflows = 0
+        self.errors = 0
+
+    def __len__(self):
+        return len(self._flights)
+
+    def _key_stats(self, key):
+        stats = self._keys.pop(key, None)
+        if stats is None:
+            stats = {'calls': 0, 'shared': 0, 'max_waiters': 0}
+            if len(self._keys) >= self.max_keys:
+                self._keys.popitem(last=False)
+        self._keys[key] = stats
+        return stats
+
+    def call(self, key, func, *args, **kwargs):
+        """Call func(*args, callback=..., **kwargs), unless a call for key
+        is in flight already, and pass its result to callback.
+
+        :param key: Key of the result, e.g. a client id.
+        :type key: str
+        :param func: Asynchronous function.
+        :type func: callable
+        """
+        callback = kwargs.pop('callback')
+        waiter = (stack_context.wrap(callback), stack_context.wrap(_reraise))
+        stats = self._key_stats(key)
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            if len(flight.waiters) < self.max_waiters:
+                flight.waiters.append(waiter)
+                stats['shared'] += 1
+                stats['max_waiters'] = max(stats['max_waiters'],
+                                           len(flight.waiters))
+                self.shared += 1
+                if self.metrics is not None:
+                    self.metrics.increment('coalesced_calls_total',
+                                           call=self.name)
+                return
+            # Leave the full flight to its waiters, later callers share
+            # the new one
+            self.overflows += 1
+
+        flight = self._flights[key] = _Flight()
+        flight.waiters.append(waiter)
+        stats['calls'] += 1
+        self.calls += 1
+
+        def done(result=None):
+            self._finish(key, flight, result)
+
+        def failed(type, value, traceback):
+            if flight.done:
+                logging.error('Uncaught exception in the call of %r', key,
+                              exc_info=(type, value, traceback))
+            else:
+                self.errors += 1
+                self._finish(key, flight, None, (type, value, traceback))
+            return True
+
+        # The call belongs to no single caller: run it in a context of its
+        # own, which hands its exceptions to every waiter
+        with stack_context.NullContext():
+            with stack_context.ExceptionStackContext(failed) as deactivate:
+                flight.deactivate = deactivate
+                func(*args, callback=done, **kwargs)
+
+    def _finish(self, key, flight, result, exc_info=None):
+        if flight.done:
+            return
+        flight.done = True
+        if flight.deactivate is not None:
+            flight.deactivate()
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+        for callback, errback in flight.waiters:
+            # A waiter failing must not keep the result from the others
+            try:
+                if exc_info is None:
+                    callback(result)
+                else:
+                    errback(exc_info)
+            except Exception:
+                logging.exception('Uncaught exception in a waiter of %r', key)
+
+    def stats(self, key=None):
+        """Return the counters of all keys, or of a single one.
+
+        :param key: Key, None for the totals.
+        :type key: str
+        :rtype: dict
+        """
+        if key is not None:
+            return dict(self._keys.get(key) or
+                        {'calls': 0, 'shared': 0, 'max_waiters': 0})
+        return {
+            'in_flight': len(self._flights),
+            'calls': self.calls,
+            'shared': self.shared,
+            'overflows': self.overflows,
+            'errors': self.errors,
+        }
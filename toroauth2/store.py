@@ -0,0 +1,1218 @@
+import json
+import re
+import time
+import zlib
+
+import tornado.gen as gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from . import signing
+from .codec import CompactCodec
+from .hashring import HashRing
+from .singleflight import SingleFlight
+from .timerwheel import TimerWheel
+
+CLIENT_TAG_LENGTH = 8
+
+
+def client_tag(client_id):
+    """Return the fixed length tag routing the keys of a client.
+
+    :param client_id: Client ID.
+    :type client_id: str
+    :rtype: str
+    """
+    if isinstance(client_id, unicode):
+        client_id = client_id.encode('utf-8')
+    return '%08x' % (zlib.crc32(client_id) & 0xffffffff)
+
+
+class TokenStore(object):
+    """Storage of authorization codes, tokens and their grant data.
+
+    An AuthorizationProvider with a token_store uses it for all of its
+    persistence hooks. Every method is asynchronous and answers through
+    callback.
+    """
+
+    def save_authorization_code(self, client_id, code, data, expires_in,
+                                callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'save_authorization_code.')
+
+    def get_authorization_code(self, client_id, code, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'get_authorization_code.')
+
+    def consume_authorization_code(self, client_id, code, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'consume_authorization_code.')
+
+    def delete_authorization_code(self, client_id, code, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'delete_authorization_code.')
+
+    def save_tokens(self, client_id, access_token, expires_in, refresh_token,
+                    data, refresh_expires_in=None, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'save_tokens.')
+
+    def get_access_token(self, access_token, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'get_access_token.')
+
+    def save_client_token(self, client_id, access_token, expires_in, data,
+                          callback=None):
+        """Save an access token of the client itself, without refresh
+        token, indexed by client and scope for :meth:`get_client_token`.
+
+        :param data: Grant data, its scope normalized.
+        :type data: dict
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'save_client_token.')
+
+    def get_client_token(self, client_id, scope, min_expires_in,
+                         callback=None):
+        """Get the latest access token saved by :meth:`save_client_token`
+        for client_id and scope, unless it expires in less than
+        min_expires_in seconds or was deleted.
+
+        :rtype: (access token, seconds left) tuple, or None
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'get_client_token.')
+
+    def get_access_tokens(self, access_tokens, callback=None):
+        """Get the grant data of several access tokens at once.
+
+        :param access_tokens: Access tokens.
+        :type access_tokens: list
+        :rtype: list of grant data, None for unknown tokens
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'get_access_tokens.')
+
+    def get_refresh_token(self, client_id, refresh_token, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'get_refresh_token.')
+
+    def rotate_refresh_token(self, client_id, refresh_token, access_token,
+                             expires_in, new_refresh_token, data,
+                             refresh_expires_in=None, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'rotate_refresh_token.')
+
+    def delete_access_token(self, access_token, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'delete_access_token.')
+
+    def delete_refresh_token(self, client_id, refresh_token, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'delete_refresh_token.')
+
+    def access_token_prefix(self, client_id):
+        """Return the string opaque access tokens of client_id must start
+        with.
+
+        :param client_id: Client ID.
+        :type client_id: str
+        :rtype: str
+        """
+        return ''
+
+    def add_revocation(self, jti, expires_at, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'add_revocation.')
+
+    def get_revocations(self, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'get_revocations.')
+
+    def save_device_code(self, client_id, device_code, user_code, data,
+                         expires_in, callback=None):
+        """Save the codes of a device authorization request, unless
+        user_code is already in use.
+
+        :rtype: bool
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'save_device_code.')
+
+    def get_device_code(self, client_id, device_code, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'get_device_code.')
+
+    def update_device_code(self, client_id, device_code, data,
+                           callback=None):
+        """Replace the data of a device code, keeping its expiration time,
+        and notify the subscribers of :meth:`subscribe_device_codes`.
+
+        :rtype: bool, False when the device code expired
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'update_device_code.')
+
+    def consume_device_code(self, client_id, device_code, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'consume_device_code.')
+
+    def poll_device_code(self, client_id, device_code, interval,
+                         callback=None):
+        """Record a poll of a device code.
+
+        :param interval: Seconds before the next poll is allowed.
+        :type interval: int
+        :rtype: bool, False when the previous poll was less than its
+            interval ago
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'poll_device_code.')
+
+    def get_user_code(self, user_code, callback=None):
+        """
+        :rtype: dict with the client_id and device_code of user_code, or
+            None
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'get_user_code.')
+
+    def delete_user_code(self, user_code, callback=None):
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'delete_user_code.')
+
+    def subscribe_device_codes(self, callback):
+        """Call callback with the device code of every update, including
+        those made by other processes.
+
+        :param callback: Called with a device code.
+        :type callback: callable
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'subscribe_device_codes.')
+
+    def delete_client_user_tokens(self, client_id, user_id, callback=None):
+        """Delete the access and refresh tokens of an app user.
+
+        :param client_id: Client ID.
+        :type client_id: str
+        :param user_id: User ID.
+        :type user_id: str
+        :rtype: (number of codes and tokens deleted, deleted access
+            tokens) tuple
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'delete_client_user_tokens.')
+
+    def delete_client_tokens(self, client_id, cursor=None, count=100,
+                             callback=None):
+        """Delete a batch of the codes and tokens of a client. Call again
+        with the returned cursor until it is None to delete all of them.
+
+        :param client_id: Client ID.
+        :type client_id: str
+        :param cursor: Cursor returned by the previous call, None to start.
+        :param count: Batch size hint, in app users or keys.
+        :type count: int
+        :rtype: (cursor, number of codes and tokens deleted, deleted access
+            tokens) tuple
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'delete_client_tokens.')
+
+    def sweep_indexes(self, cursor=None, count=100, callback=None):
+        """Remove the expired tokens from up to about count client_user
+        indexes. Call again with the returned cursor until it is None to
+        sweep every index once.
+
+        :param cursor: Cursor returned by the previous call, None to start
+            a new pass.
+        :param count: Indexes to look at.
+        :type count: int
+        :rtype: (cursor, number of entries removed) tuple
+        """
+        raise NotImplementedError('Subclasses must implement ' \
+                                  'sweep_indexes.')
+
+
+# Shared by the scripts below. ARGV: access token expiration seconds,
+# grant data, current time, refresh token expiration seconds or 0 for
+# none, access token data (the grant data and its expiration time,
+# "exp"). The client_user index is a sorted set of token keys scored by
+# their expiration time; indexes of earlier releases are sets, converted
+# on their first write.
+_TOKEN_FUNCTIONS = """
+local access_ttl = tonumber(ARGV[1])
+local now = tonumber(ARGV[3])
+local refresh_ttl = tonumber(ARGV[4])
+
+local function migrate_index(index)
+    if redis.call('TYPE', index).ok ~= 'set' then
+        return
+    end
+    local members = redis.call('SMEMBERS', index)
+    redis.call('DEL', index)
+    for _, member in ipairs(members) do
+        local ttl = redis.call('TTL', member)
+        if ttl == -1 then
+            redis.call('ZADD', index, '+inf', member)
+        elseif ttl >= 0 then
+            redis.call('ZADD', index, now + ttl, member)
+        end
+    end
+end
+
+local function save_tokens(access, refresh, index)
+    migrate_index(index)
+    redis.call('SETEX', access, access_ttl, ARGV[5])
+    redis.call('ZADD', index, now + access_ttl, access)
+    if refresh_ttl > 0 then
+        redis.call('SETEX', refresh, refresh_ttl, ARGV[2])
+        redis.call('ZADD', index, now + refresh_ttl, refresh)
+        -- Never expires an index holding refresh tokens that never
+        -- expire, as migrated from earlier releases
+        local ttl = redis.call('TTL', index)
+        local index_ttl = math.max(access_ttl, refresh_ttl)
+        if (ttl == -1 and
+                redis.call('ZCOUNT', index, '+inf', '+inf') == 0) or
+                (ttl >= 0 and ttl < index_ttl) then
+            redis.call('EXPIRE', index, index_ttl)
+        end
+    else
+        redis.call('SET', refresh, ARGV[2])
+        redis.call('ZADD', index, '+inf', refresh)
+        redis.call('PERSIST', index)
+    end
+end
+"""
+
+# KEYS: access token, refresh token, client_user index.
+SAVE_TOKENS = _TOKEN_FUNCTIONS + """
+save_tokens(KEYS[1], KEYS[2], KEYS[3])
+return 1
+"""
+
+# KEYS: used refresh token, access token, new refresh token, client_user
+# index.
+ROTATE_REFRESH_TOKEN = _TOKEN_FUNCTIONS + """
+if redis.call('DEL', KEYS[1]) == 0 then
+    return 0
+end
+migrate_index(KEYS[4])
+redis.call('ZREM', KEYS[4], KEYS[1])
+save_tokens(KEYS[2], KEYS[3], KEYS[4])
+return 1
+"""
+
+# KEYS: access token, client_user index, client token index. ARGV as
+# above, then the scope and the access token. The client_user index
+# expires with its last token, unless it holds a refresh token that
+# never expires. The client token index is a hash of the latest token of
+# each scope, which lives as long as the newest of them.
+SAVE_CLIENT_TOKEN = _TOKEN_FUNCTIONS + """
+migrate_index(KEYS[2])
+redis.call('SETEX', KEYS[1], access_ttl, ARGV[5])
+redis.call('ZADD', KEYS[2], now + access_ttl, KEYS[1])
+local ttl = redis.call('TTL', KEYS[2])
+if (ttl == -1 and redis.call('ZCOUNT', KEYS[2], '+inf', '+inf') == 0) or
+        (ttl >= 0 and ttl < access_ttl) then
+    redis.call('EXPIRE', KEYS[2], access_ttl)
+end
+redis.call('HSET', KEYS[3], ARGV[6], ARGV[7])
+if redis.call('TTL', KEYS[3]) < access_ttl then
+    redis.call('EXPIRE', KEYS[3], access_ttl)
+end
+return 1
+"""
+
+# KEYS: client token index. ARGV: scope, minimum seconds left, key of
+# the access tokens without the token. The access token is looked up too,
+# so that deleted tokens are never handed out. Its key is not declared,
+# no more than the index members migrate_index and DELETE_INDEXED_TOKENS
+# touch: it starts with the {tag} prefix of the client too, which keeps
+# it on the same shard and in the same Redis Cluster slot as KEYS[1].
+GET_CLIENT_TOKEN = """
+local token = redis.call('HGET', KEYS[1], ARGV[1])
+if not token then
+    return false
+end
+local ttl = redis.call('TTL', ARGV[3] .. token)
+if ttl < tonumber(ARGV[2]) then
+    return false
+end
+return {token, ttl}
+"""
+
+# KEYS: client_user index. Deletes the indexed tokens and the index, and
+# returns the keys deleted.
+DELETE_INDEXED_TOKENS = """
+local members
+if redis.call('TYPE', KEYS[1]).ok == 'set' then
+    members = redis.call('SMEMBERS', KEYS[1])
+else
+    members = redis.call('ZRANGE', KEYS[1], 0, -1)
+end
+local deleted = {}
+for _, member in ipairs(members) do
+    if redis.call('DEL', member) == 1 then
+        deleted[#deleted + 1] = member
+    end
+end
+redis.call('DEL', KEYS[1])
+return deleted
+"""
+
+# KEYS: device code. ARGV: new data, channel to publish the device code
+# on, device code. Keeps the expiration time, fails once expired.
+UPDATE_DEVICE_CODE = """
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl <= 0 then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ttl)
+redis.call('PUBLISH', ARGV[2], ARGV[3])
+return 1
+"""
+
+
+def _escape_pattern(value):
+    """Escape the glob characters of value for a SCAN match pattern."""
+    return re.sub(r'([*?\[\]\\])', r'\\\1', value)
+
+
+class RedisTokenStore(TokenStore):
+    """Token store on Redis, through a toroauth2.pool.RedisPool."""
+
+    authorization_code_key = 'oauth2.authorization_code.%s:%s'
+    access_token_key = 'oauth2.access_token:%s'
+    refresh_token_key = 'oauth2.refresh_token.%s:%s'
+    client_user_key = 'oauth2.client_user.%s:%s'
+    client_token_key = 'oauth2.client_token:%s'
+    revocations_key = 'oauth2.revoked_access_tokens'
+    device_code_key = 'oauth2.device_code.%s:%s'
+    device_poll_key = 'oauth2.device_poll.%s:%s'
+    user_code_key = 'oauth2.user_code:%s'
+    device_codes_channel = 'oauth2.device_codes'
+
+    def __init__(self, pool, codec=None, metrics=None):
+        """
+        :param pool: Redis pool.
+        :type pool: toroauth2.pool.RedisPool
+        :param codec: Serialization of grant data, defaults to
+            toroauth2.codec.CompactCodec. Values of any format are read.
+        :type codec: toroauth2.codec.Codec
+        :param metrics: Registry counting the coalesced reads.
+        :type metrics: toroauth2.metrics.Registry
+        """
+        self.pool = pool
+        self.codec = codec or CompactCodec()
+        # Bearer checks of a hot token share a single GET
+        self.access_token_reads = SingleFlight(name='get_access_token',
+                                               metrics=metrics)
+
+    def _loads(self, value):
+        return self.codec.decode(value)
+
+    def _route(self, client_id):
+        """Return the pool holding the keys of a client, and the prefix of
+        those keys."""
+        return self.pool, ''
+
+    def _route_access_token(self, access_token):
+        return self.pool, ''
+
+    def _route_revocations(self):
+        return self.pool
+
+    def _route_user_code(self, user_code):
+        return self._route(user_code)
+
+    def _pools(self):
+        return [self.pool]
+
+    def _index_pools(self):
+        """Return the (pool, SCAN pattern) pairs holding the client_user
+        indexes."""
+        return [(self.pool, self.client_user_key % ('*', '*'))]
+
+    def _deleted_tokens(self, prefix, keys):
+        access_prefix = prefix + self.access_token_key % ''
+        return [key[len(access_prefix):] for key in keys
+                if key.startswith(access_prefix)]
+
+    def _script_args(self, expires_in, data, refresh_expires_in):
+        now = int(time.time())
+        return [expires_in, self.codec.encode(data), now,
+                refresh_expires_in or 0,
+                self.codec.encode(dict(data, exp=now + expires_in))]
+
+    @gen.engine
+    def save_authorization_code(self, client_id, code, data, expires_in,
+                                callback=None):
+        pool, prefix = self._route(client_id)
+        key = prefix + self.authorization_code_key % (client_id, code)
+        result = yield gen.Task(pool.execute, 'setex', key, expires_in,
+                                self.codec.encode(data))
+
+        if callback:
+            callback(result)
+
+    @gen.engine
+    def get_authorization_code(self, client_id, code, callback=None):
+        pool, prefix = self._route(client_id)
+        key = prefix + self.authorization_code_key % (client_id, code)
+        data = yield gen.Task(pool.execute, 'get', key)
+
+        if callback:
+            callback(self._loads(data))
+
+    @gen.engine
+    def consume_authorization_code(self, client_id, code, callback=None):
+        # Get and delete in the same transaction, so that a code can only
+        # be redeemed once
+        pool, prefix = self._route(client_id)
+        key = prefix + self.authorization_code_key % (client_id, code)
+        data, deleted = yield gen.Task(pool.pipeline, [
+            ('get', key),
+            ('delete', key),
+        ], transactional=True)
+
+        if callback:
+            callback(self._loads(data))
+
+    @gen.engine
+    def delete_authorization_code(self, client_id, code, callback=None):
+        pool, prefix = self._route(client_id)
+        key = prefix + self.authorization_code_key % (client_id, code)
+        result = yield gen.Task(pool.execute, 'delete', key)
+
+        if callback:
+            callback(result)
+
+    @gen.engine
+    def save_tokens(self, client_id, access_token, expires_in, refresh_token,
+                    data, refresh_expires_in=None, callback=None):
+        # Write both tokens and index them by app user for easy token
+        # revocation, in a single atomic round trip
+        pool, prefix = self._route(client_id)
+        keys = [
+            prefix + self.access_token_key % access_token,
+            prefix + self.refresh_token_key % (client_id, refresh_token),
+            prefix + self.client_user_key % (client_id, data.get('user_id')),
+        ]
+        result = yield gen.Task(pool.execute_script, SAVE_TOKENS, keys,
+                                self._script_args(expires_in, data,
+                                                  refresh_expires_in))
+
+        if callback:
+            callback(result)
+
+    @gen.engine
+    def get_access_token(self, access_token, callback=None):
+        pool, prefix = self._route_access_token(access_token)
+        # Raw values are shared, every caller decodes a dict of its own
+        data = yield gen.Task(self.access_token_reads.call, access_token,
+                              pool.execute, 'get',
+                              prefix + self.access_token_key % access_token)
+
+        if callback:
+            callback(self._loads(data))
+
+    @gen.engine
+    def save_client_token(self, client_id, access_token, expires_in, data,
+                          callback=None):
+        pool, prefix = self._route(client_id)
+        keys = [
+            prefix + self.access_token_key % access_token,
+            prefix + self.client_user_key % (client_id, data.get('user_id')),
+            prefix + self.client_token_key % client_id,
+        ]
+        result = yield gen.Task(pool.execute_script, SAVE_CLIENT_TOKEN,
+                                keys,
+                                self._script_args(expires_in, data, None) +
+                                [data.get('scope', ''), access_token])
+
+        if callback:
+            callback(result)
+
+    @gen.engine
+    def get_client_token(self, client_id, scope, min_expires_in,
+                         callback=None):
+        pool, prefix = self._route(client_id)
+        result = yield gen.Task(pool.execute_script, GET_CLIENT_TOKEN,
+                                [prefix + self.client_token_key % client_id],
+                                [scope, min_expires_in,
+                                 prefix + self.access_token_key % ''])
+
+        if callback:
+            callback(tuple(result) if result else None)
+
+    @gen.engine
+    def get_access_tokens(self, access_tokens, callback=None):
+        # One MGET per server, all sent at once
+        groups = {}
+        for position, access_token in enumerate(access_tokens):
+            pool, prefix = self._route_access_token(access_token)
+            positions, keys = groups.setdefault(pool, ([], []))
+            positions.append(position)
+            keys.append(prefix + self.access_token_key % access_token)
+        groups = groups.items()
+        replies = yield [gen.Task(pool.execute, 'mget', keys)
+                         for pool, (positions, keys) in groups]
+
+        result = [None] * len(access_tokens)
+        for (pool, (positions, keys)), values in zip(groups, replies):
+            for position, value in zip(positions, values):
+                result[position] = self._loads(value)
+
+        if callback:
+            callback(result)
+
+    @gen.engine
+    def get_refresh_token(self, client_id, refresh_token, callback=None):
+        pool, prefix = self._route(client_id)
+        key = prefix + self.refresh_token_key % (client_id, refresh_token)
+        data = yield gen.Task(pool.execute, 'get', key)
+
+        if callback:
+            callback(self._loads(data))
+
+    @gen.engine
+    def rotate_refresh_token(self, client_id, refresh_token, access_token,
+                             expires_in, new_refresh_token, data,
+                             refresh_expires_in=None, callback=None):
+        # One atomic script, which fails if the refresh token was used
+        # concurrently
+        pool, prefix = self._route(client_id)
+        keys = [
+            prefix + self.refresh_token_key % (client_id, refresh_token),
+            prefix + self.access_token_key % access_token,
+            prefix + self.refresh_token_key % (client_id, new_refresh_token),
+            prefix + self.client_user_key % (client_id, data.get('user_id')),
+        ]
+        result = yield gen.Task(pool.execute_script, ROTATE_REFRESH_TOKEN,
+                                keys, self._script_args(expires_in, data,
+                                                        refresh_expires_in))
+
+        if callback:
+            callback(result == 1)
+
+    @gen.engine
+    def delete_access_token(self, access_token, callback=None):
+        pool, prefix = self._route_access_token(access_token)
+        result = yield gen.Task(pool.execute, 'delete',
+                                prefix + self.access_token_key % access_token)
+
+        if callback:
+            callback(result)
+
+    @gen.engine
+    def delete_refresh_token(self, client_id, refresh_token, callback=None):
+        pool, prefix = self._route(client_id)
+        key = prefix + self.refresh_token_key % (client_id, refresh_token)
+        result = yield gen.Task(pool.execute, 'delete', key)
+
+        if callback:
+            callback(result)
+
+    @gen.engine
+    def add_revocation(self, jti, expires_at, callback=None):
+        pool = self._route_revocations()
+        result = yield gen.Task(pool.pipeline, [
+            ('zadd', self.revocations_key, expires_at, jti),
+            # Forget revocations of tokens that expired in the meantime
+            ('zremrangebyscore', self.revocations_key, '-inf', int(time.time())),
+        ], transactional=True)
+
+        if callback:
+            callback(result)
+
+    @gen.engine
+    def get_revocations(self, callback=None):
+        pool = self._route_revocations()
+        entries = yield gen.Task(pool.execute, 'zrangebyscore',
+                                 self.revocations_key, int(time.time()), '+inf',
+                                 with_scores=True)
+
+        if callback:
+            callback(entries)
+
+    @gen.engine
+    def save_device_code(self, client_id, device_code, user_code, data,
+                         expires_in, callback=None):
+        # Claim the user code first, they are short enough to collide
+        user_pool, user_prefix = self._route_user_code(user_code)
+        value = self.codec.encode({'client_id': client_id,
+                                   'device_code': device_code})
+        saved = yield gen.Task(user_pool.execute, 'set',
+                               user_prefix + self.user_code_key % user_code,
+                               value, expire=expires_in,
+                               only_if_not_exists=True)
+        if saved:
+            pool, prefix = self._route(client_id)
+            key = prefix + self.device_code_key % (client_id, device_code)
+            yield gen.Task(pool.execute, 'setex', key, expires_in,
+                           self.codec.encode(data))
+
+        if callback:
+            callback(bool(saved))
+
+    @gen.engine
+    def get_device_code(self, client_id, device_code, callback=None):
+        pool, prefix = self._route(client_id)
+        key = prefix + self.device_code_key % (client_id, device_code)
+        data = yield gen.Task(pool.execute, 'get', key)
+
+        if callback:
+            callback(self._loads(data))
+
+    @gen.engine
+    def update_device_code(self, client_id, device_code, data,
+                           callback=None):
+        pool, prefix = self._route(client_id)
+        key = prefix + self.device_code_key % (client_id, device_code)
+        result = yield gen.Task(pool.execute_script, UPDATE_DEVICE_CODE,
+                                [key], [self.codec.encode(data),
+                                        self.device_codes_channel,
+                                        device_code])
+
+        if callback:
+            callback(result == 1)
+
+    @gen.engine
+    def consume_device_code(self, client_id, device_code, callback=None):
+        pool, prefix = self._route(client_id)
+        key = prefix + self.device_code_key % (client_id, device_code)
+        data, deleted = yield gen.Task(pool.pipeline, [
+            ('get', key),
+            ('delete', key),
+        ], transactional=True)
+
+        if callback:
+            callback(self._loads(data))
+
+    @gen.engine
+    def poll_device_code(self, client_id, device_code, interval,
+                         callback=None):
+        pool, prefix = self._route(client_id)
+        key = prefix + self.device_poll_key % (client_id, device_code)
+        result = yield gen.Task(pool.execute, 'set', key, 1, expire=interval,
+                                only_if_not_exists=True)
+
+        if callback:
+            callback(bool(result))
+
+    @gen.engine
+    def get_user_code(self, user_code, callback=None):
+        pool, prefix = self._route_user_code(user_code)
+        data = yield gen.Task(pool.execute, 'get',
+                              prefix + self.user_code_key % user_code)
+
+        if callback:
+            callback(self._loads(data))
+
+    @gen.engine
+    def delete_user_code(self, user_code, callback=None):
+        pool, prefix = self._route_user_code(user_code)
+        result = yield gen.Task(pool.execute, 'delete',
+                                prefix + self.user_code_key % user_code)
+
+        if callback:
+            callback(result)
+
+    def subscribe_device_codes(self, callback):
+        for pool in self._pools():
+            pool.subscribe(self.device_codes_channel, callback)
+
+    @gen.engine
+    def delete_client_user_tokens(self, client_id, user_id, callback=None):
+        pool, prefix = self._route(client_id)
+        key = prefix + self.client_user_key % (client_id, user_id)
+        keys = yield gen.Task(pool.execute_script,
+                              DELETE_INDEXED_TOKENS, [key], [])
+        keys = keys or []
+
+        if callback:
+            callback((len(keys), self._deleted_tokens(prefix, keys)))
+
+    @gen.engine
+    def delete_client_tokens(self, client_id, cursor=None, count=100,
+                             callback=None):
+        # Tokens are deleted through the client_user indexes, which hold
+        # every access and refresh token, then the authorization and
+        # device codes. The cursor is the position in that list and the
+        # SCAN cursor.
+        pool, prefix = self._route(client_id)
+        escaped = _escape_pattern(client_id)
+        patterns = [
+            prefix + self.client_user_key % (escaped, '*'),
+            prefix + self.authorization_code_key % (escaped, '*'),
+            prefix + self.device_code_key % (escaped, '*'),
+        ]
+        if cursor is None:
+            # Tokens are checked on the way out, the index only saves
+            # lookups from now on
+            yield gen.Task(pool.execute, 'delete',
+                           prefix + self.client_token_key % client_id)
+        position, scan_cursor = cursor or (0, 0)
+        scan_cursor, keys = yield gen.Task(pool.execute, 'scan', scan_cursor,
+                                           count=count,
+                                           match=patterns[position])
+        deleted, access_tokens = 0, []
+        if keys and position == 0:
+            results = yield gen.Task(pool.execute_scripts,
+                                     DELETE_INDEXED_TOKENS,
+                                     [([key], []) for key in keys])
+            for result in results:
+                if isinstance(result, list):
+                    deleted += len(result)
+                    access_tokens.extend(self._deleted_tokens(prefix, result))
+        elif keys:
+            deleted = yield gen.Task(pool.execute, 'delete', *keys)
+
+        if int(scan_cursor) == 0:
+            position += 1
+            scan_cursor = 0
+        next_cursor = None
+        if position < len(patterns):
+            next_cursor = (position, scan_cursor)
+
+        if callback:
+            callback((next_cursor, deleted, access_tokens))
+
+    @gen.engine
+    def sweep_indexes(self, cursor=None, count=100, callback=None):
+        # The cursor is the position in _index_pools and the SCAN cursor
+        # of that server
+        pools = self._index_pools()
+        position, scan_cursor = cursor or (0, 0)
+        pool, pattern = pools[position]
+        scan_cursor, keys = yield gen.Task(pool.execute, 'scan', scan_cursor,
+                                           count=count, match=pattern)
+        reclaimed = 0
+        if keys:
+            # Sorted sets left empty are deleted by Redis
+            now = int(time.time())
+            results = yield gen.Task(pool.pipeline, [
+                ('zremrangebyscore', key, '-inf', now) for key in keys])
+            # Indexes of earlier releases are sets, which fail with
+            # WRONGTYPE until their next write converts them
+            reclaimed = sum(r for r in results if isinstance(r, (int, long)))
+
+        if int(scan_cursor) == 0:
+            position += 1
+            scan_cursor = 0
+        next_cursor = None
+        if position < len(pools):
+            next_cursor = (position, scan_cursor)
+
+        if callback:
+            callback((next_cursor, reclaimed))
+
+
+class ShardedRedisTokenStore(RedisTokenStore):
+    """Token store spread over several Redis servers.
+
+    Keys are routed by client through a consistent hash ring, so all the
+    keys of a grant are on the same server and are still written in one
+    transaction or script. Every key starts with the ``{tag}`` of its
+    client, which also keeps them in the same slot of a Redis Cluster.
+
+    Access tokens start with the tag of their client, see
+    :meth:`access_token_prefix`, so that they can be routed without
+    their client id. Signed access tokens are routed by the client_id
+    claim of their payload instead.
+    """
+
+    def __init__(self, pools, replicas=160, codec=None, metrics=None):
+        """
+        :param pools: Redis pools by shard name.
+        :type pools: dict
+        :param replicas: Points of every shard on the hash ring.
+        :type replicas: int
+        :param codec: Serialization of grant data.
+        :type codec: toroauth2.codec.Codec
+        :param metrics: Registry counting the coalesced reads.
+        :type metrics: toroauth2.metrics.Registry
+        """
+        self.pools = dict(pools)
+        self.codec = codec or CompactCodec()
+        self.access_token_reads = SingleFlight(name='get_access_token',
+                                               metrics=metrics)
+        self.ring = HashRing(self.pools, replicas)
+
+    def add_shard(self, name, pool):
+        """Add a Redis server. About 1 / (number of shards) of the clients
+        move to it; their existing codes and tokens stay behind on their
+        former shard, so clients have to be migrated or authorize again.
+
+        :param name: Shard name, which places the shard on the ring.
+        :type name: str
+        :param pool: Redis pool.
+        :type pool: toroauth2.pool.RedisPool
+        """
+        self.pools[name] = pool
+        self.ring.add_node(name)
+
+    def access_token_prefix(self, client_id):
+        return client_tag(client_id)
+
+    def _route_tag(self, tag):
+        return self.pools[self.ring.get_node(tag)], '{%s}' % tag
+
+    def _route(self, client_id):
+        return self._route_tag(client_tag(client_id))
+
+    def _route_access_token(self, access_token):
+        if '.' in access_token:
+            try:
+                claims = json.loads(signing._b64decode(
+                    str(access_token.split('.', 1)[0])))
+                return self._route(claims['client_id'])
+            except (TypeError, ValueError, KeyError):
+                pass
+        return self._route_tag(access_token[:CLIENT_TAG_LENGTH])
+
+    def _route_revocations(self):
+        return self.pools[self.ring.get_node(self.revocations_key)]
+
+    def _pools(self):
+        return [self.pools[name] for name in sorted(self.pools)]
+
+    def _index_pools(self):
+        pattern = '{*}' + self.client_user_key % ('*', '*')
+        return [(pool, pattern) for pool in self._pools()]
+
+
+class StoreFull(Exception):
+    """Raised when an in-memory store reached its maximum size."""
+
+
+class _Entry(object):
+    __slots__ = ('data', 'expires_at', 'index')
+
+    def __init__(self, data, expires_at, index):
+        self.data = data
+        self.expires_at = expires_at
+        self.index = index
+
+
+class MemoryTokenStore(TokenStore):
+    """Token store in the memory of the current process.
+
+    Entries live in hashed indexes keyed like the Redis keys, and expire
+    through a TimerWheel advanced once per second from the IOLoop, so no
+    scan is ever needed. Entries past their expiration time are ignored
+    on reads even before the wheel removed them. Meant for single-node
+    deployments and tests; nothing is shared between processes.
+    """
+
+    def __init__(self, max_entries=1000000, resolution=1.0, io_loop=None):
+        """
+        :param max_entries: Maximum number of codes and tokens held, see
+            :class:`StoreFull`.
+        :type max_entries: int
+        :param resolution: Seconds between two expiration passes.
+        :type resolution: float
+        """
+        self.max_entries = max_entries
+        self.resolution = resolution
+        self.io_loop = io_loop
+        self.expired = 0
+        self._entries = {}
+        self._indexes = {}
+        self._revocations = {}
+        self._device_subscribers = []
+        # (client id, scope) -> latest client token
+        self._client_tokens = {}
+        self._wheel = TimerWheel(resolution)
+        # Key -> its Timer on the wheel, cancelled on overwrite and delete
+        self._timers = {}
+        self._timer = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def start(self):
+        """Start the periodic expiration of entries."""
+        if self._timer is None:
+            self._timer = PeriodicCallback(self.expire, self.resolution * 1000,
+                                           io_loop=self.io_loop or IOLoop.current())
+            self._timer.start()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+
+    def expire(self, now=None):
+        """Drop the entries that expired since the last call.
+
+        :rtype: int
+        """
+        now = time.time() if now is None else now
+        count = 0
+        for key in self._wheel.advance(now):
+            self._timers.pop(key, None)
+            entry = self._entries.get(key)
+            # The key may have been deleted or replaced in the meantime
+            if entry is not None and entry.expires_at is not None and \
+                    entry.expires_at <= now:
+                self._delete(key)
+                count += 1
+            elif key in self._revocations and self._revocations[key] <= now:
+                del self._revocations[key]
+        self.expired += count
+        return count
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at is not None and entry.expires_at <= time.time():
+            return None
+        return entry.data
+
+    def _reserve(self, count):
+        if len(self._entries) + count > self.max_entries:
+            raise StoreFull('Token store holds %d entries' % self.max_entries)
+
+    def _set(self, key, data, expires_in=None, index=None):
+        if key not in self._entries:
+            self._reserve(1)
+        if self._timer is None:
+            self.start()
+
+        self._delete(key)
+        expires_at = None
+        if expires_in is not None:
+            expires_at = time.time() + expires_in
+            self._schedule(key, expires_at)
+        self._entries[key] = _Entry(data, expires_at, index)
+        if index is not None:
+            self._indexes.setdefault(index, set()).add(key)
+
+    def _schedule(self, key, expires_at):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            self._wheel.cancel(timer)
+        self._timers[key] = self._wheel.schedule(key, expires_at)
+
+    def _delete(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            self._wheel.cancel(timer)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        if entry.index is not None:
+            keys = self._indexes.get(entry.index)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._indexes[entry.index]
+        return True
+
+    def save_authorization_code(self, client_id, code, data, expires_in,
+                                callback=None):
+        self._set(('code', client_id, code), data, expires_in)
+        if callback:
+            callback(True)
+
+    def get_authorization_code(self, client_id, code, callback=None):
+        data = self._get(('code', client_id, code))
+        if callback:
+            callback(data)
+
+    def consume_authorization_code(self, client_id, code, callback=None):
+        key = ('code', client_id, code)
+        data = self._get(key)
+        self._delete(key)
+        if callback:
+            callback(data)
+
+    def delete_authorization_code(self, client_id, code, callback=None):
+        result = self._delete(('code', client_id, code))
+        if callback:
+            callback(result)
+
+    def save_tokens(self, client_id, access_token, expires_in, refresh_token,
+                    data, refresh_expires_in=None, callback=None):
+        index = (client_id, data.get('user_id'))
+        self._reserve(2)
+        self._set(('access', access_token),
+                  dict(data, exp=int(time.time()) + expires_in), expires_in,
+                  index)
+        self._set(('refresh', client_id, refresh_token), data,
+                  refresh_expires_in, index)
+        if callback:
+            callback(True)
+
+    def get_access_token(self, access_token, callback=None):
+        data = self._get(('access', access_token))
+        if callback:
+            callback(data)
+
+    def save_client_token(self, client_id, access_token, expires_in, data,
+                          callback=None):
+        self._set(('access', access_token),
+                  dict(data, exp=int(time.time()) + expires_in), expires_in,
+                  (client_id, data.get('user_id')))
+        self._client_tokens[(client_id, data.get('scope', ''))] = access_token
+        if callback:
+            callback(True)
+
+    def get_client_token(self, client_id, scope, min_expires_in,
+                         callback=None):
+        result = None
+        access_token = self._client_tokens.get((client_id, scope))
+        entry = self._entries.get(('access', access_token))
+        if entry is not None:
+            expires_in = int(entry.expires_at - time.time())
+            if expires_in >= min_expires_in:
+                result = (access_token, expires_in)
+        if callback:
+            callback(result)
+
+    def get_access_tokens(self, access_tokens, callback=None):
+        result = [self._get(('access', access_token))
+                  for access_token in access_tokens]
+        if callback:
+            callback(result)
+
+    def get_refresh_token(self, client_id, refresh_token, callback=None):
+        data = self._get(('refresh', client_id, refresh_token))
+        if callback:
+            callback(data)
+
+    def rotate_refresh_token(self, client_id, refresh_token, access_token,
+                             expires_in, new_refresh_token, data,
+                             refresh_expires_in=None, callback=None):
+        # Check for room first, so a full store keeps the used token
+        self._reserve(1)
+        rotated = self._delete(('refresh', client_id, refresh_token))
+        if rotated:
+            self.save_tokens(client_id, access_token, expires_in,
+                             new_refresh_token, data, refresh_expires_in)
+        if callback:
+            callback(rotated)
+
+    def delete_access_token(self, access_token, callback=None):
+        result = self._delete(('access', access_token))
+        if callback:
+            callback(result)
+
+    def delete_refresh_token(self, client_id, refresh_token, callback=None):
+        result = self._delete(('refresh', client_id, refresh_token))
+        if callback:
+            callback(result)
+
+    def add_revocation(self, jti, expires_at, callback=None):
+        self._revocations[jti] = expires_at
+        self._schedule(jti, expires_at)
+        if callback:
+            callback(True)
+
+    def get_revocations(self, callback=None):
+        now = time.time()
+        entries = [(jti, expires_at) for jti, expires_at
+                   in self._revocations.iteritems() if expires_at > now]
+        if callback:
+            callback(entries)
+
+    def save_device_code(self, client_id, device_code, user_code, data,
+                         expires_in, callback=None):
+        saved = self._get(('user_code', user_code)) is None
+        if saved:
+            self._reserve(2)
+            self._set(('user_code', user_code),
+                      {'client_id': client_id, 'device_code': device_code},
+                      expires_in)
+            self._set(('device', client_id, device_code), data, expires_in)
+        if callback:
+            callback(saved)
+
+    def get_device_code(self, client_id, device_code, callback=None):
+        data = self._get(('device', client_id, device_code))
+        if callback:
+            callback(data)
+
+    def update_device_code(self, client_id, device_code, data,
+                           callback=None):
+        key = ('device', client_id, device_code)
+        updated = self._get(key) is not None
+        if updated:
+            self._entries[key].data = data
+            for subscriber in self._device_subscribers:
+                subscriber(device_code)
+        if callback:
+            callback(updated)
+
+    def consume_device_code(self, client_id, device_code, callback=None):
+        key = ('device', client_id, device_code)
+        data = self._get(key)
+        self._delete(key)
+        if callback:
+            callback(data)
+
+    def poll_device_code(self, client_id, device_code, interval,
+                         callback=None):
+        key = ('device_poll', client_id, device_code)
+        allowed = self._get(key) is None
+        if allowed:
+            self._set(key, True, interval)
+        if callback:
+            callback(allowed)
+
+    def get_user_code(self, user_code, callback=None):
+        data = self._get(('user_code', user_code))
+        if callback:
+            callback(data)
+
+    def delete_user_code(self, user_code, callback=None):
+        result = self._delete(('user_code', user_code))
+        if callback:
+            callback(result)
+
+    def subscribe_device_codes(self, callback):
+        self._device_subscribers.append(callback)
+
+    def _delete_keys(self, keys):
+        deleted, access_tokens = 0, []
+        for key in keys:
+            if self._delete(key):
+                deleted += 1
+                if key[0] == 'access':
+                    access_tokens.append(key[1])
+        return deleted, access_tokens
+
+    def delete_client_user_tokens(self, client_id, user_id, callback=None):
+        keys = list(self._indexes.get((client_id, user_id), ()))
+        result = self._delete_keys(keys)
+        if callback:
+            callback(result)
+
+    def delete_client_tokens(self, client_id, cursor=None, count=100,
+                             callback=None):
+        # The cursor holds the keys left to delete, listed on the first
+        # call
+        if cursor is None:
+            for key in self._client_tokens.keys():
+                if key[0] == client_id:
+                    del self._client_tokens[key]
+            cursor = [key for index, keys in self._indexes.iteritems()
+                      if index[0] == client_id for key in keys]
+            cursor.extend(key for key in self._entries
+                          if key[0] in ('code', 'device') and
+                          key[1] == client_id)
+        deleted, access_tokens = self._delete_keys(cursor[:count])
+        cursor = cursor[count:] or None
+        if callback:
+            callback((cursor, deleted, access_tokens))
+
+    def sweep_indexes(self, cursor=None, count=100, callback=None):
+        # Indexes lose their keys as entries expire or are deleted, so a
+        # pass is a single expiration pass
+        reclaimed = self.expire()
+        if callback:
+            callback((None, reclaimed))
@@ -0,0 +1,125 @@
+import logging
+import time
+
+import tornado.gen as gen
+from tornado.ioloop import IOLoop
+
+
+class IndexSweeper(object):
+    """Removes the expired tokens from the client_user indexes of a token
+    store, which otherwise keep them until the app user's tokens are
+    revoked.
+
+    A pass walks every index through :meth:`TokenStore.sweep_indexes`,
+    batch_size indexes every interval seconds so that the sweep never
+    competes with requests for the store, then waits pass_interval
+    seconds before the next one. A batch that fails is retried after
+    retry_interval seconds, doubled on every further failure. Run one
+    sweeper per deployment; with pre-forked workers, in one of them.
+    """
+
+    def __init__(self, store, batch_size=100, interval=0.1, pass_interval=300,
+                 retry_interval=5, metrics=None, io_loop=None):
+        """
+        :param store: Token store to sweep.
+        :type store: toroauth2.store.TokenStore
+        :param batch_size: Indexes looked at per step.
+        :type batch_size: int
+        :param interval: Seconds between two steps of a pass.
+        :type interval: float
+        :param pass_interval: Seconds between the end of a pass and the
+            start of the next one.
+        :type pass_interval: float
+        :param retry_interval: Seconds before retrying a failed batch.
+        :type retry_interval: float
+        :param metrics: Registry counting the removed entries.
+        :type metrics: toroauth2.metrics.Registry
+        """
+        self.store = store
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pass_interval = pass_interval
+        self.retry_interval = retry_interval
+        self.metrics = metrics
+        self.io_loop = io_loop
+
+        self._timeout = None
+        self._cursor = None
+        self._pass_started_at = None
+        self._pass_reclaimed = 0
+        # Consecutive failed batches
+        self._failures = 0
+
+        self.passes = 0
+        self.reclaimed = 0
+        self.last_pass_reclaimed = 0
+        self.last_pass_seconds = 0.0
+        self.errors = 0
+
+    def start(self):
+        """Start sweeping; the first pass starts right away."""
+        if self._timeout is None:
+            if self.io_loop is None:
+                self.io_loop = IOLoop.current()
+            self._schedule(0)
+
+    def stop(self):
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+    def _schedule(self, delay):
+        self._timeout = self.io_loop.add_timeout(time.time() + delay,
+                                                 self._step)
+
+    @gen.engine
+    def _step(self):
+        if self._pass_started_at is None:
+            self._pass_started_at = time.time()
+            self._pass_reclaimed = 0
+
+        try:
+            cursor, reclaimed = yield gen.Task(self.store.sweep_indexes,
+                                               self._cursor, self.batch_size)
+        except Exception:
+            logging.exception('Error sweeping token indexes')
+            self.errors += 1
+            self._failures += 1
+            if self._timeout is not None:
+                # Keep the cursor and the pass, retry the same batch
+                self._schedule(min(
+                    self.retry_interval * 2 ** (self._failures - 1),
+                    self.pass_interval))
+            return
+
+        self._failures = 0
+        self._cursor = cursor
+        self._pass_reclaimed += reclaimed
+        self.reclaimed += reclaimed
+        if reclaimed and self.metrics is not None:
+            self.metrics.increment('oauth2_index_entries_reclaimed_total',
+                                   reclaimed)
+
+        if self._timeout is None:
+            # Stopped in the meantime
+            return
+        if cursor is not None:
+            self._schedule(self.interval)
+            return
+
+        self.passes += 1
+        self.last_pass_reclaimed = self._pass_reclaimed
+        self.last_pass_seconds = time.time() - self._pass_started_at
+        self._pass_started_at = None
+        logging.info('Swept token indexes in %.1fs, %d expired entries removed',
+                     self.last_pass_seconds, self.last_pass_reclaimed)
+        self._schedule(self.pass_interval)
+
+    def stats(self):
+        return {
+            'passes': self.passes,
+            'reclaimed': self.reclaimed,
+            'last_pass_reclaimed': self.last_pass_reclaimed,
+            'last_pass_seconds': self.last_pass_seconds,
+            'errors': self.errors,
+        }
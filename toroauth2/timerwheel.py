@@ -0,0 +1,130 @@
+import math
+import time
+
+
+class Timer(object):
+    """Handle of a scheduled key, see :meth:`TimerWheel.cancel`."""
+
+    __slots__ = ('tick', 'key', 'bucket')
+
+    def __init__(self, tick, key):
+        self.tick = tick
+        self.key = key
+        self.bucket = None
+
+
+class TimerWheel(object):
+    """Hierarchical timing wheel for key expiration.
+
+    Level 0 has one bucket per tick of ``resolution`` seconds, every
+    further level has buckets ``slots`` times wider. A key is filed in
+    the narrowest level its deadline fits in and moves down a level each
+    time the wheel below it completes a turn, so scheduling is O(1) and
+    advancing costs O(1) per tick plus the keys that move or expire,
+    however many keys are pending.
+    """
+
+    def __init__(self, resolution=1.0, slots=64, levels=4, now=None):
+        """
+        :param resolution: Seconds per tick.
+        :type resolution: float
+        :param slots: Buckets per level.
+        :type slots: int
+        :param levels: Number of levels. Deadlines beyond
+            resolution * slots ** levels seconds are filed in the last
+            level and re-filed until they are in reach.
+        :type levels: int
+        """
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        self._spans = [slots ** level for level in xrange(levels)]
+        self._wheels = [[set() for i in xrange(slots)]
+                        for level in xrange(levels)]
+        self._tick = self._to_tick(time.time() if now is None else now)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _to_tick(self, when):
+        return int(math.floor(when / self.resolution))
+
+    def schedule(self, key, expires_at):
+        """File key to be returned by :meth:`advance` once expires_at has
+        passed. Keys are not deduplicated: cancel the timer of a key before
+        scheduling it again.
+
+        :param key: Hashable key.
+        :type key: object
+        :param expires_at: Expiration time in seconds.
+        :type expires_at: float
+        :rtype: Timer
+        """
+        tick = max(int(math.ceil(expires_at / self.resolution)), self._tick + 1)
+        timer = Timer(tick, key)
+        self._file(timer)
+        self._count += 1
+        return timer
+
+    def cancel(self, timer):
+        """Unschedule a timer returned by :meth:`schedule`, in O(1).
+
+        :param timer: Timer of the key.
+        :type timer: Timer
+        :rtype: bool, False if it had expired or was cancelled already
+        """
+        if timer.bucket is None:
+            return False
+        timer.bucket.discard(timer)
+        timer.bucket = None
+        self._count -= 1
+        return True
+
+    def _file(self, timer):
+        delta = timer.tick - self._tick
+        level = 0
+        while level < self.levels - 1 and delta >= self._spans[level + 1]:
+            level += 1
+        index = (timer.tick // self._spans[level]) % self.slots
+        timer.bucket = self._wheels[level][index]
+        timer.bucket.add(timer)
+
+    def advance(self, now=None):
+        """Move the wheel forward to now.
+
+        :param now: Current time in seconds, defaults to time.time().
+        :type now: float
+        :rtype: list of expired keys
+        """
+        target = self._to_tick(time.time() if now is None else now)
+        expired = []
+        while self._tick < target:
+            self._tick += 1
+            tick = self._tick
+
+            # Cascade the buckets whose span starts now, widest first, so
+            # keys falling into a narrower starting bucket cascade too
+            for level in xrange(self.levels - 1, 0, -1):
+                span = self._spans[level]
+                if tick % span:
+                    continue
+                bucket = self._wheels[level][(tick // span) % self.slots]
+                timers = list(bucket)
+                bucket.clear()
+                for timer in timers:
+                    if timer.tick <= tick:
+                        timer.bucket = None
+                        expired.append(timer.key)
+                        self._count -= 1
+                    else:
+                        self._file(timer)
+
+            bucket = self._wheels[0][tick % self.slots]
+            if bucket:
+                self._count -= len(bucket)
+                for timer in bucket:
+                    timer.bucket = None
+                    expired.append(timer.key)
+                bucket.clear()
+        return expired
@@ -1,14 +1,121 @@
+import os
 import string
 import urllib
 import urlparse
-from Crypto.Random import random
+from collections import deque
+
+from tornado.ioloop import IOLoop
 
 UNICODE_ASCII_CHARACTERS = (string.ascii_letters.decode('ascii') +
     string.digits.decode('ascii'))
 
+# Random bytes are mapped onto the alphabet by their value modulo its size.
+# Bytes from the largest multiple of that size up to 255 are dropped, as
+# keeping them would make the first characters more likely than the rest.
+_BYTE_LIMIT = 256 - 256 % len(UNICODE_ASCII_CHARACTERS)
+_BYTE_TO_CHARACTER = ''.join(
+    str(UNICODE_ASCII_CHARACTERS[i % len(UNICODE_ASCII_CHARACTERS)])
+    for i in xrange(256))
+_REJECTED_BYTES = ''.join(chr(i) for i in xrange(_BYTE_LIMIT, 256))
+
+
+# Letters of user codes, without vowels so that codes spell no words and
+# without the ones easily mistaken for each other
+USER_CODE_CHARACTERS = 'BCDFGHJKLMNPQRSTVWXZ'
+_USER_CODE_BYTE_LIMIT = 256 - 256 % len(USER_CODE_CHARACTERS)
+_USER_CODE_BYTE_TO_CHARACTER = ''.join(
+    USER_CODE_CHARACTERS[i % len(USER_CODE_CHARACTERS)] for i in xrange(256))
+_USER_CODE_REJECTED_BYTES = ''.join(
+    chr(i) for i in xrange(_USER_CODE_BYTE_LIMIT, 256))
+
+
+def _random_string(length, table, rejected):
+    chars = ''
+    while len(chars) < length:
+        # Draw one block with some headroom for the rejected bytes
+        block = os.urandom(length - len(chars) + length // 16 + 4)
+        chars += block.translate(table, rejected)
+    return chars[:length].decode('ascii')
+
 
 def random_ascii_string(length):
-    return ''.join([random.choice(UNICODE_ASCII_CHARACTERS) for x in xrange(length)])
+    """Return a random string of ASCII letters and digits.
+
+    :param length: Length of the string.
+    :type length: int
+    :rtype: unicode
+    """
+    return _random_string(length, _BYTE_TO_CHARACTER, _REJECTED_BYTES)
+
+
+def random_user_code(length=8):
+    """Return a random code for users to type, made of
+    USER_CODE_CHARACTERS.
+
+    :param length: Length of the code.
+    :type length: int
+    :rtype: unicode
+    """
+    return _random_string(length, _USER_CODE_BYTE_TO_CHARACTER,
+                          _USER_CODE_REJECTED_BYTES)
+
+
+def normalize_user_code(user_code):
+    """Return user_code as generated by :func:`random_user_code`, from
+    what a user typed: any case, with dashes or spaces.
+
+    :param user_code: User code as typed.
+    :type user_code: str
+    :rtype: str
+    """
+    return ''.join(c for c in user_code.upper() if c.isalnum())
+
+
+class TokenPool(object):
+    """Pool of pre-generated random tokens.
+
+    Tokens are generated in batches from a callback on the IOLoop once
+    the pool is half empty, so handing one out is a deque pop.
+    """
+
+    def __init__(self, length, size=1024, io_loop=None):
+        """
+        :param length: Length of the tokens.
+        :type length: int
+        :param size: Number of tokens kept ready.
+        :type size: int
+        """
+        self.length = length
+        self.size = size
+        self.io_loop = io_loop
+        self._tokens = deque()
+        self._refilling = False
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def get(self):
+        """Return an unused random token.
+
+        :rtype: unicode
+        """
+        if len(self._tokens) <= self.size // 2 and not self._refilling:
+            self._refilling = True
+            (self.io_loop or IOLoop.current()).add_callback(self.refill)
+
+        if self._tokens:
+            return self._tokens.popleft()
+        return random_ascii_string(self.length)
+
+    def refill(self):
+        """Fill the pool up to size with a single batch of randomness."""
+        self._refilling = False
+        count = self.size - len(self._tokens)
+        if count <= 0:
+            return
+        block = random_ascii_string(count * self.length)
+        self._tokens.extend(block[i:i + self.length]
+                            for i in xrange(0, len(block), self.length))
 
 
 def url_query_params(url):